@@ -5,7 +5,7 @@ Solo renderiza las páginas HTML (maquetado)
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from .routes import pages, video
+from .routes import pages, video, reports, admin
 import os
 
 # Obtener rutas absolutas
@@ -23,9 +23,11 @@ app = FastAPI(
 # Montar archivos estáticos (CSS, JS, imágenes)
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
-# Incluir rutas de páginas y video
+# Incluir rutas de páginas, video, reportes y administración
 app.include_router(pages.router)
 app.include_router(video.router, prefix="/api")
+app.include_router(reports.router, prefix="/api/reports")
+app.include_router(admin.router, prefix="/api/admin")
 
 # Ruta raíz redirige al dashboard
 @app.get("/")
@@ -33,6 +35,13 @@ async def root():
     from fastapi.responses import RedirectResponse
     return RedirectResponse(url="/dashboard")
 
+# Métricas en formato Prometheus (tiempos por etapa, frames, pool de detectores)
+@app.get("/metrics")
+async def metrics():
+    from fastapi.responses import PlainTextResponse
+    from backend.core.metrics import render_metrics
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,114 @@
+"""
+Rutas de administración: profiler por muestreo y traza del pipeline en el proceso en vivo,
+y reglas de cumplimiento vigentes
+"""
+import asyncio
+import hmac
+import os
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from dotenv import load_dotenv
+from backend.core.profiler import profiler, stage_tracer, PROFILER_MAX_SECONDS
+from backend.core.compliance_rules import rules_engine
+
+load_dotenv()
+
+# Token para las rutas de administración (cabecera X-Admin-Token); vacío = solo desde localhost
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+
+def require_admin(request: Request):
+    """Exige el token de administración (o una conexión local si no hay token configurado)"""
+    if ADMIN_TOKEN:
+        token = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(token, ADMIN_TOKEN):
+            raise HTTPException(status_code=401, detail="Token de administración inválido")
+    elif request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=403, detail="Solo disponible desde localhost (configure ADMIN_TOKEN)")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+def _filename(extension: str) -> str:
+    return f"perfil_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
+@router.post("/profiler/start")
+async def start_profiler(seconds: float = 30, interval_ms: Optional[float] = None, trace: bool = False,
+                         camera_id: Optional[int] = None):
+    """
+    Inicia el muestreo de todos los hilos durante N segundos
+
+    trace=true registra además cada etapa del pipeline con su camera_id
+    (camera_id limita la traza a una cámara)
+    """
+    if seconds <= 0 or seconds > PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds debe estar entre 0 y {PROFILER_MAX_SECONDS}")
+    try:
+        status = profiler.start(seconds, interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if trace:
+        stage_tracer.start(seconds, camera_id)
+    return {"success": True, "profiler": status, "trace": trace}
+
+
+@router.post("/profiler/stop")
+async def stop_profiler():
+    """Detiene el muestreo y la traza (los resultados quedan disponibles)"""
+    stage_tracer.stop()
+    status = await asyncio.to_thread(profiler.stop)
+    return {"success": True, "profiler": status}
+
+
+@router.get("/profiler/status")
+async def profiler_status():
+    return {"success": True, "profiler": profiler.status(), "trace_active": stage_tracer.active}
+
+
+@router.get("/profiler/collapsed")
+async def profiler_collapsed(thread: Optional[str] = None):
+    """Último perfil en formato de pilas colapsadas (flamegraph.pl, speedscope, inferno)"""
+    return PlainTextResponse(profiler.collapsed(thread),
+                             headers={"Content-Disposition": f'attachment; filename="{_filename("collapsed")}"'})
+
+
+@router.get("/profiler/profile")
+async def profile(seconds: float = 10, interval_ms: Optional[float] = None, thread: Optional[str] = None):
+    """Muestrea N segundos y devuelve directamente las pilas colapsadas"""
+    if seconds <= 0 or seconds > PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds debe estar entre 0 y {PROFILER_MAX_SECONDS}")
+    try:
+        profiler.start(seconds, interval_ms)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await asyncio.to_thread(profiler.wait)
+    return await profiler_collapsed(thread)
+
+
+@router.get("/profiler/trace")
+async def profiler_trace():
+    """Etapas registradas en formato Chrome trace (abrir en chrome://tracing o ui.perfetto.dev)"""
+    return JSONResponse(stage_tracer.chrome_trace(),
+                        headers={"Content-Disposition": f'attachment; filename="{_filename("trace.json")}"'})
+
+
+@router.get("/rules")
+async def compliance_rules():
+    """Reglas de cumplimiento compiladas por cámara (EPP obligatorio, umbrales, severidades)"""
+    return {"success": True, "rules": rules_engine.status()}
+
+
+@router.post("/rules/reload")
+async def reload_compliance_rules():
+    """
+    Recarga las reglas desde tipos_epp y configuracion_ia sin reiniciar los streams
+    (en modo workers, cada worker las recarga en su próximo intervalo)
+    """
+    if not await asyncio.to_thread(rules_engine.reload):
+        raise HTTPException(status_code=503, detail="No se pudieron leer las reglas de la base de datos")
+    return {"success": True, "rules": rules_engine.status()}
@@ -0,0 +1,123 @@
+"""
+Rutas de Reportes
+Solo leen las tablas de resumen (resumen_cumplimiento, resumen_faltas_epp)
+"""
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+from backend.core.compliance_rollup import compliance_rollup, GRANULARIDADES
+from backend.core.retention import retention_manager
+from backend.core.report_export import export_report, ExportError, FORMATOS
+from backend.core.logging_config import get_logger
+
+router = APIRouter()
+
+logger = get_logger("db")
+
+# Rango por defecto: últimas 24 horas
+DEFAULT_RANGE = timedelta(hours=24)
+
+
+def parse_range(desde: Optional[datetime], hasta: Optional[datetime], granularidad: Optional[str]) -> Tuple[datetime, datetime]:
+    """Valida el rango y la granularidad pedidos"""
+    if granularidad is not None and granularidad not in GRANULARIDADES:
+        raise HTTPException(status_code=400, detail=f"Granularidad inválida. Use: {', '.join(GRANULARIDADES)}")
+    hasta = hasta or datetime.now()
+    desde = desde or hasta - DEFAULT_RANGE
+    if desde >= hasta:
+        raise HTTPException(status_code=400, detail="'desde' debe ser anterior a 'hasta'")
+    return desde, hasta
+
+
+@router.get("/cumplimiento/serie")
+async def compliance_series(desde: datetime = None, hasta: datetime = None, granularidad: str = None,
+                            camera_id: int = None, zona: str = None):
+    """Serie temporal de cumplimiento y alertas (por minuto, hora o día)"""
+    desde, hasta = parse_range(desde, hasta, granularidad)
+    try:
+        result = await run_in_threadpool(compliance_rollup.series, desde, hasta, granularidad, camera_id, zona)
+        return {"success": True, "desde": desde.isoformat(), "hasta": hasta.isoformat(), **result}
+    except Exception as e:
+        logger.error("Error en serie de cumplimiento: %s", e)
+        return {"success": False, "serie": [], "error": str(e)}
+
+
+@router.get("/cumplimiento/camaras")
+async def compliance_by_camera(desde: datetime = None, hasta: datetime = None, granularidad: str = None,
+                               zona: str = None):
+    """Cumplimiento y alertas del rango por cámara"""
+    desde, hasta = parse_range(desde, hasta, granularidad)
+    try:
+        cameras = await run_in_threadpool(compliance_rollup.by_camera, desde, hasta, granularidad, zona)
+        return {"success": True, "camaras": cameras}
+    except Exception as e:
+        logger.error("Error en cumplimiento por cámara: %s", e)
+        return {"success": False, "camaras": [], "error": str(e)}
+
+
+@router.get("/cumplimiento/zonas")
+async def compliance_by_zone(desde: datetime = None, hasta: datetime = None, granularidad: str = None):
+    """Cumplimiento y alertas del rango por zona"""
+    desde, hasta = parse_range(desde, hasta, granularidad)
+    try:
+        zonas = await run_in_threadpool(compliance_rollup.by_zone, desde, hasta, granularidad)
+        return {"success": True, "zonas": zonas}
+    except Exception as e:
+        logger.error("Error en cumplimiento por zona: %s", e)
+        return {"success": False, "zonas": [], "error": str(e)}
+
+
+@router.get("/cumplimiento/epp")
+async def missing_epp(desde: datetime = None, hasta: datetime = None, granularidad: str = None,
+                      camera_id: int = None, zona: str = None):
+    """EPP faltantes en el rango (muestras sin cada tipo de EPP)"""
+    desde, hasta = parse_range(desde, hasta, granularidad)
+    try:
+        epp = await run_in_threadpool(compliance_rollup.missing_epp, desde, hasta, granularidad, camera_id, zona)
+        return {"success": True, "epp": epp}
+    except Exception as e:
+        logger.error("Error en EPP faltantes: %s", e)
+        return {"success": False, "epp": [], "error": str(e)}
+
+
+@router.get("/export")
+async def export(dataset: str = "alertas", formato: str = "csv", desde: datetime = None, hasta: datetime = None,
+                 camera_id: int = None, zona: str = None, tipo: str = None, severidad: str = None,
+                 estado: str = None):
+    """
+    Exporta alertas o detecciones en CSV, Parquet o XLSX (en streaming, sin cargar todo en memoria)
+    
+    Filtros: rango de fechas, cámara, zona y, para alertas, tipo/severidad/estado
+    (para detecciones, estado = C/I/N)
+    """
+    if desde is not None and hasta is not None and desde >= hasta:
+        raise HTTPException(status_code=400, detail="'desde' debe ser anterior a 'hasta'")
+    filters = dict(desde=desde, hasta=hasta, camera_id=camera_id, zona=zona, tipo=tipo,
+                   severidad=severidad, estado=estado)
+    try:
+        content = export_report(dataset, formato, filters)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    media_type, extension = FORMATOS[formato]
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return StreamingResponse(content, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.on_event("startup")
+async def startup_event():
+    """Inicia la retención periódica del historial"""
+    retention_manager.start()
+
+
+@router.on_event("shutdown")
+async def shutdown_event():
+    """Escribe los resúmenes pendientes y detiene la retención al cerrar la aplicación"""
+    retention_manager.stop()
+    compliance_rollup.stop()
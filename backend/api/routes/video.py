@@ -1,164 +1,291 @@
 """
 Rutas de Video Streaming
 """
-from fastapi import APIRouter, Response, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import APIRouter, Response, HTTPException, UploadFile, File, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, JSONResponse, RedirectResponse, FileResponse
 from pydantic import BaseModel
+import asyncio
 import cv2
 import time
 import sys
 import os
 import uuid
-import shutil
+import hashlib
+from datetime import datetime
 from pathlib import Path
+from typing import List, Optional
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from backend.core.camera_config import camera_manager
+from backend.core.stream_hub import StreamHub
+from backend.core.camera_workers import WorkerStreamHub, CAMERA_WORKERS
+from backend.core.camera_source import create_source, record_camera_state, usb_backend
+from backend.core.inference_scheduler import inference_scheduler
+from backend.core import metrics
+from backend.core.logging_config import get_logger
+from backend.core.jpeg_encoder import AdaptiveEncodeController
+from backend.core.hls_streamer import hls_manager, ffmpeg_available
+from backend.core.result_cache import result_cache, VideoResultSource
+from backend.core.video_jobs import VideoJobRegistry, JobProgress
+from backend.core.chunked_upload import (ChunkedUploadManager, UploadError, probe_video,
+                                         ALLOWED_EXTENSIONS, MAX_UPLOAD_BYTES, WRITE_BUFFER_SIZE)
 
 router = APIRouter()
 
+logger = get_logger("video")
+
 # Diccionario para cámaras activas
 active_cameras = {}
 
-# Diccionario para videos en procesamiento
-active_videos = {}
-
 # Directorio temporal para videos
 TEMP_VIDEO_DIR = Path("backend/temp_videos")
 TEMP_VIDEO_DIR.mkdir(exist_ok=True)
 
-# Detector EPP global (se carga bajo demanda)
-epp_detector = None
+# Registro de videos subidos (en base de datos, compartido entre workers)
+video_jobs = VideoJobRegistry(TEMP_VIDEO_DIR)
+
+# Subidas por partes (reanudables)
+upload_manager = ChunkedUploadManager(TEMP_VIDEO_DIR)
+
+# Pool de detectores EPP global (se carga bajo demanda)
+epp_pool = None
 
 class CameraAddRequest(BaseModel):
-    physical_id: int
+    physical_id: Optional[int] = None
+    fuente: Optional[str] = None  # rtsp://, http(s)://, usb:N o ruta de video
     nombre: str
     zona: str
 
 class CameraUpdateRequest(BaseModel):
     nombre: str
     zona: str
+    fuente: Optional[str] = None
+
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int
+
+class AlertReviewRequest(BaseModel):
+    estado: str  # revisada, resuelta, descartada o pendiente
+    ids: Optional[List[int]] = None
+    camera_id: Optional[int] = None
+    tipo: Optional[str] = None
+    desde: Optional[datetime] = None
+    hasta: Optional[datetime] = None
+    estado_actual: Optional[str] = None
+    revisada_por: Optional[str] = None
+    notas: Optional[str] = None
 
 def get_camera(camera_id: int):
     """Obtiene una instancia de cámara usando el ID de cámara configurada"""
     if camera_id in active_cameras and active_cameras[camera_id] is not None:
         return active_cameras[camera_id]
     
-    # Obtener configuración de la cámara
-    cam_config = camera_manager.get_camera_by_id(camera_id)
+    # Obtener configuración de la cámara (con la URL completa de la fuente)
+    cam_config = camera_manager.get_camera_by_id(camera_id, redact=False)
     if cam_config is None:
         return None
     
-    physical_id = cam_config['physical_id']
-    
-    print(f"[VIDEO] Intentando abrir cámara física ID={physical_id} (Camera DB ID={camera_id})")
+    # USB, RTSP/HTTP o archivo según la fuente configurada
+    source = create_source(cam_config, on_state=record_camera_state)
+    logger.info("Intentando abrir %s (Camera DB ID=%s)", source.describe(), camera_id)
     
-    # Crear nueva instancia de cámara
-    cap = cv2.VideoCapture(physical_id, cv2.CAP_DSHOW)
-    
-    if not cap.isOpened():
-        print(f"[VIDEO ERROR] No se pudo abrir cámara física ID={physical_id}. Puede estar en uso por otra aplicación.")
+    if not source.open():
+        logger.error("No se pudo abrir %s. Puede estar en uso por otra aplicación o fuera de línea.",
+                     source.describe(), extra={'camera_id': camera_id, 'rate_key': camera_id})
         return None
     
-    # Configurar resolución
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    cap.set(cv2.CAP_PROP_FPS, 30)
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    
-    print(f"[VIDEO OK] Cámara física ID={physical_id} abierta correctamente")
-    active_cameras[camera_id] = cap
-    return cap
+    logger.info("%s abierta correctamente", source.describe())
+    active_cameras[camera_id] = source
+    return source
 
-def generate_frames(camera_id: int, enable_detection: bool = False):
-    """Genera frames de video para streaming MJPEG"""
-    global epp_detector
+def release_capture(camera_id: int):
+    """Libera la captura física de una cámara (la llama el hub al cerrar un stream)"""
+    cap = active_cameras.pop(camera_id, None)
+    if cap is not None:
+        cap.release()
+
+# Hub de streams: una captura y una detección por cámara, compartidas por todos los clientes
+# (con CAMERA_WORKERS > 0, captura e inferencia corren en procesos worker)
+if CAMERA_WORKERS > 0:
+    stream_hub = WorkerStreamHub()
+    metrics.REGISTRY.add_collector(stream_hub.supervisor.collect_metrics)
+else:
+    stream_hub = StreamHub(open_capture=get_camera, release_capture=release_capture)
+    metrics.REGISTRY.add_collector(inference_scheduler.collect_metrics)
+metrics.REGISTRY.add_collector(stream_hub.collect_metrics)
+metrics.REGISTRY.add_collector(lambda: metrics.HLS_SESSIONS.set(hls_manager.active_count()))
+
+def generate_frames(camera_id: int, enable_detection: bool = False, overlay: str = "server",
+                    encoder: AdaptiveEncodeController = None):
+    """
+    Genera frames de video para streaming MJPEG
     
-    camera = get_camera(camera_id)
+    Args:
+        camera_id: ID de la cámara configurada
+        enable_detection: Si True, se ejecuta la detección EPP
+        overlay: 'server' dibuja las detecciones en el frame;
+                 'client' envía frames sin tocar (el navegador dibuja con /stream/{id}/detections)
+        encoder: Parámetros de codificación del cliente (ancho, calidad, fps, modo automático)
+    """
+    encoder = encoder or AdaptiveEncodeController()
+    draw_on_server = enable_detection and overlay == "server"
+    stream = stream_hub.subscribe(camera_id, detect=draw_on_server)
     
-    if camera is None:
-        print(f"[VIDEO ERROR] No se pudo obtener cámara para streaming (camera_id={camera_id})")
+    if stream is None:
+        logger.error("No se pudo obtener cámara para streaming (camera_id=%s)", camera_id,
+                     extra={'camera_id': camera_id, 'rate_key': camera_id})
         # Generar frame de error
         yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + b'\xff\xd8\xff\xe0' + b'\r\n'
         return
     
-    # Cargar detector si está habilitada la detección
-    if enable_detection and epp_detector is None:
-        try:
-            print("[INFO] Cargando modelo EPP por primera vez...")
-            # Import relativo desde la estructura del proyecto
-            import sys
-            import os
-            project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-            sys.path.insert(0, project_root)
-            
-            from backend.core.epp_detector import EPPDetector
-            epp_detector = EPPDetector(model_path="models/best.pt")
-            print("[INFO] Modelo EPP cargado exitosamente")
-        except Exception as e:
-            print(f"[ERROR] No se pudo cargar modelo EPP: {e}")
-            import traceback
-            traceback.print_exc()
-            enable_detection = False
+    logger.info("Iniciando streaming para camera_id=%s (detección=%s, overlay=%s)",
+                camera_id, 'ON' if enable_detection else 'OFF', overlay, extra={'camera_id': camera_id})
     
-    print(f"[VIDEO] Iniciando streaming para camera_id={camera_id} (detección={'ON' if enable_detection else 'OFF'})")
+    last_seq = 0
+    last_sent = 0.0
+    frame_bytes = None
+    try:
+        while True:
+            # Respetar max_fps del cliente
+            if encoder.min_interval:
+                remaining = last_sent + encoder.min_interval - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+            
+            item = stream.wait_frame(last_seq)
+            if item is None:
+                # Cámara reconectándose: reenviar el último frame para que el navegador no corte
+                if stream.running and frame_bytes is not None:
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+                    continue
+                break
+            seq, frame = item
+            skipped = seq - last_seq - 1 if last_seq else 0
+            last_seq = seq
+            if skipped > 0:
+                metrics.FRAMES_DROPPED.inc(camera_id, "cliente", amount=skipped)
+            
+            # El slot del anillo se retiene solo mientras se dibuja y codifica (no durante el envío)
+            with item:
+                # Dibujar la última detección (una sola vez por frame para todos los clientes)
+                if draw_on_server:
+                    rendered = stream.render(seq, frame)
+                else:
+                    rendered = item
+                with rendered:
+                    # Convertir a JPEG (compartido entre clientes con la misma variante)
+                    width, quality = encoder.current(rendered.frame.shape[1])
+                    frame_bytes = stream.encode(seq, rendered.frame, width, quality, annotated=draw_on_server)
+            if frame_bytes is None:
+                continue
+            
+            # Yield frame en formato multipart
+            last_sent = time.monotonic()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            
+            # El generador se reanuda cuando el frame anterior ya se envió al cliente
+            encoder.report(time.monotonic() - last_sent, skipped)
+    finally:
+        stream_hub.unsubscribe(stream, detect=draw_on_server)
+
+def generate_detection_events(camera_id: int):
+    """Genera eventos SSE con la detección compacta de cada frame analizado"""
+    stream = stream_hub.subscribe(camera_id, detect=True)
     
-    # Contador de frames para no guardar cada frame (solo cada 30 frames = ~1 seg)
-    frame_count = 0
-    last_alert_time = 0
+    if stream is None:
+        yield 'event: error\ndata: {"error": "camara_no_disponible"}\n\n'
+        return
     
-    while True:
-        success, frame = camera.read()
-        if not success:
-            print(f"[VIDEO ERROR] No se pudo leer frame de camera_id={camera_id}")
-            break
-        
-        # Procesar con detector EPP si está habilitado
-        if enable_detection and epp_detector is not None:
-            try:
-                frame, detections, compliance = epp_detector.process_frame(frame, draw=True)
-                
-                # Guardar detección y generar alerta solo cada 30 frames y si hay incumplimiento
-                frame_count += 1
-                current_time = time.time()
-                
-                if frame_count % 30 == 0 and compliance['estado'] != 'C':
-                    # Evitar spam de alertas (mínimo 5 segundos entre alertas de la misma cámara)
-                    if current_time - last_alert_time > 5:
-                        try:
-                            from backend.core.alert_manager import alert_manager
-                            
-                            # Guardar detección en BD con snapshot
-                            deteccion_id = alert_manager.save_detection(camera_id, detections, compliance, frame=frame)
-                            
-                            # Generar alerta
-                            if deteccion_id:
-                                alert_manager.generate_alert(camera_id, deteccion_id, compliance)
-                                last_alert_time = current_time
-                        except Exception as e:
-                            print(f"[ERROR] Error guardando detección/alerta: {e}")
-                
-            except Exception as e:
-                print(f"[ERROR] Error en detección EPP: {e}")
-        
-        # Convertir a JPEG
-        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        if not ret:
-            continue
-        
-        frame_bytes = buffer.tobytes()
-        
-        # Yield frame en formato multipart
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    version = 0
+    try:
+        while True:
+            item = stream.wait_result(version)
+            if item is None:
+                yield 'event: end\ndata: {}\n\n'
+                break
+            version, payload = item
+            if payload is None:
+                # Mantener viva la conexión mientras no hay detecciones nuevas
+                yield ': keepalive\n\n'
+                continue
+            yield f'data: {payload}\n\n'
+    finally:
+        stream_hub.unsubscribe(stream, detect=True)
 
 @router.get("/stream/{camera_id}")
-async def video_stream(camera_id: int, detect: bool = False):
-    """Endpoint de streaming de video para una cámara configurada"""
+async def video_stream(camera_id: int, detect: bool = False, overlay: str = "server",
+                       width: int = None, quality: int = None, max_fps: float = None, auto: bool = False,
+                       format: str = "mjpeg"):
+    """
+    Endpoint de streaming de video para una cámara configurada
+    
+    width/quality/max_fps ajustan la codificación para el tamaño en que se muestra el stream;
+    auto=true baja calidad o resolución si el cliente no alcanza a recibir los frames.
+    format=hls redirige a la playlist HLS (H.264) de la cámara en lugar de MJPEG.
+    """
+    if overlay not in ("server", "client"):
+        raise HTTPException(status_code=400, detail="overlay debe ser 'server' o 'client'")
+    if format == "hls":
+        return start_camera_hls(camera_id, annotate=detect and overlay == "server", width=width)
+    if format != "mjpeg":
+        raise HTTPException(status_code=400, detail="format debe ser 'mjpeg' o 'hls'")
+    encoder = AdaptiveEncodeController(width=width, quality=quality, max_fps=max_fps, auto=auto)
     return StreamingResponse(
-        generate_frames(camera_id, enable_detection=detect),
+        generate_frames(camera_id, enable_detection=detect, overlay=overlay, encoder=encoder),
         media_type="multipart/x-mixed-replace; boundary=frame"
     )
 
+@router.get("/stream/{camera_id}/detections")
+async def detection_events(camera_id: int):
+    """Canal SSE con las detecciones por frame (bboxes, clases, cumplimiento, seq)"""
+    return StreamingResponse(
+        generate_detection_events(camera_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ==================== STREAMING HLS (H.264) ====================
+
+def start_camera_hls(camera_id: int, annotate: bool = False, width: int = None):
+    """Inicia (o reutiliza) la sesión HLS de una cámara y redirige a su playlist"""
+    if not ffmpeg_available():
+        raise HTTPException(status_code=503, detail="FFmpeg no está instalado en el servidor")
+    if camera_manager.get_camera_by_id(camera_id) is None:
+        raise HTTPException(status_code=404, detail="Cámara no encontrada")
+    session = hls_manager.camera_session(stream_hub, camera_id, annotate=annotate, width=width)
+    return RedirectResponse(url=f"/api/hls/{session.key}/index.m3u8", status_code=307)
+
+@router.get("/hls/camera/{camera_id}")
+async def camera_hls(camera_id: int, detect: bool = False, width: int = None):
+    """Stream HLS (segmentos fMP4 H.264) de una cámara, alternativa de bajo ancho de banda a MJPEG"""
+    return start_camera_hls(camera_id, annotate=detect, width=width)
+
+@router.get("/hls/{session_key}/{filename}")
+async def hls_file(session_key: str, filename: str):
+    """Sirve la playlist y los segmentos de una sesión HLS"""
+    resolved = hls_manager.resolve_file(session_key, filename)
+    if resolved is None:
+        raise HTTPException(status_code=404, detail="Archivo HLS no encontrado")
+    path, media_type = resolved
+    session = hls_manager.get_session(session_key)
+    
+    # La playlist y el init aparecen cuando FFmpeg cierra el primer segmento
+    deadline = time.monotonic() + 15
+    while not path.exists() and time.monotonic() < deadline:
+        if session is None or (not session.running and not session.finished):
+            break
+        await asyncio.sleep(0.25)
+    
+    if not path.exists():
+        detail = session.error if session is not None and session.error else "Segmento no disponible"
+        raise HTTPException(status_code=404, detail=detail)
+    
+    headers = {"Cache-Control": "no-cache"} if filename.endswith(".m3u8") else {}
+    return FileResponse(path, media_type=media_type, headers=headers)
+
 @router.get("/cameras/configured")
 async def list_configured_cameras():
     """Lista todas las cámaras configuradas por el usuario"""
@@ -179,7 +306,7 @@ async def list_physical_cameras():
     
     # Detectar cámaras físicas disponibles (IDs 0-10)
     for cam_id in range(11):
-        cap = cv2.VideoCapture(cam_id, cv2.CAP_DSHOW)
+        cap = cv2.VideoCapture(cam_id, usb_backend())
         if cap.isOpened():
             # Obtener información de la cámara
             width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -200,28 +327,31 @@ async def list_physical_cameras():
 @router.post("/cameras/add")
 async def add_camera(request: CameraAddRequest):
     """Agrega una nueva cámara configurada"""
+    if request.physical_id is None and not (request.fuente or "").strip():
+        raise HTTPException(status_code=400, detail="Indique physical_id o fuente")
     try:
-        print(f"[DEBUG] Intentando agregar cámara: physical_id={request.physical_id}, nombre={request.nombre}, zona={request.zona}")
+        logger.debug("Intentando agregar cámara: physical_id=%s, nombre=%s, zona=%s",
+                     request.physical_id, request.nombre, request.zona)
         camera = camera_manager.add_camera(
             physical_id=request.physical_id,
             nombre=request.nombre,
-            zona=request.zona
+            zona=request.zona,
+            fuente=request.fuente
         )
-        print(f"[DEBUG] Cámara agregada exitosamente: {camera}")
+        logger.debug("Cámara agregada exitosamente: %s", camera)
         return {"success": True, "camera": camera}
     except ValueError as e:
-        print(f"[ERROR] ValueError: {str(e)}")
+        logger.warning("No se pudo agregar la cámara: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"[ERROR] Error inesperado: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error inesperado agregando cámara: %s", e)
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 @router.delete("/cameras/{camera_id}")
 async def delete_camera(camera_id: int):
     """Elimina una cámara configurada"""
-    # Liberar la cámara si está activa
+    # Detener el stream y liberar la cámara si está activa
+    stream_hub.stop(camera_id)
     if camera_id in active_cameras:
         if active_cameras[camera_id] is not None:
             active_cameras[camera_id].release()
@@ -236,20 +366,34 @@ async def delete_camera(camera_id: int):
 @router.put("/cameras/{camera_id}")
 async def update_camera(camera_id: int, request: CameraUpdateRequest):
     """Actualiza los datos de una cámara configurada"""
-    camera = camera_manager.update_camera(
-        camera_id=camera_id,
-        nombre=request.nombre,
-        zona=request.zona
-    )
+    previous = camera_manager.get_camera_by_id(camera_id, redact=False)
+    try:
+        camera = camera_manager.update_camera(
+            camera_id=camera_id,
+            nombre=request.nombre,
+            zona=request.zona,
+            fuente=request.fuente
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     if camera is None:
         raise HTTPException(status_code=404, detail="Cámara no encontrada")
     
+    # Fuente nueva: cerrar la captura abierta con la anterior (los clientes vuelven a conectar)
+    if request.fuente is not None and previous is not None and (request.fuente.strip() or None) != previous['fuente']:
+        stream_hub.stop(camera_id)
+        if camera_id in active_cameras:
+            if active_cameras[camera_id] is not None:
+                active_cameras[camera_id].release()
+            del active_cameras[camera_id]
+    
     return {"success": True, "camera": camera}
 
 @router.post("/camera/release/{camera_id}")
 async def release_camera(camera_id: int):
     """Libera una cámara específica"""
+    stream_hub.stop(camera_id)
     if camera_id in active_cameras:
         if active_cameras[camera_id] is not None:
             active_cameras[camera_id].release()
@@ -257,14 +401,51 @@ async def release_camera(camera_id: int):
         return {"message": f"Cámara {camera_id} liberada"}
     return {"message": "Cámara no estaba en uso"}
 
+@router.on_event("startup")
+async def startup_event():
+    """Inicia la limpieza periódica de videos temporales vencidos (y los workers, si están activos)"""
+    video_jobs.start_gc(on_expire=hls_manager.remove_video)
+    # Sembrar los conteos de alertas (los sondeos de /alerts/count no consultan la BD)
+    from backend.core.alert_counters import alert_counters
+    await run_in_threadpool(alert_counters.reconcile)
+    if isinstance(stream_hub, WorkerStreamHub):
+        stream_hub.supervisor.start()
+
 @router.on_event("shutdown")
 async def shutdown_event():
     """Libera todas las cámaras al cerrar la aplicación"""
+    stream_hub.stop_all()
     for cam in active_cameras.values():
         if cam is not None:
             cam.release()
     active_cameras.clear()
 
+@router.get("/detector/pool")
+async def get_detector_pool_stats():
+    """Obtiene uso y tiempos de espera del pool de detectores EPP"""
+    from backend.core.detector_pool import get_loaded_pool
+    pool = get_loaded_pool()
+    if pool is None:
+        return {"success": True, "loaded": False, "pool": None}
+    return {"success": True, "loaded": True, "pool": pool.get_stats()}
+
+@router.get("/detector/workers")
+async def get_workers_status():
+    """Estado de los procesos worker de captura/inferencia (modo CAMERA_WORKERS)"""
+    if not isinstance(stream_hub, WorkerStreamHub):
+        return {"success": True, "enabled": False, "workers": []}
+    return {"success": True, "enabled": True, "workers": stream_hub.supervisor.status()}
+
+@router.get("/detector/schedule")
+async def get_inference_schedule():
+    """
+    Reparto del presupuesto de inferencias entre las cámaras con detección activa
+    (prioridad y fps_procesamiento de las reglas; en modo workers, uno por worker)
+    """
+    if isinstance(stream_hub, WorkerStreamHub):
+        return {"success": True, "workers": stream_hub.supervisor.schedules()}
+    return {"success": True, "schedule": inference_scheduler.allocation()}
+
 @router.get("/alerts/recent")
 async def get_recent_alerts(limit: int = 10):
     """Obtiene las alertas más recientes"""
@@ -279,6 +460,30 @@ async def get_alerts_count(estado: str = "pendiente"):
     count = alert_manager.get_alerts_count(estado=estado)
     return {"success": True, "count": count}
 
+@router.post("/alerts/review")
+async def review_alerts(request: AlertReviewRequest):
+    """
+    Revisión masiva: cambia el estado de las alertas indicadas por IDs o por filtro
+    (cámara, tipo, rango de fechas; por defecto solo las pendientes) con un UPDATE por lote
+    """
+    from backend.core.alert_manager import alert_manager
+    try:
+        result = await run_in_threadpool(
+            alert_manager.review_alerts, request.estado, ids=request.ids, camera_id=request.camera_id,
+            tipo=request.tipo, desde=request.desde, hasta=request.hasta, estado_actual=request.estado_actual,
+            revisada_por=request.revisada_por, notas=request.notas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error revisando alertas: {e}")
+    return {"success": True, **result}
+
+@router.get("/alerts/summary")
+async def get_alerts_summary():
+    """Conteos de alertas por estado, severidad, cámara y del día (en memoria, sin consultar la BD)"""
+    from backend.core.alert_counters import alert_counters
+    return {"success": True, **alert_counters.summary()}
+
 @router.get("/alerts/history")
 async def get_alerts_history(limit: int = 50, tipo: str = None, camera_id: int = None):
     """Obtiene historial completo de alertas con filtros"""
@@ -311,12 +516,14 @@ async def get_alerts_history(limit: int = 50, tipo: str = None, camera_id: int =
                 'severidad': alerta.severidad,
                 'mensaje': alerta.mensaje,
                 'estado': alerta.estado,
+                'ocurrencias': alerta.ocurrencias or 1,
+                'ultima_ocurrencia': alerta.ultima_ocurrencia.strftime('%d/%m/%Y %H:%M') if alerta.ultima_ocurrencia else '',
                 'imagen_path': alerta.deteccion.imagen_path if alerta.deteccion and alerta.deteccion.imagen_path else None
             })
         
         return {"success": True, "alerts": result}
     except Exception as e:
-        print(f"[ERROR] Error en historial: {e}")
+        logger.error("Error en historial: %s", e)
         return {"success": False, "alerts": [], "error": str(e)}
     finally:
         db.close()
@@ -329,130 +536,259 @@ async def upload_video(file: UploadFile = File(...)):
     """Recibe un video para procesamiento temporal"""
     try:
         # Validar extensión
-        allowed_extensions = ['.mp4', '.avi', '.mov', '.mkv']
         file_extension = Path(file.filename).suffix.lower()
         
-        if file_extension not in allowed_extensions:
-            raise HTTPException(status_code=400, detail=f"Formato no soportado. Use: {', '.join(allowed_extensions)}")
+        if file_extension not in ALLOWED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"Formato no soportado. Use: {', '.join(ALLOWED_EXTENSIONS)}")
         
         # Generar ID único para el video
         video_id = str(uuid.uuid4())
         video_path = TEMP_VIDEO_DIR / f"{video_id}{file_extension}"
         
-        # Guardar archivo temporalmente
+        # Guardar archivo temporalmente (en bloques, con límite de tamaño)
+        written = 0
+        content_hash = hashlib.sha256()
         with video_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Obtener información del video
-        cap = cv2.VideoCapture(str(video_path))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        duration = total_frames / fps if fps > 0 else 0
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        cap.release()
+            while True:
+                data = await file.read(WRITE_BUFFER_SIZE)
+                if not data:
+                    break
+                written += len(data)
+                if written > MAX_UPLOAD_BYTES:
+                    break
+                content_hash.update(data)
+                await run_in_threadpool(buffer.write, data)
         
-        # Almacenar en diccionario de videos activos
-        active_videos[video_id] = {
-            'path': str(video_path),
-            'filename': file.filename,
-            'total_frames': total_frames,
-            'fps': fps,
-            'duration': duration,
-            'width': width,
-            'height': height,
-            'stats': {
-                'frames_procesados': 0,
-                'detecciones_totales': 0,
-                'personas_detectadas': 0,
-                'epp_incorrecto': 0
-            }
-        }
+        if written > MAX_UPLOAD_BYTES:
+            video_path.unlink()
+            raise HTTPException(status_code=413, detail=f"El archivo supera el máximo de {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
         
-        print(f"[VIDEO UPLOAD] {file.filename} guardado como {video_id} ({duration:.1f}s, {total_frames} frames)")
+        # Obtener información del video
+        metadata = await run_in_threadpool(probe_video, str(video_path))
+        if metadata is None:
+            video_path.unlink()
+            raise HTTPException(status_code=422, detail="No se pudo leer el video")
         
-        return {
-            "success": True,
-            "video_id": video_id,
-            "filename": file.filename,
-            "duration": round(duration, 2),
-            "total_frames": total_frames,
-            "fps": round(fps, 2),
-            "resolution": f"{width}x{height}"
-        }
+        video_info = await run_in_threadpool(
+            register_video, video_id, str(video_path), file.filename, metadata,
+            content_hash=content_hash.hexdigest()
+        )
+        return video_response(video_info)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Upload video: {e}")
+        logger.exception("Error subiendo video: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def register_video(video_id: str, path: str, filename: str, metadata: dict, upload_complete: bool = True,
+                   content_hash: str = None) -> dict:
+    """Registra (o actualiza) un video en el registro de trabajos"""
+    video_info = video_jobs.register(video_id, path, filename, metadata, upload_complete, content_hash)
+    
+    estado = "guardado" if upload_complete else "disponible (subida en curso)"
+    logger.info("%s %s como %s (%.1fs, %s frames)", filename, estado, video_id, metadata['duration'],
+                metadata['total_frames'], extra={'video_id': video_id})
+    return video_info
+
+
+def get_video_or_404(video_id: str) -> dict:
+    """Información de un video registrado (404 si no existe o ya venció)"""
+    video_info = video_jobs.get(video_id)
+    if video_info is None:
+        raise HTTPException(status_code=404, detail="Video no encontrado")
+    return video_info
+
+
+def video_response(video_info: dict) -> dict:
+    """Respuesta estándar con la información de un video registrado"""
+    return {
+        "success": True,
+        "video_id": video_info['video_id'],
+        "filename": video_info['filename'],
+        "duration": round(video_info['duration'], 2),
+        "total_frames": video_info['total_frames'],
+        "fps": round(video_info['fps'], 2),
+        "resolution": f"{video_info['width']}x{video_info['height']}",
+        "upload_complete": video_info.get('upload_complete', True)
+    }
+
+
+def upload_error_response(error: UploadError) -> JSONResponse:
+    """Error de subida con el offset desde el que el cliente debe reanudar"""
+    return JSONResponse(
+        status_code=error.status_code,
+        content={"success": False, "detail": str(error), "offset": error.offset}
+    )
+
+
+@router.post("/videos/upload/init")
+async def init_chunked_upload(request: UploadInitRequest):
+    """Inicia una subida por partes: devuelve upload_id y tamaño de chunk recomendado"""
+    try:
+        session = upload_manager.init_upload(request.filename, request.size)
+    except UploadError as e:
+        return upload_error_response(e)
+    return {"success": True, **session.to_dict()}
+
+
+@router.put("/videos/upload/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    """
+    Recibe un chunk (cuerpo binario) en el offset indicado
+    
+    Si el offset no coincide responde 409 con el offset correcto para reanudar; si aún se
+    está recibiendo un chunk anterior de la misma subida, 423 (reintentar con espera).
+    En cuanto se pueden leer los metadatos, el video queda disponible para analizar
+    el prefijo ya subido (video_id en la respuesta).
+    """
+    try:
+        writer = upload_manager.open_chunk(upload_id, offset)
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    try:
+        with writer:
+            async for data in request.stream():
+                if writer.feed(data):
+                    await run_in_threadpool(writer.write_buffer)
+            await run_in_threadpool(writer.flush)
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    session = writer.session
+    already_probed = session.metadata is not None
+    metadata = await run_in_threadpool(writer.probe_if_due)
+    if metadata is not None and not already_probed:
+        await run_in_threadpool(register_video, upload_id, str(session.path), session.filename, metadata,
+                                upload_complete=False)
+    
+    return {"success": True, **session.to_dict(), "video_id": upload_id if metadata is not None else None}
+
+
+@router.get("/videos/upload/{upload_id}")
+async def get_upload_status(upload_id: str):
+    """Estado de una subida (offset recibido, para reanudar)"""
+    try:
+        session = upload_manager.get_session(upload_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    return {"success": True, **session.to_dict()}
+
+
+@router.post("/videos/upload/{upload_id}/complete")
+async def complete_chunked_upload(upload_id: str):
+    """Cierra la subida y deja el video listo para procesar"""
+    try:
+        session = await run_in_threadpool(upload_manager.complete, upload_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    video_info = await run_in_threadpool(register_video, upload_id, str(session.path), session.filename,
+                                         session.metadata, content_hash=session.content_hash)
+    upload_manager.forget(upload_id)
+    return video_response(video_info)
+
+
+@router.delete("/videos/upload/{upload_id}")
+async def abort_chunked_upload(upload_id: str):
+    """Cancela una subida y borra el archivo parcial"""
+    try:
+        upload_manager.abort(upload_id)
+    except UploadError as e:
+        return upload_error_response(e)
+    await run_in_threadpool(video_jobs.delete, upload_id)
+    return {"success": True}
+
+
 @router.get("/videos/stream/{video_id}")
 async def stream_video_with_detection(video_id: str):
     """Stream de video con detección EPP en tiempo real"""
     
-    if video_id not in active_videos:
-        raise HTTPException(status_code=404, detail="Video no encontrado")
+    video_info = await run_in_threadpool(get_video_or_404, video_id)
     
     def generate_video_frames():
-        global epp_detector
+        global epp_pool
         
-        video_info = active_videos.get(video_id)
-        if not video_info:
-            print(f"[ERROR] Video {video_id} no encontrado en active_videos")
-            return
-            
         video_path = video_info['path']
-        print(f"[VIDEO] Iniciando stream para: {video_info['filename']}")
+        logger.info("Iniciando stream para: %s", video_info['filename'], extra={'video_id': video_id})
         
         # Cargar detector si no existe
-        if epp_detector is None:
+        if epp_pool is None:
             try:
-                print("[INFO] Cargando modelo EPP para procesamiento de video...")
+                logger.info("Cargando modelo EPP para procesamiento de video...")
                 import sys
                 import os
                 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
                 sys.path.insert(0, project_root)
-                from backend.core.epp_detector import EPPDetector
-                epp_detector = EPPDetector()
-                print("[INFO] Modelo EPP cargado exitosamente para video")
+                from backend.core.detector_pool import get_detector_pool
+                epp_pool = get_detector_pool()
+                logger.info("Modelo EPP cargado exitosamente para video")
             except Exception as e:
-                print(f"[ERROR] Error cargando modelo EPP: {e}")
-                import traceback
-                traceback.print_exc()
+                get_logger("detector").exception(f"Error cargando modelo EPP: {e}")
         
         cap = cv2.VideoCapture(video_path)
         
         if not cap.isOpened():
-            print(f"[ERROR] No se pudo abrir video: {video_path}")
+            logger.error("No se pudo abrir video: %s", video_path, extra={'video_id': video_id})
             return
+        
+        # Resultados: desde caché si este contenido ya se analizó con el mismo modelo y umbrales
+        results = None
+        if epp_pool is not None:
+            results = VideoResultSource(result_cache, epp_pool, video_info['content_hash'])
+            if results.cache_hit:
+                logger.info("Usando resultados en caché para %s", video_info['filename'], extra={'video_id': video_id})
+        
+        video_jobs.start_run(video_id, cache_hit=results is not None and results.cache_hit)
+        progress_batch = JobProgress(video_jobs, video_id)
+        upload_complete = video_info['upload_complete']
+        epp_incorrecto = 0
             
         frame_count = 0
+        completed = False
+        error = None
         
         try:
             while True:
                 ret, frame = cap.read()
                 
                 if not ret:
+                    if not upload_complete:
+                        # Subida en curso: esperar más datos y reabrir desde el frame actual
+                        time.sleep(0.5)
+                        current = video_jobs.get(video_id)
+                        if current is None:
+                            break
+                        upload_complete = current['upload_complete']
+                        video_info['content_hash'] = current['content_hash']
+                        video_info['total_frames'] = current['total_frames']
+                        cap.release()
+                        cap = cv2.VideoCapture(video_path)
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
+                        continue
+                    
                     # Video terminado
-                    print(f"[VIDEO] Procesamiento completado: {video_info['filename']}")
+                    logger.info("Procesamiento completado: %s", video_info['filename'], extra={'video_id': video_id})
+                    completed = True
                     break
                 
                 frame_count += 1
                 
                 try:
                     # Procesar con detector EPP si está disponible
-                    if epp_detector is not None:
-                        frame, detections, compliance = epp_detector.process_frame(frame, draw=True)
+                    if results is not None:
+                        detections = results.detections(frame_count - 1, frame)
+                        compliance = epp_pool.reference.classify_compliance(detections)
+                        with metrics.stage_timer("draw", "video"):
+                            frame = epp_pool.reference.draw_detections(frame, detections, compliance, in_place=True)
                         
-                        # Actualizar estadísticas
-                        video_info['stats']['frames_procesados'] = frame_count
-                        if detections:
-                            video_info['stats']['detecciones_totales'] += len(detections)
-                            video_info['stats']['personas_detectadas'] = len(detections)
-                            if compliance['estado'] != 'C':
-                                video_info['stats']['epp_incorrecto'] += 1
-                        else:
-                            video_info['stats']['personas_detectadas'] = 0
+                        # Actualizar estadísticas (se escriben en lotes)
+                        incorrecto = bool(detections) and compliance['estado'] != 'C'
+                        if incorrecto:
+                            epp_incorrecto += 1
+                        progress_batch.add(len(detections), incorrecto)
                         
                         # Info de progreso en el frame
                         progress = (frame_count / video_info['total_frames']) * 100 if video_info['total_frames'] > 0 else 0
@@ -460,24 +796,25 @@ async def stream_video_with_detection(video_id: str):
                                   (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
                         
                         # Contador de personas detectadas
-                        cv2.putText(frame, f"Personas: {len(detections)} | EPP Incorrecto: {video_info['stats']['epp_incorrecto']}", 
+                        cv2.putText(frame, f"Personas: {len(detections)} | EPP Incorrecto: {epp_incorrecto}", 
                                   (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
                     else:
                         # Si no hay detector, solo actualizar contador
-                        video_info['stats']['frames_procesados'] = frame_count
+                        progress_batch.add(0, False)
                         cv2.putText(frame, "Cargando modelo EPP...", 
                                   (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
                     
                 except Exception as e:
-                    print(f"[ERROR] Error procesando frame {frame_count}: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    logger.error("Error procesando frame %s: %s", frame_count, e, exc_info=True,
+                                 extra={'video_id': video_id, 'rate_key': video_id})
                 
                 # Codificar frame
-                ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                with metrics.stage_timer("encode", "video"):
+                    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
                 
                 if not ret:
-                    print(f"[ERROR] No se pudo codificar frame {frame_count}")
+                    logger.error("No se pudo codificar frame %s", frame_count,
+                                 extra={'video_id': video_id, 'rate_key': video_id})
                     continue
                 
                 frame_bytes = buffer.tobytes()
@@ -489,12 +826,19 @@ async def stream_video_with_detection(video_id: str):
                 time.sleep(1/30)  # ~30 FPS
                 
         except Exception as e:
-            print(f"[ERROR] Error en stream de video: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error en stream de video: %s", e, extra={'video_id': video_id})
+            error = str(e)
         finally:
             cap.release()
-            print(f"[VIDEO] Stream finalizado para {video_id}")
+            if results is not None:
+                # Guardar en caché solo si se analizó el video completo
+                results.finish(completed, content_hash=video_info['content_hash'])
+            try:
+                progress_batch.flush()
+                video_jobs.finish_run(video_id, completed, error)
+            except Exception as e:
+                get_logger("db").error(f"No se pudo actualizar el trabajo {video_id}: {e}")
+            logger.info("Stream finalizado para %s", video_id, extra={'video_id': video_id})
     
     return StreamingResponse(
         generate_video_frames(),
@@ -502,14 +846,23 @@ async def stream_video_with_detection(video_id: str):
     )
 
 
+@router.get("/videos/hls/{video_id}")
+async def stream_video_hls(video_id: str, detect: bool = True, width: int = None):
+    """Versión HLS (H.264) de un video subido, con detección EPP opcional"""
+    video_info = await run_in_threadpool(get_video_or_404, video_id)
+    if not ffmpeg_available():
+        raise HTTPException(status_code=503, detail="FFmpeg no está instalado en el servidor")
+    
+    session = hls_manager.video_session(video_id, video_info['path'], annotate=detect, width=width,
+                                        content_hash=video_info['content_hash'])
+    return RedirectResponse(url=f"/api/hls/{session.key}/index.m3u8", status_code=307)
+
+
 @router.get("/videos/stats/{video_id}")
 async def get_video_stats(video_id: str):
     """Obtiene estadísticas del video en procesamiento"""
     
-    if video_id not in active_videos:
-        raise HTTPException(status_code=404, detail="Video no encontrado")
-    
-    video_info = active_videos[video_id]
+    video_info = await run_in_threadpool(get_video_or_404, video_id)
     stats = video_info['stats']
     
     progress = (stats['frames_procesados'] / video_info['total_frames']) * 100 if video_info['total_frames'] > 0 else 0
@@ -525,7 +878,10 @@ async def get_video_stats(video_id: str):
         "personas_detectadas": stats['personas_detectadas'],
         "epp_incorrecto": stats['epp_incorrecto'],
         "duracion": video_info['duration'],
-        "fps": video_info['fps']
+        "fps": video_info['fps'],
+        "cache_hit": video_info['cache_hit'],
+        "estado": video_info['estado'],
+        "error": video_info['error']
     }
 
 
@@ -533,22 +889,19 @@ async def get_video_stats(video_id: str):
 async def delete_video(video_id: str):
     """Elimina un video temporal"""
     
-    if video_id not in active_videos:
-        raise HTTPException(status_code=404, detail="Video no encontrado")
-    
     try:
-        video_path = Path(active_videos[video_id]['path'])
-        
-        # Eliminar archivo
-        if video_path.exists():
-            video_path.unlink()
-            print(f"[VIDEO] Archivo eliminado: {video_path}")
+        # Borrar registro y archivo
+        video_info = await run_in_threadpool(video_jobs.delete, video_id)
+        if video_info is None:
+            raise HTTPException(status_code=404, detail="Video no encontrado")
         
-        # Remover del diccionario
-        del active_videos[video_id]
+        # Detener y borrar sus sesiones HLS
+        hls_manager.remove_video(video_id)
         
         return {"success": True, "message": "Video eliminado"}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"[ERROR] Error eliminando video: {e}")
+        logger.error("Error eliminando video: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,230 @@
+"""
+Conteos de alertas en memoria (por estado, severidad, cámara y del día)
+Se siembran con un GROUP BY al arrancar, se actualizan en el momento en que se crea
+una alerta o cambia su estado, y se reconcilian con la BD cada ALERT_COUNTS_RECONCILE
+segundos (cubre borrados de retención y escrituras de otros procesos). /api/alerts/count
+y /api/alerts/summary responden desde memoria, sin COUNT(*) por cada sondeo.
+Los workers de cámaras no tienen conteos propios: acumulan los cambios y los envían con
+el latido al proceso web
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func
+from dotenv import load_dotenv
+from backend.core.database import SessionLocal, Alerta
+from backend.core.compliance_rules import SEVERIDADES
+from backend.core.logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("alerts")
+
+ALERT_COUNTS_RECONCILE = float(os.getenv("ALERT_COUNTS_RECONCILE", "60"))
+
+ESTADOS = ('pendiente', 'revisada', 'resuelta', 'descartada')
+
+# Clave de conteo: (camera_id, severidad, estado)
+Key = Tuple[Optional[int], Optional[str], Optional[str]]
+
+
+class AlertCounters:
+    def __init__(self, reconcile_interval: float = None):
+        """
+        Args:
+            reconcile_interval: Segundos entre reconciliaciones con la BD (ALERT_COUNTS_RECONCILE por defecto)
+        """
+        self.reconcile_interval = reconcile_interval if reconcile_interval is not None else ALERT_COUNTS_RECONCILE
+        self._lock = threading.Lock()
+        self._totals: Dict[Key, int] = defaultdict(int)
+        self._today: Dict[Key, int] = defaultdict(int)
+        self._day = date.today()
+        self.seeded = False
+        self.reconciled_at: Optional[float] = None
+        self._next_reconcile = 0.0
+        self._reconciling = False
+        # Cambios pendientes de enviar al proceso web (solo en workers)
+        self._journal: Optional[Dict[Tuple, int]] = None
+
+    # ---------- Cambios incrementales ----------
+
+    def record_created(self, camera_id: int, severidad: str, estado: str = 'pendiente', ts: datetime = None):
+        """Alerta nueva"""
+        day = (ts or datetime.now()).date()
+        self.apply([((camera_id, severidad, estado, day.isoformat()), 1)])
+
+    def record_transition(self, rows: Iterable[Tuple[int, str, str, Optional[date], int]], estado: str):
+        """
+        Alertas que pasaron a otro estado
+
+        Args:
+            rows: (camera_id, severidad, estado anterior, día de la alerta, cantidad) por grupo de alertas
+            estado: Estado nuevo
+        """
+        deltas = []
+        for camera_id, severidad, anterior, day, n in rows:
+            if anterior == estado or not n:
+                continue
+            day = day.isoformat() if day is not None else None
+            deltas.append(((camera_id, severidad, anterior, day), -n))
+            deltas.append(((camera_id, severidad, estado, day), n))
+        self.apply(deltas)
+
+    def apply(self, deltas: Iterable[Tuple[Tuple, int]]):
+        """
+        Aplica cambios ((camera_id, severidad, estado, día ISO), delta); también los que
+        envían los workers con el latido
+        """
+        with self._lock:
+            self._roll_day()
+            today = self._day.isoformat()
+            for (camera_id, severidad, estado, day), n in deltas:
+                if self._journal is not None:
+                    self._journal[(camera_id, severidad, estado, day)] += n
+                if not self.seeded:
+                    continue
+                key = (camera_id, severidad, estado)
+                self._add(self._totals, key, n)
+                if day == today:
+                    self._add(self._today, key, n)
+
+    @staticmethod
+    def _add(counts: Dict[Key, int], key: Key, n: int):
+        value = counts[key] + n
+        if value > 0:
+            counts[key] = value
+        else:
+            # Una baja que llegó antes que su alta (p.ej. de un worker) se corrige al reconciliar
+            del counts[key]
+
+    def _roll_day(self):
+        """Cambio de día: los conteos de hoy empiezan de cero (llamar con el lock tomado)"""
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self._today = defaultdict(int)
+
+    def start_journal(self):
+        """Acumula los cambios para enviarlos a otro proceso (workers de cámaras)"""
+        with self._lock:
+            self._journal = defaultdict(int)
+
+    def drain_journal(self) -> List[Tuple[Tuple, int]]:
+        """Cambios acumulados desde la última llamada"""
+        with self._lock:
+            if not self._journal:
+                return []
+            deltas = [(key, n) for key, n in self._journal.items() if n]
+            self._journal = defaultdict(int)
+            return deltas
+
+    # ---------- Reconciliación ----------
+
+    def reconcile(self) -> bool:
+        """
+        Recalcula los conteos desde la BD (dos GROUP BY) y los reemplaza
+
+        Returns:
+            True si la consulta fue exitosa
+        """
+        from backend.core.database import ensure_schema
+        db = SessionLocal()
+        try:
+            ensure_schema()
+            midnight = datetime.combine(date.today(), datetime.min.time())
+            group = (Alerta.camera_id, Alerta.severidad, Alerta.estado)
+            totals = db.query(*group, func.count(Alerta.id)).group_by(*group).all()
+            today = db.query(*group, func.count(Alerta.id)).filter(Alerta.timestamp >= midnight).group_by(*group).all()
+        except Exception as e:
+            logger.error("Error contando alertas: %s", e, extra={'rate_key': 'conteos'})
+            return False
+        finally:
+            db.close()
+
+        # Los cambios que llegaron durante la consulta pueden contarse dos veces o ninguna:
+        # la próxima reconciliación lo corrige
+        with self._lock:
+            self._totals = defaultdict(int, {(c, s, e): n for c, s, e, n in totals if n})
+            self._today = defaultdict(int, {(c, s, e): n for c, s, e, n in today if n})
+            self._day = midnight.date()
+            self.seeded = True
+            self.reconciled_at = time.time()
+        return True
+
+    def invalidate(self):
+        """Forzar la reconciliación en la próxima lectura (p.ej. tras un borrado masivo)"""
+        self._next_reconcile = 0.0
+
+    def _refresh(self):
+        if time.monotonic() < self._next_reconcile:
+            return
+        with self._lock:
+            if self._reconciling:
+                return
+            self._reconciling = True
+            self._next_reconcile = time.monotonic() + self.reconcile_interval
+        if not self.seeded:
+            # Primera lectura sin siembra previa: en línea
+            self._reconcile_guarded()
+        else:
+            threading.Thread(target=self._reconcile_guarded, name="alertas-conteo", daemon=True).start()
+
+    def _reconcile_guarded(self):
+        try:
+            self.reconcile()
+        finally:
+            with self._lock:
+                self._reconciling = False
+
+    # ---------- Lectura ----------
+
+    def count(self, estado: str = 'pendiente', camera_id: int = None, severidad: str = None) -> int:
+        """Alertas en un estado (opcionalmente de una cámara o severidad)"""
+        self._refresh()
+        with self._lock:
+            return sum(n for (c, s, e), n in self._totals.items()
+                       if e == estado and (camera_id is None or c == camera_id)
+                       and (severidad is None or s == severidad))
+
+    def summary(self) -> Dict:
+        """Todos los conteos del dashboard en una sola lectura"""
+        self._refresh()
+        por_estado = dict.fromkeys(ESTADOS, 0)
+        pendientes_severidad = dict.fromkeys(SEVERIDADES, 0)
+        pendientes_camara = defaultdict(int)
+        hoy_estado = dict.fromkeys(ESTADOS, 0)
+        hoy_severidad = dict.fromkeys(SEVERIDADES, 0)
+        with self._lock:
+            self._roll_day()
+            for (camera_id, severidad, estado), n in self._totals.items():
+                por_estado[estado] = por_estado.get(estado, 0) + n
+                if estado == 'pendiente':
+                    pendientes_severidad[severidad] = pendientes_severidad.get(severidad, 0) + n
+                    pendientes_camara[camera_id] += n
+            for (camera_id, severidad, estado), n in self._today.items():
+                hoy_estado[estado] = hoy_estado.get(estado, 0) + n
+                hoy_severidad[severidad] = hoy_severidad.get(severidad, 0) + n
+            reconciled_at = self.reconciled_at
+
+        return {
+            'pendientes': por_estado['pendiente'],
+            'total': sum(por_estado.values()),
+            'por_estado': por_estado,
+            'pendientes_por_severidad': pendientes_severidad,
+            'pendientes_por_camara': [{'camera_id': camera_id, 'pendientes': n}
+                                      for camera_id, n in sorted(pendientes_camara.items(),
+                                                                 key=lambda item: item[0] or 0)],
+            'hoy': {
+                'total': sum(hoy_estado.values()),
+                'por_estado': hoy_estado,
+                'por_severidad': hoy_severidad,
+            },
+            'reconciliado_hace_s': round(time.time() - reconciled_at, 1) if reconciled_at else None,
+        }
+
+
+# Instancia global
+alert_counters = AlertCounters()
@@ -1,11 +1,41 @@
 """
 Gestor de Alertas y Detecciones
-Guarda detecciones en base de datos y genera alertas cuando hay incumplimiento
+Guarda detecciones en base de datos y genera alertas cuando hay incumplimiento.
+Las ocurrencias repetidas de la misma (cámara, tipo) se agrupan en un incidente abierto
+(ocurrencias / ultima_ocurrencia) en lugar de insertar filas y snapshots nuevos, y la
+apertura de incidentes tiene un tope por cámara y otro global
 """
-from typing import Dict, List
-from datetime import datetime
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from sqlalchemy import update, func
 from sqlalchemy.orm import Session
-from backend.core.database import SessionLocal, Deteccion, DeteccionEPP, Alerta, TipoEPP
+from dotenv import load_dotenv
+from backend.core.database import SessionLocal, Deteccion, DeteccionEPP, Alerta, TipoEPP, ensure_schema
+from backend.core.compliance_rollup import compliance_rollup
+from backend.core.alert_counters import alert_counters, ESTADOS
+from backend.core.compliance_rules import rules_engine
+from backend.core.inference_scheduler import TokenBucket
+from backend.core import metrics
+from backend.core.logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("alerts")
+
+# Un incidente sigue abierto mientras lleguen ocurrencias con menos de N segundos entre sí
+ALERT_COALESCE_WINDOW = float(os.getenv("ALERT_COALESCE_WINDOW", "300"))
+# Incidentes nuevos por minuto como máximo (0 = sin tope)
+ALERT_RATE_CAMERA = float(os.getenv("ALERT_RATE_CAMERA", "6"))
+ALERT_RATE_GLOBAL = float(os.getenv("ALERT_RATE_GLOBAL", "60"))
+# Ráfagas permitidas sobre esas tasas
+ALERT_BURST_CAMERA = 3
+ALERT_BURST_GLOBAL = 20
+
+# Alertas por UPDATE en la revisión masiva (transacciones cortas, recorrido por PK)
+REVIEW_BATCH_SIZE = 1000
 
 class AlertManager:
     def __init__(self):
@@ -16,11 +46,127 @@ class AlertManager:
             'botas': 4,
             'gafas': 5
         }
+        
+        # Incidentes abiertos: (camera_id, tipo) -> (alerta_id, última ocurrencia)
+        self._incidents: Dict[Tuple[int, str], Tuple[int, datetime]] = {}
+        self._incidents_lock = threading.Lock()
+        
+        # Topes de incidentes nuevos (token buckets en alertas por segundo)
+        self._rate_lock = threading.Lock()
+        self._camera_buckets: Dict[int, TokenBucket] = {}
+        self._global_bucket = TokenBucket(ALERT_RATE_GLOBAL / 60, capacity=ALERT_BURST_GLOBAL)
     
     def _get_db(self) -> Session:
         """Obtiene sesión de base de datos"""
+        # Columnas de incidentes (ocurrencias) en bases creadas con versiones anteriores
+        ensure_schema()
         return SessionLocal()
     
+    def report_violation(self, camera_id: int, detections: List[Dict], compliance: Dict,
+                         snapshot: Optional[Callable[[], object]] = None) -> Optional[int]:
+        """
+        Registra un incumplimiento: suma una ocurrencia al incidente abierto de (cámara, tipo)
+        o, si no hay uno, guarda la detección y abre un incidente nuevo (dentro de los topes)
+        
+        Args:
+            camera_id: ID de la cámara
+            detections: Lista de detecciones del detector EPP
+            compliance: Resultado de clasificación de cumplimiento
+            snapshot: Devuelve el frame anotado; solo se llama si se abre un incidente
+            
+        Returns:
+            ID de la alerta (nueva o agrupada) o None si no hubo alerta
+        """
+        if compliance['estado'] not in ('I', 'N'):
+            return None
+        
+        tipo, _, _ = rules_engine.for_camera(camera_id).classify_alert(compliance)
+        alerta_id = self._add_occurrence(camera_id, tipo, datetime.now())
+        if alerta_id is not None:
+            metrics.ALERTS_COALESCED.inc(camera_id)
+            return alerta_id
+        
+        limit = self._admit(camera_id)
+        if limit is not None:
+            metrics.ALERTS_SUPPRESSED.inc(camera_id, limit)
+            logger.warning("Tope de alertas (%s) alcanzado: incidente %s descartado (Cámara %s)", limit, tipo, camera_id,
+                           extra={'camera_id': camera_id, 'rate_key': (camera_id, limit)})
+            return None
+        
+        frame = snapshot() if snapshot is not None else None
+        deteccion_id = self.save_detection(camera_id, detections, compliance, frame=frame)
+        alerta_id = self.generate_alert(camera_id, deteccion_id, compliance) if deteccion_id else None
+        if alerta_id is None:
+            # Error de BD: el cupo no se gastó en un incidente
+            self._refund(camera_id)
+        return alerta_id
+    
+    def _add_occurrence(self, camera_id: int, tipo: str, now: datetime) -> Optional[int]:
+        """Suma una ocurrencia al incidente abierto (None si no hay uno vigente)"""
+        key = (camera_id, tipo)
+        window = timedelta(seconds=ALERT_COALESCE_WINDOW)
+        with self._incidents_lock:
+            cached = self._incidents.get(key)
+        if cached is not None and now - cached[1] > window:
+            cached = None
+        
+        db = self._get_db()
+        try:
+            if cached is not None:
+                alerta_id = cached[0]
+            else:
+                # Incidente abierto por otro proceso o antes de un reinicio
+                alerta_id = db.query(Alerta.id).filter(
+                    Alerta.camera_id == camera_id,
+                    Alerta.tipo == tipo,
+                    Alerta.estado == 'pendiente',
+                    func.coalesce(Alerta.ultima_ocurrencia, Alerta.timestamp) >= now - window
+                ).order_by(Alerta.id.desc()).limit(1).scalar()
+                if alerta_id is None:
+                    return None
+            
+            write_start = time.perf_counter()
+            # Solo mientras siga pendiente: una alerta revisada o resuelta cierra el incidente
+            updated = db.execute(
+                update(Alerta)
+                .where(Alerta.id == alerta_id, Alerta.estado == 'pendiente')
+                .values(ocurrencias=Alerta.ocurrencias + 1, ultima_ocurrencia=now)
+            ).rowcount
+            db.commit()
+            metrics.observe_stage("db_write", camera_id, time.perf_counter() - write_start)
+        except Exception as e:
+            db.rollback()
+            logger.error("Error agrupando alerta: %s", e, extra={'camera_id': camera_id, 'rate_key': camera_id})
+            return None
+        finally:
+            db.close()
+        
+        with self._incidents_lock:
+            if updated:
+                self._incidents[key] = (alerta_id, now)
+            else:
+                self._incidents.pop(key, None)
+        return alerta_id if updated else None
+    
+    def _admit(self, camera_id: int) -> Optional[str]:
+        """Consume un cupo de incidente nuevo; devuelve el tope alcanzado ('camara' | 'global') o None"""
+        with self._rate_lock:
+            bucket = self._camera_buckets.get(camera_id)
+            if bucket is None:
+                bucket = self._camera_buckets[camera_id] = TokenBucket(ALERT_RATE_CAMERA / 60,
+                                                                       capacity=ALERT_BURST_CAMERA)
+            if bucket.reserve() > 0:
+                return 'camara'
+            if self._global_bucket.reserve() > 0:
+                bucket.refund()
+                return 'global'
+            return None
+    
+    def _refund(self, camera_id: int):
+        with self._rate_lock:
+            self._camera_buckets[camera_id].refund()
+            self._global_bucket.refund()
+    
     def save_detection(self, camera_id: int, detections: List[Dict], compliance: Dict, frame=None) -> int:
         """
         Guarda una detección en la base de datos
@@ -41,7 +187,6 @@ class AlertManager:
             if frame is not None and compliance['estado'] != 'C':
                 import cv2
                 import os
-                from datetime import datetime
                 
                 # Crear carpeta de snapshots si no existe (ruta absoluta)
                 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -58,9 +203,10 @@ class AlertManager:
                 
                 # Guardar ruta relativa para la BD (para servir vía /static/)
                 imagen_path = f"static/snapshots/{filename}"
-                print(f"[ALERT] Snapshot guardado: {full_path}")
+                logger.debug("Snapshot guardado: %s", full_path, extra={'camera_id': camera_id})
             
             # Crear registro de detección principal
+            write_start = time.perf_counter()
             deteccion = Deteccion(
                 camera_id=camera_id,
                 trabajador_id=None,  # Por ahora sin reconocimiento de trabajador
@@ -109,11 +255,12 @@ class AlertManager:
                     db.add(deteccion_epp)
             
             db.commit()
+            metrics.observe_stage("db_write", camera_id, time.perf_counter() - write_start)
             return deteccion.id
             
         except Exception as e:
             db.rollback()
-            print(f"[ALERT ERROR] Error guardando detección: {e}")
+            logger.error("Error guardando detección: %s", e, extra={'camera_id': camera_id, 'rate_key': camera_id})
             return None
         finally:
             db.close()
@@ -136,51 +283,40 @@ class AlertManager:
         
         db = self._get_db()
         try:
-            # Determinar tipo y severidad
-            if compliance['estado'] == 'N':
-                tipo = 'sin_epp'
-                severidad = 'critica'
-                mensaje = 'Trabajador sin EPP detectado'
-            else:  # Estado 'I'
-                # Determinar qué EPP falta
-                missing = [epp for epp, present in compliance['epp_status'].items() if not present]
-                
-                # Severidad según EPP faltante
-                if 'casco' in missing:
-                    tipo = 'sin_casco'
-                    severidad = 'critica'
-                elif 'chaleco' in missing:
-                    tipo = 'sin_chaleco'
-                    severidad = 'alta'
-                elif len(missing) >= 3:
-                    tipo = 'epp_multiple_faltante'
-                    severidad = 'alta'
-                else:
-                    tipo = 'epp_incorrecto'
-                    severidad = 'media'
-                
-                mensaje = f"EPP incorrecto: Falta {', '.join(missing)}"
+            # Tipo y severidad según las reglas de la cámara (configuracion_ia)
+            tipo, severidad, mensaje = rules_engine.for_camera(camera_id).classify_alert(compliance)
             
-            # Crear alerta
+            # Crear alerta (incidente con su primera ocurrencia)
+            write_start = time.perf_counter()
+            now = datetime.now()
             alerta = Alerta(
                 deteccion_id=deteccion_id,
                 camera_id=camera_id,
-                timestamp=datetime.now(),
+                timestamp=now,
                 tipo=tipo,
                 severidad=severidad,
                 mensaje=mensaje,
-                estado='pendiente'
+                estado='pendiente',
+                ocurrencias=1,
+                ultima_ocurrencia=now
             )
             
             db.add(alerta)
             db.commit()
+            with self._incidents_lock:
+                self._incidents[(camera_id, tipo)] = (alerta.id, now)
+            metrics.observe_stage("db_write", camera_id, time.perf_counter() - write_start)
+            metrics.ALERTS.inc(camera_id, severidad)
+            alert_counters.record_created(camera_id, severidad, 'pendiente', now)
+            compliance_rollup.record_alert(camera_id, severidad, alerta.timestamp)
             
-            print(f"[ALERT] Generada alerta {severidad.upper()}: {mensaje} (Cámara {camera_id})")
+            logger.info("Generada alerta %s: %s (Cámara %s)", severidad.upper(), mensaje, camera_id,
+                        extra={'camera_id': camera_id, 'severidad': severidad, 'alerta_id': alerta.id})
             return alerta.id
             
         except Exception as e:
             db.rollback()
-            print(f"[ALERT ERROR] Error generando alerta: {e}")
+            logger.error("Error generando alerta: %s", e, extra={'camera_id': camera_id, 'rate_key': camera_id})
             return None
         finally:
             db.close()
@@ -203,28 +339,125 @@ class AlertManager:
                     'tipo': alerta.tipo,
                     'severidad': alerta.severidad,
                     'mensaje': alerta.mensaje,
-                    'estado': alerta.estado
+                    'estado': alerta.estado,
+                    'ocurrencias': alerta.ocurrencias or 1,
+                    'ultima_ocurrencia': alerta.ultima_ocurrencia.strftime('%H:%M %p') if alerta.ultima_ocurrencia else ''
                 })
             
             return result
             
         except Exception as e:
-            print(f"[ALERT ERROR] Error obteniendo alertas: {e}")
+            logger.error("Error obteniendo alertas: %s", e)
             return []
         finally:
             db.close()
     
+    def review_alerts(self, estado: str, ids: List[int] = None, camera_id: int = None, tipo: str = None,
+                      desde: datetime = None, hasta: datetime = None, estado_actual: str = None,
+                      revisada_por: str = None, notas: str = None) -> Dict:
+        """
+        Cambia el estado de muchas alertas con un UPDATE por lote
+        
+        Args:
+            estado: Estado nuevo (revisada, resuelta, descartada o pendiente)
+            ids: IDs explícitos (si se indican, los filtros restantes también aplican)
+            camera_id: Filtrar por cámara
+            tipo: Filtrar por tipo (contiene, como en el historial)
+            desde: Alertas desde esta fecha
+            hasta: Alertas hasta esta fecha
+            estado_actual: Solo alertas en este estado (por defecto 'pendiente' al filtrar sin IDs)
+            revisada_por: Quién revisa (si no se indica se conserva el anterior)
+            notas: Notas de revisión
+            
+        Returns:
+            Dict con las alertas actualizadas y los lotes ejecutados
+        """
+        if estado not in ESTADOS:
+            raise ValueError(f"Estado inválido: {estado} (use {', '.join(ESTADOS)})")
+        if estado_actual is not None and estado_actual not in ESTADOS:
+            raise ValueError(f"Estado actual inválido: {estado_actual}")
+        if not ids and camera_id is None and not tipo and desde is None and hasta is None:
+            raise ValueError("Indique ids o al menos un filtro (camera_id, tipo, desde, hasta)")
+        if not ids and estado_actual is None:
+            estado_actual = 'pendiente'
+        
+        conditions = [Alerta.estado != estado]
+        if estado_actual is not None:
+            conditions.append(Alerta.estado == estado_actual)
+        if camera_id is not None:
+            conditions.append(Alerta.camera_id == camera_id)
+        if tipo:
+            conditions.append(Alerta.tipo.contains(tipo))
+        if desde is not None:
+            conditions.append(Alerta.timestamp >= desde)
+        if hasta is not None:
+            conditions.append(Alerta.timestamp <= hasta)
+        
+        if ids:
+            unique_ids = sorted(set(ids))
+            batches = (unique_ids[i:i + REVIEW_BATCH_SIZE] for i in range(0, len(unique_ids), REVIEW_BATCH_SIZE))
+        else:
+            batches = None
+        
+        if estado == 'pendiente':
+            # De vuelta a pendiente: deja de figurar como revisada
+            values = {'estado': estado, 'revisada_por': None, 'revisada_at': None}
+        else:
+            values = {'estado': estado, 'revisada_at': datetime.now()}
+            if revisada_por:
+                values['revisada_por'] = revisada_por
+        if notas is not None:
+            values['notas_revision'] = notas
+        updated = 0
+        rounds = 0
+        last_id = 0
+        while True:
+            if batches is not None:
+                batch_ids = next(batches, None)
+                if batch_ids is None:
+                    break
+                scope = Alerta.id.in_(batch_ids)
+            else:
+                scope = Alerta.id > last_id
+            
+            db = self._get_db()
+            try:
+                # Filas del lote bloqueadas hasta el commit: el estado anterior leído es el que se reemplaza
+                rows = db.query(Alerta.id, Alerta.camera_id, Alerta.severidad, Alerta.estado, Alerta.timestamp) \
+                    .filter(scope, *conditions).order_by(Alerta.id).limit(REVIEW_BATCH_SIZE) \
+                    .with_for_update().all()
+                if not rows:
+                    db.rollback()
+                    if batches is None:
+                        break
+                    continue
+                db.execute(update(Alerta).where(Alerta.id.in_([row.id for row in rows])).values(**values))
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error("Error revisando alertas: %s", e)
+                raise
+            finally:
+                db.close()
+            
+            updated += len(rows)
+            rounds += 1
+            last_id = rows[-1].id
+            groups: Dict[Tuple, int] = {}
+            for row in rows:
+                key = (row.camera_id, row.severidad, row.estado,
+                       row.timestamp.date() if row.timestamp else None)
+                groups[key] = groups.get(key, 0) + 1
+            alert_counters.record_transition([key + (n,) for key, n in groups.items()], estado)
+        
+        if updated:
+            logger.info("Revisión masiva: %s alertas -> %s en %s lote(s)%s", updated, estado, rounds,
+                        f" por {revisada_por}" if revisada_por else "")
+        return {'actualizadas': updated, 'lotes': rounds}
+    
     def get_alerts_count(self, estado: str = 'pendiente') -> int:
-        """Obtiene el conteo de alertas por estado"""
-        db = self._get_db()
-        try:
-            count = db.query(Alerta).filter(Alerta.estado == estado).count()
-            return count
-        except Exception as e:
-            print(f"[ALERT ERROR] Error contando alertas: {e}")
-            return 0
-        finally:
-            db.close()
+        """Obtiene el conteo de alertas por estado (desde los conteos en memoria)"""
+        return alert_counters.count(estado)
 
 # Instancia global
 alert_manager = AlertManager()
@@ -1,6 +1,6 @@
 """
 Módulo de gestión de configuración de cámaras
-Almacena la asignación de cámaras físicas a zonas en MySQL
+Almacena la asignación de cámaras (USB, IP o archivo) a zonas en MySQL
 """
 from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
@@ -12,40 +12,74 @@ class CameraConfigManager:
     
     def _get_db(self) -> Session:
         """Obtiene una sesión de base de datos"""
-        from .database import SessionLocal
+        from .database import SessionLocal, ensure_schema
+        
+        # Columnas nuevas de cameras (fuente) en bases creadas con versiones anteriores
+        ensure_schema()
         return SessionLocal()
     
+    @staticmethod
+    def _to_dict(camera, redact: bool = True) -> Dict:
+        """
+        Representación de una cámara
+
+        Args:
+            camera: Registro Camera
+            redact: Si True, oculta la contraseña de la URL de la fuente (respuestas de la API)
+        """
+        from .camera_source import redact_uri
+        return {
+            'id': camera.id,
+            'physical_id': camera.physical_id,
+            'fuente': redact_uri(camera.fuente) if redact else camera.fuente,
+            'nombre': camera.nombre,
+            'zona': camera.zona,
+            'estado': camera.estado,
+            'resolucion': camera.resolucion
+        }
+    
     def get_all_cameras(self) -> List[Dict]:
         """Obtiene todas las cámaras configuradas"""
         db = self._get_db()
         try:
             from .database import Camera
             cameras = db.query(Camera).all()
-            return [{
-                'id': cam.id,
-                'physical_id': cam.physical_id,
-                'nombre': cam.nombre,
-                'zona': cam.zona,
-                'estado': cam.estado,
-                'resolucion': cam.resolucion
-            } for cam in cameras]
+            return [self._to_dict(cam) for cam in cameras]
         finally:
             db.close()
     
-    def add_camera(self, physical_id: int, nombre: str, zona: str) -> Dict:
-        """Agrega una nueva cámara configurada"""
+    def add_camera(self, physical_id: Optional[int], nombre: str, zona: str, fuente: Optional[str] = None) -> Dict:
+        """
+        Agrega una nueva cámara configurada
+
+        Args:
+            physical_id: ID de cámara local (USB); None para cámaras IP o archivo
+            nombre: Nombre visible
+            zona: Zona de la obra
+            fuente: URL rtsp/http(s), 'usb:N' o ruta de video (None = usar physical_id)
+        """
         db = self._get_db()
         try:
             from .database import Camera
+            from .camera_source import validate_source
+            
+            fuente = (fuente or "").strip() or None
+            if physical_id is None and fuente is None:
+                raise ValueError("Indique la cámara física o la fuente (URL o archivo)")
+            error = validate_source(fuente)
+            if error:
+                raise ValueError(error)
             
-            # Verificar que no exista ya esta cámara física
-            existing = db.query(Camera).filter_by(physical_id=physical_id).first()
-            if existing:
+            # Verificar que no exista ya esta cámara física / fuente
+            if physical_id is not None and db.query(Camera).filter_by(physical_id=physical_id).first():
                 raise ValueError(f"La cámara física {physical_id} ya está configurada")
+            if fuente is not None and db.query(Camera).filter_by(fuente=fuente).first():
+                raise ValueError("Esta fuente ya está configurada")
             
             # Crear nueva cámara
             new_camera = Camera(
                 physical_id=physical_id,
+                fuente=fuente,
                 nombre=nombre,
                 zona=zona,
                 estado='activa',
@@ -57,14 +91,7 @@ class CameraConfigManager:
             db.commit()
             db.refresh(new_camera)
             
-            return {
-                'id': new_camera.id,
-                'physical_id': new_camera.physical_id,
-                'nombre': new_camera.nombre,
-                'zona': new_camera.zona,
-                'estado': new_camera.estado,
-                'resolucion': new_camera.resolucion
-            }
+            return self._to_dict(new_camera)
         except Exception as e:
             db.rollback()
             raise e
@@ -90,11 +117,12 @@ class CameraConfigManager:
         finally:
             db.close()
     
-    def update_camera(self, camera_id: int, nombre: str, zona: str) -> Optional[Dict]:
-        """Actualiza los datos de una cámara configurada"""
+    def update_camera(self, camera_id: int, nombre: str, zona: str, fuente: Optional[str] = None) -> Optional[Dict]:
+        """Actualiza los datos de una cámara configurada (la fuente solo si se indica)"""
         db = self._get_db()
         try:
             from .database import Camera
+            from .camera_source import validate_source
             camera = db.query(Camera).filter_by(id=camera_id).first()
             
             if not camera:
@@ -102,25 +130,28 @@ class CameraConfigManager:
             
             camera.nombre = nombre
             camera.zona = zona
+            if fuente is not None:
+                fuente = fuente.strip() or None
+                if fuente is None and camera.physical_id is None:
+                    raise ValueError("La cámara no tiene cámara física: indique la fuente (URL o archivo)")
+                error = validate_source(fuente)
+                if error:
+                    raise ValueError(error)
+                if fuente is not None and db.query(Camera).filter(Camera.fuente == fuente, Camera.id != camera_id).first():
+                    raise ValueError("Esta fuente ya está configurada")
+                camera.fuente = fuente
             db.commit()
             db.refresh(camera)
             
-            return {
-                'id': camera.id,
-                'physical_id': camera.physical_id,
-                'nombre': camera.nombre,
-                'zona': camera.zona,
-                'estado': camera.estado,
-                'resolucion': camera.resolucion
-            }
+            return self._to_dict(camera)
         except Exception as e:
             db.rollback()
             raise e
         finally:
             db.close()
     
-    def get_camera_by_id(self, camera_id: int) -> Optional[Dict]:
-        """Obtiene una cámara por su ID"""
+    def get_camera_by_id(self, camera_id: int, redact: bool = True) -> Optional[Dict]:
+        """Obtiene una cámara por su ID (redact=False incluye la URL completa de la fuente)"""
         db = self._get_db()
         try:
             from .database import Camera
@@ -129,14 +160,7 @@ class CameraConfigManager:
             if not camera:
                 return None
             
-            return {
-                'id': camera.id,
-                'physical_id': camera.physical_id,
-                'nombre': camera.nombre,
-                'zona': camera.zona,
-                'estado': camera.estado,
-                'resolucion': camera.resolucion
-            }
+            return self._to_dict(camera, redact=redact)
         finally:
             db.close()
 
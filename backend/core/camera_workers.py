@@ -0,0 +1,789 @@
+"""
+Modo workers: captura e inferencia en procesos separados del servidor web
+Cada worker es un proceso con su propio StreamHub y su propio modelo, dueño de un grupo
+de cámaras (captura, detección, alertas y escrituras en BD). Los frames y detecciones
+llegan al proceso de FastAPI por buffers en memoria compartida (ShmRing); por las colas
+solo viajan comandos y eventos pequeños. Un supervisor reinicia los workers caídos o
+colgados y reparte las cámaras entre los workers vivos
+"""
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+from backend.core import metrics
+from backend.core.logging_config import get_logger
+from backend.core.shm_ring import ShmRing, unlink_ring
+from backend.core.stream_hub import CameraStream, StreamHub
+
+load_dotenv()
+
+logger = get_logger("video")
+
+# Procesos de captura/inferencia (0 = todo en el proceso web, como antes)
+CAMERA_WORKERS = int(os.getenv("CAMERA_WORKERS", "0"))
+WORKER_HEARTBEAT = float(os.getenv("WORKER_HEARTBEAT", "1"))
+# Segundos sin latido antes de reiniciar un worker (el primero tarda más: imports y modelo)
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "15"))
+WORKER_START_TIMEOUT = float(os.getenv("WORKER_START_TIMEOUT", "60"))
+WORKER_OPEN_TIMEOUT = float(os.getenv("WORKER_OPEN_TIMEOUT", "20"))
+WORKER_RESTART_MAX_DELAY = float(os.getenv("WORKER_RESTART_MAX_DELAY", "30"))
+# Intervalo de lectura de los buffers compartidos en el proceso web (milisegundos)
+WORKER_POLL_MS = float(os.getenv("WORKER_POLL_MS", "5"))
+
+# Tamaño de cada slot de detecciones (JSON)
+RESULT_SLOT_SIZE = 256 * 1024
+# Segundos que un worker debe estar estable para repartirle cámaras o reiniciar su backoff
+WORKER_STABLE_AFTER = 5.0
+
+# Numeración de los buffers de detecciones creados por este worker
+_result_ring_ids = itertools.count(1)
+
+
+def _json_default(value):
+    """Tipos de numpy en detecciones -> tipos de Python"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+# ============= PROCESO WORKER =============
+
+class _Publisher:
+    def __init__(self, hub: StreamHub, camera_id: int, events, worker_index: int):
+        """
+        Publica los frames y detecciones de un stream local en memoria compartida
+        (los frames ya se capturan en el anillo compartido del stream: solo se anuncia)
+
+        Args:
+            hub: StreamHub del worker
+            camera_id: ID de la cámara configurada
+            events: Cola de eventos hacia el supervisor
+            worker_index: Índice de este worker
+        """
+        self.hub = hub
+        self.camera_id = camera_id
+        self._events = events
+        self._worker_index = worker_index
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stream: Optional[CameraStream] = None
+        self.detect = False
+        self._detecting = False
+        self._frame_ring = None
+        self.results: Optional[ShmRing] = None
+        self._thread = threading.Thread(target=self._run, name=f"publicador-cam{camera_id}", daemon=True)
+
+    @property
+    def alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, wait: float = 2.0):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=wait)
+
+    def set_detect(self, detect: bool):
+        """Activa o desactiva la detección del stream local (según los clientes del proceso web)"""
+        with self._lock:
+            self.detect = detect
+            self._sync_detect()
+
+    def _sync_detect(self):
+        if self.stream is None:
+            return
+        if self.detect and not self._detecting:
+            self.stream.add_subscriber(detect=True)
+            self._detecting = True
+        elif not self.detect and self._detecting:
+            self.stream.remove_subscriber(detect=True)
+            self._detecting = False
+
+    def _emit(self, kind: str, *args):
+        self._events.put((kind, self._worker_index, os.getpid(), self.camera_id) + args)
+
+    def _run(self):
+        stream = self.hub.subscribe(self.camera_id)
+        if stream is None:
+            self._emit('failed')
+            return
+        with self._lock:
+            self.stream = stream
+            self._sync_detect()
+
+        last_seq = 0
+        last_version = 0
+        try:
+            while not self._stop.is_set():
+                item = stream.wait_frame(last_seq, timeout=0.5)
+                if item is not None:
+                    last_seq = item.seq
+                    item.release()
+                    self._announce(stream)
+                elif not stream.running:
+                    break
+
+                version, result, result_json = stream.latest_result()
+                if version != last_version and result is not None and self.results is not None:
+                    last_version = version
+                    self._publish_result(result, result_json)
+        except Exception as e:
+            logger.exception("Error publicando camera_id=%s: %s", self.camera_id, e,
+                             extra={'camera_id': self.camera_id})
+        finally:
+            with self._lock:
+                if self._detecting:
+                    stream.remove_subscriber(detect=True)
+                    self._detecting = False
+                self.stream = None
+            self.hub.unsubscribe(stream)
+            if not self._stop.is_set():
+                # El stream terminó solo (cámara perdida sin reconexión posible)
+                self._emit('closed')
+            if self.results is not None:
+                self.results.close()
+                self.results = None
+
+    def _announce(self, stream: CameraStream):
+        """Avisa al proceso web cuando el stream crea su anillo (primer frame o cambio de resolución)"""
+        ring = stream.frame_ring
+        if ring is None or ring is self._frame_ring:
+            return
+        self._frame_ring = ring
+        if self.results is None:
+            name = f"eppv{os.getpid()}c{self.camera_id}n{next(_result_ring_ids)}r"
+            self.results = ShmRing.create(name, RESULT_SLOT_SIZE)
+        self._emit('ready', ring.name, self.results.name)
+
+    def _publish_result(self, result: Dict, result_json: str):
+        data = json.dumps({
+            'detections': result['detections'],
+            'compliance': result['compliance'],
+            'json': result_json,
+        }, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode()
+        if len(data) > self.results.slot_size:
+            logger.warning("Detección de %s bytes no cabe en memoria compartida (camera_id=%s)",
+                           len(data), self.camera_id, extra={'camera_id': self.camera_id, 'rate_key': self.camera_id})
+            return
+        self.results.write_bytes(data)
+
+
+def worker_main(index: int, commands, events):
+    """
+    Proceso worker: atiende los comandos del supervisor hasta 'stop' o hasta que
+    termine el proceso web
+
+    Comandos: (accion, camera_id, detect) con accion 'open' | 'detect' | 'close' | 'stop'
+    Eventos: (tipo, índice, pid, ...) con tipo 'started' | 'heartbeat' | 'ready' | 'failed'
+             | 'closed' | 'released'
+    """
+    # Ctrl+C llega a todo el grupo de procesos: el worker se detiene por comando del supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from backend.core.camera_config import camera_manager
+    from backend.core.camera_source import create_source, record_camera_state
+
+    sources = {}
+
+    def open_capture(camera_id: int):
+        cam_config = camera_manager.get_camera_by_id(camera_id, redact=False)
+        if cam_config is None:
+            return None
+        source = create_source(cam_config, on_state=record_camera_state)
+        if not source.open():
+            return None
+        sources[camera_id] = source
+        return source
+
+    def release_capture(camera_id: int):
+        source = sources.pop(camera_id, None)
+        if source is not None:
+            source.release()
+
+    # Anillos de frames en memoria compartida: el proceso web lee los frames sin copia intermedia
+    hub = StreamHub(open_capture=open_capture, release_capture=release_capture, shared_frames=True)
+    publishers: Dict[int, _Publisher] = {}
+    publishers_lock = threading.Lock()
+    stopping = threading.Event()
+    pid = os.getpid()
+    parent = multiprocessing.parent_process()
+
+    from backend.core.inference_scheduler import inference_scheduler
+    from backend.core.alert_counters import alert_counters
+    alert_counters.start_journal()
+    # Gauges del reparto de inferencias de este worker (el pool ya tiene su colector)
+    metrics.REGISTRY.add_collector(inference_scheduler.collect_metrics)
+
+    def heartbeat():
+        while not stopping.wait(WORKER_HEARTBEAT):
+            with publishers_lock:
+                cameras = sorted(publishers)
+            # El reparto de inferencias de este worker, los cambios en los conteos de alertas y las
+            # métricas viajan con el latido (GET /api/detector/schedule, /api/alerts/summary, /metrics)
+            events.put(('heartbeat', index, pid, None, cameras, inference_scheduler.allocation(),
+                        alert_counters.drain_journal(), metrics.REGISTRY.drain()))
+
+    threading.Thread(target=heartbeat, name=f"worker{index}-latido", daemon=True).start()
+    events.put(('started', index, pid, None))
+    logger.info("Worker %s iniciado (pid=%s)", index, pid)
+
+    try:
+        while True:
+            try:
+                action, camera_id, detect = commands.get(timeout=1.0)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    logger.warning("Worker %s: el proceso web terminó, saliendo", index)
+                    break
+                with publishers_lock:
+                    for cam in [c for c, p in publishers.items() if not p.alive]:
+                        del publishers[cam]
+                continue
+
+            if action == 'stop':
+                break
+            if action == 'open':
+                with publishers_lock:
+                    publisher = publishers.get(camera_id)
+                    if publisher is None or not publisher.alive:
+                        publisher = publishers[camera_id] = _Publisher(hub, camera_id, events, index)
+                        publisher.start()
+                publisher.set_detect(detect)
+            elif action == 'detect':
+                publisher = publishers.get(camera_id)
+                if publisher is not None:
+                    publisher.set_detect(detect)
+            elif action == 'close':
+                with publishers_lock:
+                    publisher = publishers.pop(camera_id, None)
+                if publisher is not None:
+                    publisher.stop()
+                # Liberar la cámara ya (otro worker puede necesitar abrirla)
+                hub.stop(camera_id)
+                events.put(('released', index, pid, camera_id))
+    finally:
+        stopping.set()
+        with publishers_lock:
+            running = list(publishers.values())
+            publishers.clear()
+        for publisher in running:
+            publisher.stop()
+        hub.stop_all()
+        try:
+            from backend.core.compliance_rollup import compliance_rollup
+            compliance_rollup.stop()
+        except Exception as e:
+            logger.error("Worker %s: error escribiendo resúmenes pendientes: %s", index, e)
+        logger.info("Worker %s detenido", index)
+
+
+# ============= PROCESO WEB =============
+
+class RemoteCapture:
+    def __init__(self, supervisor: "WorkerSupervisor", camera_id: int):
+        """
+        Captura servida por un worker: frames y detecciones desde memoria compartida
+        (solo el hilo lector del stream llama a frame_available/read_frame/read_result/release)
+
+        Args:
+            supervisor: Supervisor que asignó la cámara
+            camera_id: ID de la cámara configurada
+        """
+        self._supervisor = supervisor
+        self.camera_id = camera_id
+        self.closed = False
+        self._ready = threading.Event()
+        self._pending: Optional[Tuple[str, str]] = None
+        self.frames: Optional[ShmRing] = None
+        self.results: Optional[ShmRing] = None
+        self._frame_seq = 0
+        self._result_seq = 0
+
+    def attach(self, frames_name: str, results_name: str):
+        """Buffers nuevos del worker (primer frame, reasignación o cambio de resolución)"""
+        self._pending = (frames_name, results_name)
+        self._ready.set()
+
+    def mark_closed(self):
+        self.closed = True
+        self._ready.set()
+
+    def wait_ready(self, timeout: float) -> bool:
+        return self._ready.wait(timeout) and not self.closed
+
+    def set_detect(self, detect: bool):
+        self._supervisor.set_detect(self.camera_id, detect)
+
+    def _swap_rings(self):
+        frames_name, results_name = self._pending
+        self._pending = None
+        self._close_rings()
+        try:
+            self.frames = ShmRing.attach(frames_name)
+            self.results = ShmRing.attach(results_name)
+        except FileNotFoundError:
+            # El worker ya los reemplazó o terminó: llegará otro 'ready'
+            self._close_rings()
+            return
+        self._frame_seq = self._result_seq = 0
+
+    def frame_available(self) -> bool:
+        """Hay un frame nuevo desde la última lectura"""
+        if self._pending is not None:
+            self._swap_rings()
+        return self.frames is not None and self.frames.latest_seq() != self._frame_seq
+
+    def read_frame(self, out=None) -> Optional[object]:
+        """
+        Copia el frame más reciente del worker
+
+        Args:
+            out: Slot del anillo local donde copiarlo (se asigna uno nuevo si no coincide)
+
+        Returns:
+            Frame o None si no se logró una copia consistente
+        """
+        item = self.frames.read_frame(out)
+        if item is None:
+            return None
+        self._frame_seq, frame = item
+        return frame
+
+    def read_result(self) -> Optional[Dict]:
+        """Detección nueva desde la última llamada (o None)"""
+        if self.results is None or self.results.latest_seq() == self._result_seq:
+            return None
+        item = self.results.read_bytes()
+        if item is None:
+            return None
+        self._result_seq, data = item
+        return json.loads(data)
+
+    def _close_rings(self):
+        for ring in (self.frames, self.results):
+            if ring is not None:
+                ring.close()
+        self.frames = self.results = None
+
+    def release(self):
+        self._close_rings()
+
+
+class RemoteCameraStream(CameraStream):
+    """
+    Stream de una cámara servida por un worker: la captura, detección y alertas corren en
+    el worker; aquí solo se leen frames y detecciones y se reparten a los clientes
+    (render, encode y esperas son los de CameraStream)
+    """
+
+    def add_subscriber(self, detect: bool = False):
+        with self._cond:
+            super().add_subscriber(detect)
+            first = detect and self.detect_subscribers == 1
+        if first:
+            self.capture.set_detect(True)
+
+    def remove_subscriber(self, detect: bool = False):
+        with self._cond:
+            had = self.detect_subscribers
+            super().remove_subscriber(detect)
+            last = detect and had == 1 and self.detect_subscribers == 0
+        if last:
+            self.capture.set_detect(False)
+
+    def _capture_loop(self):
+        poll_interval = WORKER_POLL_MS / 1000
+        try:
+            while self.running:
+                if self.capture.closed:
+                    logger.error("El worker cerró camera_id=%s", self.camera_id,
+                                 extra={'camera_id': self.camera_id, 'rate_key': self.camera_id})
+                    break
+
+                frame = None
+                if self.capture.frame_available():
+                    # Copiar directamente del anillo del worker a un slot del anillo local
+                    index, buffer = self._acquire_buffer()
+                    frame = self.capture.read_frame(buffer)
+                    if frame is not None:
+                        # FRAMES_CAPTURED/FRAMES_DETECTED los cuenta el worker (llegan con el latido)
+                        self._publish_frame(frame, index)
+                    elif index is not None:
+                        self.frame_ring.release(index)
+
+                result = self.capture.read_result()
+                if result is not None:
+                    with self._cond:
+                        self.result = {'seq': self.seq, 'detections': result['detections'],
+                                       'compliance': result['compliance']}
+                        self.result_json = result['json']
+                        self.result_version += 1
+                        self.detected_seq = self.seq
+                        self._cond.notify_all()
+
+                if self._idle_expired():
+                    logger.info("Sin clientes para camera_id=%s, liberando cámara", self.camera_id,
+                                extra={'camera_id': self.camera_id})
+                    break
+                if frame is None and result is None:
+                    time.sleep(poll_interval)
+        finally:
+            self.stop()
+            self._on_stop(self)
+            if self.frame_ring is not None:
+                self.frame_ring.close()
+
+    def _detect_loop(self):
+        # La detección y las alertas corren en el worker
+        return
+
+
+class _WorkerSlot:
+    def __init__(self, index: int):
+        """Estado de un worker en el supervisor"""
+        self.index = index
+        self.process = None
+        self.commands = None
+        self.pid: Optional[int] = None
+        self.cameras: Dict[int, bool] = {}  # camera_id -> detección activa
+        self.rings: Set[str] = set()  # Buffers creados (se destruyen si el proceso muere)
+        self.schedule: Optional[Dict] = None  # Reparto de inferencias (último latido)
+        self.started_at = 0.0
+        self.last_seen = 0.0
+        self.restarts = 0
+        self.total_restarts = 0
+        self.next_start = 0.0
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def stable(self, now: float) -> bool:
+        """Worker vivo, que ya reportó y lleva un rato sin reiniciarse"""
+        return self.alive() and self.pid is not None and now - self.started_at >= WORKER_STABLE_AFTER
+
+
+class WorkerSupervisor:
+    def __init__(self, workers: int = None):
+        """
+        Lanza y vigila los procesos worker y les asigna cámaras
+
+        Args:
+            workers: Cantidad de procesos (CAMERA_WORKERS por defecto)
+        """
+        self.size = max(1, workers or CAMERA_WORKERS)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._events = None
+        self._slots: List[_WorkerSlot] = [_WorkerSlot(i) for i in range(self.size)]
+        self._assignments: Dict[int, int] = {}  # camera_id -> índice de worker
+        self._moves: Dict[int, Tuple[int, int]] = {}  # camera_id -> (worker origen, destino)
+        self._handles: Dict[int, RemoteCapture] = {}
+        self._lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+
+    # ---------- Ciclo de vida ----------
+
+    def start(self):
+        """Lanza los workers y el hilo supervisor (idempotente)"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._events = self._ctx.Queue()
+            for slot in self._slots:
+                self._spawn(slot)
+        self._thread = threading.Thread(target=self._monitor, name="supervisor-workers", daemon=True)
+        self._thread.start()
+        logger.info("Modo workers: %s proceso(s) de captura/inferencia", self.size)
+
+    def stop(self, wait: float = 5.0):
+        """Detiene todos los workers"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            slots = list(self._slots)
+            for slot in slots:
+                self._send(slot, ('stop', None, False))
+        deadline = time.monotonic() + wait
+        for slot in slots:
+            if slot.process is not None:
+                slot.process.join(timeout=max(0.1, deadline - time.monotonic()))
+                if slot.process.is_alive():
+                    slot.process.kill()
+                    slot.process.join(timeout=1)
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        with self._lock:
+            for handle in self._handles.values():
+                handle.mark_closed()
+            self._handles.clear()
+            self._assignments.clear()
+            self._moves.clear()
+            for slot in self._slots:
+                slot.cameras.clear()
+                metrics.REGISTRY.forget(str(slot.index))
+
+    def _spawn(self, slot: _WorkerSlot):
+        slot.commands = self._ctx.Queue()
+        slot.process = self._ctx.Process(
+            target=worker_main, args=(slot.index, slot.commands, self._events),
+            name=f"epp-worker-{slot.index}", daemon=True)
+        slot.process.start()
+        slot.pid = None
+        slot.rings.clear()
+        slot.started_at = slot.last_seen = time.monotonic()
+
+    @staticmethod
+    def _send(slot: _WorkerSlot, command: Tuple):
+        if slot.commands is not None:
+            try:
+                slot.commands.put(command)
+            except (ValueError, OSError):
+                # Cola cerrada: el worker se está reiniciando
+                pass
+
+    # ---------- Cámaras ----------
+
+    def open(self, camera_id: int) -> Optional[RemoteCapture]:
+        """
+        Asigna una cámara a un worker y espera su primer frame (open_capture del hub)
+
+        Returns:
+            RemoteCapture o None si el worker no pudo abrir la cámara
+        """
+        self.start()
+        handle = RemoteCapture(self, camera_id)
+        with self._lock:
+            self._handles[camera_id] = handle
+            self._assign(camera_id, False)
+        if not handle.wait_ready(WORKER_OPEN_TIMEOUT):
+            logger.error("Ningún worker pudo abrir camera_id=%s", camera_id,
+                         extra={'camera_id': camera_id, 'rate_key': camera_id})
+            self.close(camera_id)
+            return None
+        return handle
+
+    def close(self, camera_id: int):
+        """Libera la cámara en su worker (release_capture del hub)"""
+        with self._lock:
+            handle = self._handles.pop(camera_id, None)
+            index = self._assignments.pop(camera_id, None)
+            self._moves.pop(camera_id, None)
+            if index is not None:
+                slot = self._slots[index]
+                slot.cameras.pop(camera_id, None)
+                self._send(slot, ('close', camera_id, False))
+        if handle is not None:
+            handle.release()
+
+    def set_detect(self, camera_id: int, detect: bool):
+        with self._lock:
+            index = self._assignments.get(camera_id)
+            if index is None:
+                return
+            slot = self._slots[index]
+            slot.cameras[camera_id] = detect
+            if camera_id not in self._moves:
+                self._send(slot, ('detect', camera_id, detect))
+
+    def _assign(self, camera_id: int, detect: bool, exclude: _WorkerSlot = None):
+        """Asigna la cámara al worker vivo con menos cámaras"""
+        candidates = [s for s in self._slots if s is not exclude]
+        alive = [s for s in candidates if s.alive()]
+        slot = min(alive or candidates or self._slots, key=lambda s: len(s.cameras))
+        slot.cameras[camera_id] = detect
+        self._assignments[camera_id] = slot.index
+        self._send(slot, ('open', camera_id, detect))
+
+    # ---------- Supervisión ----------
+
+    def _monitor(self):
+        last_check = 0.0
+        while self.running:
+            try:
+                event = self._events.get(timeout=0.5)
+            except queue.Empty:
+                event = None
+            except (EOFError, OSError):
+                break
+            if event is not None:
+                try:
+                    self._handle_event(event)
+                except Exception as e:
+                    logger.exception("Error procesando evento de worker %s: %s", event[:2], e)
+
+            now = time.monotonic()
+            if now - last_check >= 1.0:
+                last_check = now
+                try:
+                    with self._lock:
+                        if self.running:
+                            self._check_workers(now)
+                            self._rebalance(now)
+                except Exception as e:
+                    logger.exception("Error supervisando workers: %s", e)
+
+    def _handle_event(self, event: Tuple):
+        kind, index, pid, camera_id = event[:4]
+        with self._lock:
+            slot = self._slots[index]
+            if kind == 'started':
+                slot.pid = pid
+                slot.last_seen = time.monotonic()
+                # Gauges del proceso anterior de este worker
+                metrics.REGISTRY.forget(str(index))
+                return
+            # Eventos de un proceso anterior del mismo worker
+            if pid != slot.pid:
+                return
+            slot.last_seen = time.monotonic()
+            if kind == 'heartbeat':
+                slot.schedule = event[5]
+                if event[6]:
+                    from backend.core.alert_counters import alert_counters
+                    alert_counters.apply(event[6])
+                metrics.REGISTRY.merge(str(index), event[7])
+                return
+            if kind == 'ready':
+                slot.rings.update(event[4:6])
+
+            if kind == 'released':
+                move = self._moves.get(camera_id)
+                if move is not None and move[0] == index:
+                    # Mudanza: el worker anterior ya soltó la cámara, abrirla en el nuevo
+                    del self._moves[camera_id]
+                    target = self._slots[move[1]]
+                    self._send(target, ('open', camera_id, target.cameras.get(camera_id, False)))
+                return
+
+            if self._assignments.get(camera_id) != index:
+                return
+            handle = self._handles.get(camera_id)
+            if kind == 'ready':
+                if handle is not None:
+                    handle.attach(*event[4:6])
+            elif kind in ('failed', 'closed'):
+                slot.cameras.pop(camera_id, None)
+                self._assignments.pop(camera_id, None)
+                if handle is not None:
+                    handle.mark_closed()
+
+    def _check_workers(self, now: float):
+        """Reinicia workers terminados o sin latido y reasigna sus cámaras"""
+        for slot in self._slots:
+            if slot.process is None:
+                if now >= slot.next_start:
+                    self._spawn(slot)
+                continue
+
+            alive = slot.process.is_alive()
+            timeout = WORKER_HEARTBEAT_TIMEOUT if slot.pid is not None else WORKER_START_TIMEOUT
+            if alive and now - slot.last_seen <= timeout:
+                if slot.restarts and now - slot.started_at > 60:
+                    slot.restarts = 0
+                continue
+
+            if alive:
+                logger.error("Worker %s sin responder hace %.0fs, reiniciando", slot.index, now - slot.last_seen)
+                slot.process.kill()
+            else:
+                logger.error("Worker %s terminó (código %s), reiniciando", slot.index, slot.process.exitcode)
+            slot.process.join(timeout=1)
+            for name in slot.rings:
+                unlink_ring(name)
+            slot.process = None
+            slot.pid = None
+            slot.commands = None
+            slot.restarts += 1
+            slot.total_restarts += 1
+            slot.next_start = now + min(2 ** (slot.restarts - 1), WORKER_RESTART_MAX_DELAY)
+            metrics.WORKER_RESTARTS.inc(slot.index)
+
+            # Cámaras del worker caído (y mudanzas que esperaban que las soltara) a otros workers
+            orphans, slot.cameras = slot.cameras, {}
+            for camera_id, detect in orphans.items():
+                self._moves.pop(camera_id, None)
+                self._assign(camera_id, detect, exclude=slot)
+            for camera_id, (source, target) in list(self._moves.items()):
+                if source == slot.index:
+                    del self._moves[camera_id]
+                    destination = self._slots[target]
+                    self._send(destination, ('open', camera_id, destination.cameras.get(camera_id, False)))
+
+    def _rebalance(self, now: float):
+        """Muda una cámara por ciclo del worker más cargado al menos cargado"""
+        if self._moves:
+            return
+        stable = [s for s in self._slots if s.stable(now)]
+        if len(stable) < 2:
+            return
+        busiest = max(stable, key=lambda s: len(s.cameras))
+        idlest = min(stable, key=lambda s: len(s.cameras))
+        if len(busiest.cameras) - len(idlest.cameras) <= 1:
+            return
+
+        camera_id, detect = next(iter(busiest.cameras.items()))
+        logger.info("Mudando camera_id=%s del worker %s al %s", camera_id, busiest.index, idlest.index)
+        del busiest.cameras[camera_id]
+        idlest.cameras[camera_id] = detect
+        self._assignments[camera_id] = idlest.index
+        # Primero se libera en el origen (una cámara USB no se puede abrir dos veces)
+        self._moves[camera_id] = (busiest.index, idlest.index)
+        self._send(busiest, ('close', camera_id, False))
+
+    def status(self) -> List[Dict]:
+        """Estado de cada worker"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'worker': slot.index,
+                'pid': slot.pid,
+                'alive': slot.alive(),
+                'cameras': sorted(slot.cameras),
+                'uptime_s': round(now - slot.started_at, 1) if slot.alive() else 0,
+                'last_heartbeat_s': round(now - slot.last_seen, 1) if slot.alive() else None,
+                'restarts': slot.total_restarts,
+            } for slot in self._slots]
+
+    def schedules(self) -> List[Dict]:
+        """Reparto de inferencias de cada worker vivo (según su último latido)"""
+        with self._lock:
+            return [dict(slot.schedule, worker=slot.index) for slot in self._slots
+                    if slot.alive() and slot.schedule is not None]
+
+    def collect_metrics(self):
+        """Gauges de workers vivos y cámaras por worker (colector de /metrics)"""
+        if not self.running:
+            return
+        workers = self.status()
+        metrics.WORKERS_ALIVE.set(sum(1 for w in workers if w['alive']))
+        for worker in workers:
+            metrics.WORKER_CAMERAS.set(len(worker['cameras']), worker['worker'])
+
+
+class WorkerStreamHub(StreamHub):
+    # Streams que leen de memoria compartida en lugar de capturar
+    stream_class = RemoteCameraStream
+
+    def __init__(self, supervisor: WorkerSupervisor = None):
+        """
+        StreamHub del proceso web en modo workers (misma interfaz que StreamHub)
+
+        Args:
+            supervisor: Supervisor de workers (uno nuevo con CAMERA_WORKERS procesos por defecto)
+        """
+        self.supervisor = supervisor or WorkerSupervisor()
+        super().__init__(open_capture=self.supervisor.open, release_capture=self.supervisor.close)
+
+    def stop_all(self, wait: float = 2.0):
+        super().stop_all(wait=wait)
+        self.supervisor.stop()
@@ -0,0 +1,298 @@
+"""
+Subida de videos por partes (reanudable)
+init -> PUT chunk (por offset) -> complete, con escritura en buffers grandes alineados,
+cuotas de tamaño y lectura de metadatos desde los primeros chunks
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+from backend.core.logging_config import get_logger
+load_dotenv()
+
+logger = get_logger("video")
+
+ALLOWED_EXTENSIONS = ['.mp4', '.avi', '.mov', '.mkv']
+
+# Buffer de escritura: múltiplo del tamaño de página/bloque del disco
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+RECOMMENDED_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Cuotas
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "8192")) * 1024 * 1024
+TEMP_VIDEO_QUOTA_BYTES = int(os.getenv("TEMP_VIDEO_QUOTA_MB", "32768")) * 1024 * 1024
+
+# Intentar leer metadatos al llegar a este tamaño y luego cada PROBE_RETRY_BYTES
+PROBE_MIN_BYTES = 4 * 1024 * 1024
+PROBE_RETRY_BYTES = 32 * 1024 * 1024
+
+# Subidas sin actividad durante este tiempo se descartan
+UPLOAD_STALE_SECONDS = 6 * 3600
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status_code: int = 400, offset: int = None):
+        """Error de subida con el código HTTP sugerido (y el offset actual para reanudar)"""
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+def probe_video(path: str) -> Optional[Dict]:
+    """
+    Lee metadatos de un video (completo o parcial)
+
+    Returns:
+        Diccionario con total_frames, fps, duration, width, height o None si aún no se puede leer
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(str(path))
+    try:
+        if not cap.isOpened():
+            return None
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if width <= 0 or height <= 0:
+            return None
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        return {
+            'total_frames': max(total_frames, 0),
+            'fps': fps,
+            'duration': total_frames / fps if fps > 0 else 0,
+            'width': width,
+            'height': height
+        }
+    finally:
+        cap.release()
+
+
+class UploadSession:
+    def __init__(self, upload_id: str, filename: str, total_size: int, path: Path):
+        """Estado de una subida en curso"""
+        self.upload_id = upload_id
+        self.filename = filename
+        self.total_size = total_size
+        self.path = path
+        self.received = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.completed = False
+        self.metadata: Optional[Dict] = None
+        self.sha256 = hashlib.sha256()  # Hash incremental (los chunks llegan en orden)
+        self.content_hash: Optional[str] = None
+        self._next_probe_at = PROBE_MIN_BYTES
+        self.lock = threading.Lock()
+
+    def to_dict(self) -> Dict:
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.total_size,
+            'received': self.received,
+            'completed': self.completed,
+            'probed': self.metadata is not None,
+            'chunk_size': RECOMMENDED_CHUNK_SIZE
+        }
+
+
+class ChunkedUploadManager:
+    def __init__(self, upload_dir: Path):
+        """
+        Gestiona subidas reanudables al directorio temporal de videos
+
+        Args:
+            upload_dir: Directorio donde se escriben los videos
+        """
+        self.upload_dir = Path(upload_dir)
+        self.upload_dir.mkdir(exist_ok=True)
+        self._sessions: Dict[str, UploadSession] = {}
+        self._lock = threading.Lock()
+
+    def _used_bytes(self) -> int:
+        """Bytes ocupados en disco más los reservados por subidas en curso"""
+        on_disk = sum(f.stat().st_size for f in self.upload_dir.iterdir() if f.is_file())
+        pending = sum(s.total_size - s.received for s in self._sessions.values() if not s.completed)
+        return on_disk + pending
+
+    def init_upload(self, filename: str, size: int) -> UploadSession:
+        """Registra una subida nueva y reserva su espacio en la cuota"""
+        extension = Path(filename).suffix.lower()
+        if extension not in ALLOWED_EXTENSIONS:
+            raise UploadError(f"Formato no soportado. Use: {', '.join(ALLOWED_EXTENSIONS)}")
+        if size <= 0:
+            raise UploadError("Tamaño de archivo inválido")
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadError(f"El archivo supera el máximo de {MAX_UPLOAD_BYTES // (1024 * 1024)} MB", 413)
+
+        self.cleanup_stale()
+        with self._lock:
+            if self._used_bytes() + size > TEMP_VIDEO_QUOTA_BYTES:
+                raise UploadError("No hay espacio disponible para videos temporales", 507)
+
+            upload_id = str(uuid.uuid4())
+            path = self.upload_dir / f"{upload_id}{extension}"
+            path.touch()
+            session = UploadSession(upload_id, filename, size, path)
+            self._sessions[upload_id] = session
+
+        logger.info("Subida %s iniciada: %s (%.1f MB)", upload_id, filename, size / 1024 / 1024)
+        return session
+
+    def get_session(self, upload_id: str) -> UploadSession:
+        session = self._sessions.get(upload_id)
+        if session is None:
+            raise UploadError("Subida no encontrada", 404)
+        return session
+
+    def open_chunk(self, upload_id: str, offset: int) -> "ChunkWriter":
+        """
+        Prepara la escritura de un chunk en el offset indicado
+
+        Raises:
+            UploadError 409 si el offset no coincide con lo recibido (el cliente debe reanudar desde ahí)
+            UploadError 423 si todavía se está recibiendo un chunk anterior (reintentar con espera)
+        """
+        session = self.get_session(upload_id)
+        if not session.lock.acquire(blocking=False):
+            raise UploadError("Ya se está recibiendo un chunk para esta subida", 423, session.received)
+        if session.completed:
+            session.lock.release()
+            raise UploadError("La subida ya fue completada", 409, session.received)
+        if offset != session.received:
+            session.lock.release()
+            raise UploadError("Offset inesperado", 409, session.received)
+        try:
+            return ChunkWriter(session)
+        except Exception:
+            session.lock.release()
+            raise
+
+    def complete(self, upload_id: str) -> UploadSession:
+        """Verifica que llegó todo el archivo y lee sus metadatos finales"""
+        session = self.get_session(upload_id)
+        with session.lock:
+            if session.received != session.total_size:
+                raise UploadError(f"Faltan {session.total_size - session.received} bytes", 409, session.received)
+            if not session.completed:
+                session.completed = True
+                session.content_hash = session.sha256.hexdigest()
+                session.metadata = probe_video(str(session.path)) or session.metadata
+            if session.metadata is None:
+                raise UploadError("No se pudo leer el video", 422)
+        return session
+
+    def abort(self, upload_id: str):
+        """Cancela una subida y borra el archivo parcial"""
+        with self._lock:
+            session = self._sessions.pop(upload_id, None)
+        if session is None:
+            raise UploadError("Subida no encontrada", 404)
+        if not session.completed and session.path.exists():
+            session.path.unlink()
+
+    def forget(self, upload_id: str):
+        """Olvida una subida completada (el archivo pasa a ser un video normal)"""
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+
+    def cleanup_stale(self):
+        """Borra subidas incompletas sin actividad"""
+        now = time.time()
+        with self._lock:
+            stale = [s for s in self._sessions.values()
+                     if not s.completed and now - s.updated_at > UPLOAD_STALE_SECONDS]
+            for session in stale:
+                del self._sessions[session.upload_id]
+        for session in stale:
+            if session.path.exists():
+                session.path.unlink()
+            logger.info("Subida abandonada eliminada: %s", session.upload_id)
+
+
+class ChunkWriter:
+    def __init__(self, session: UploadSession):
+        """Escribe un chunk en buffers grandes; se usa con 'with' y write()/flush()"""
+        self.session = session
+        self.limit = min(MAX_CHUNK_SIZE, session.total_size - session.received)
+        self.written = 0
+        self._buffer = bytearray()
+        self._file = open(session.path, "r+b", buffering=0)
+        self._file.seek(session.received)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._file.close()
+            self.session.lock.release()
+        return False
+
+    def feed(self, data: bytes) -> bool:
+        """
+        Acumula datos del cuerpo de la petición
+
+        Returns:
+            True si el buffer llegó a WRITE_BUFFER_SIZE y conviene llamar a write_buffer()
+        """
+        if self.written + len(self._buffer) + len(data) > self.limit:
+            raise UploadError("El chunk excede el tamaño permitido", 413, self.session.received)
+        self._buffer += data
+        return len(self._buffer) >= WRITE_BUFFER_SIZE
+
+    def write_buffer(self):
+        """Escribe los bloques completos del buffer (bloqueante: llamar fuera del event loop)"""
+        full = len(self._buffer) - len(self._buffer) % WRITE_BUFFER_SIZE
+        if full:
+            view = memoryview(self._buffer)
+            try:
+                self._write(view[:full])
+            finally:
+                view.release()
+            del self._buffer[:full]
+
+    def flush(self):
+        """Escribe lo que quede en el buffer (bloqueante)"""
+        if self._buffer:
+            view = memoryview(self._buffer)
+            try:
+                self._write(view)
+            finally:
+                view.release()
+            self._buffer = bytearray()
+
+    def _write(self, data: memoryview):
+        # FileIO sin buffer puede escribir menos de lo pedido: completar antes de contar los bytes
+        pending = data
+        while pending:
+            written = self._file.write(pending)
+            if not written:
+                raise OSError("No se pudo escribir el chunk en disco")
+            pending = pending[written:]
+        session = self.session
+        session.sha256.update(data)
+        self.written += len(data)
+        session.received += len(data)
+        session.updated_at = time.time()
+
+    def probe_if_due(self) -> Optional[Dict]:
+        """Intenta leer metadatos del prefijo ya escrito (bloqueante)"""
+        session = self.session
+        if session.metadata is not None or session.received < session._next_probe_at:
+            return session.metadata
+        session._next_probe_at = session.received + PROBE_RETRY_BYTES
+        session.metadata = probe_video(str(session.path))
+        if session.metadata is not None:
+            logger.info("Metadatos leídos con %.1f MB recibidos", session.received / 1024 / 1024)
+        return session.metadata
@@ -0,0 +1,122 @@
+"""
+Filtro temporal del cumplimiento de EPP por cámara
+classify_compliance mira un solo frame: un guante o unas gafas que caen un frame por
+debajo del umbral de confianza cambian el estado de C a I y disparan una alerta. El
+filtro suaviza la presencia de la persona y de cada EPP en el tiempo (todos los tipos a
+la vez con numpy) y solo cambia de estado cuando el cambio persiste, tanto al empezar
+un incumplimiento como al corregirlo
+"""
+import os
+import time
+from typing import Dict, List
+import numpy as np
+from dotenv import load_dotenv
+from backend.core.epp_detector import compliance_from_status
+
+load_dotenv()
+
+# Modo: votos (N de los últimos M frames), ema (media móvil exponencial) u off (frame a frame)
+COMPLIANCE_FILTER = os.getenv("COMPLIANCE_FILTER", "votos").lower()
+# Votación: un EPP cambia de estado si aparece (o falta) en VOTE_MIN de los últimos VOTE_WINDOW frames analizados
+COMPLIANCE_VOTE_WINDOW = int(os.getenv("COMPLIANCE_VOTE_WINDOW", "10"))
+COMPLIANCE_VOTE_MIN = int(os.getenv("COMPLIANCE_VOTE_MIN", "7"))
+# EMA: peso del frame nuevo y banda de histéresis alrededor de 0.5
+COMPLIANCE_EMA_ALPHA = float(os.getenv("COMPLIANCE_EMA_ALPHA", "0.3"))
+COMPLIANCE_EMA_BAND = float(os.getenv("COMPLIANCE_EMA_BAND", "0.2"))
+
+FILTER_MODES = ('votos', 'ema', 'off')
+# Segundos sin frames analizados tras los que la historia ya no describe la escena
+MAX_GAP_SECONDS = 10.0
+
+
+class ComplianceFilter:
+    def __init__(self, epp_types: List[str], mode: str = None, window: int = None, votes: int = None,
+                 alpha: float = None, band: float = None):
+        """
+        Estado suavizado de una cámara
+
+        Args:
+            epp_types: EPP evaluados (mismo orden que epp_status)
+            mode: 'votos', 'ema' u 'off' (COMPLIANCE_FILTER por defecto)
+            window: Frames de la ventana de votación (M)
+            votes: Votos necesarios para cambiar de estado (N, mayoría de M como mínimo)
+            alpha: Peso del frame nuevo en la EMA (0-1)
+            band: Histéresis de la EMA: cambia a presente sobre 0.5+band y a ausente bajo 0.5-band
+        """
+        mode = (mode or COMPLIANCE_FILTER).lower()
+        if mode not in FILTER_MODES:
+            raise ValueError(f"Modo de filtro inválido: {mode} (use {', '.join(FILTER_MODES)})")
+        self.mode = mode
+        self.epp_types = list(epp_types)
+
+        self.window = max(1, window or COMPLIANCE_VOTE_WINDOW)
+        # Con N <= M/2 ambos estados podrían ganar a la vez
+        self.votes = min(self.window, max(self.window // 2 + 1, votes or COMPLIANCE_VOTE_MIN))
+        self.alpha = min(1.0, max(0.01, alpha if alpha is not None else COMPLIANCE_EMA_ALPHA))
+        band = band if band is not None else COMPLIANCE_EMA_BAND
+        self.band = min(0.49, max(0.0, band))
+
+        self.reset()
+
+    def reset(self):
+        """Olvida la historia (p.ej. al reconectar la cámara)"""
+        # Columna 0: persona en escena; columnas 1..K: cada EPP presente
+        size = len(self.epp_types) + 1
+        # Estado inicial: sin persona y EPP completo (un incumplimiento también debe persistir al arrancar)
+        self._state = np.ones(size, dtype=bool)
+        self._state[0] = False
+        self._ema = self._state.astype(np.float32)
+        self._obs = np.zeros((self.window, size), dtype=bool)
+        self._valid = np.zeros((self.window, size), dtype=bool)
+        self._pos = 0
+        self._last_update = 0.0
+
+    def update(self, compliance: Dict) -> Dict:
+        """
+        Agrega la clasificación de un frame y devuelve la clasificación suavizada
+
+        Args:
+            compliance: Resultado de classify_compliance() del frame
+
+        Returns:
+            Clasificación con el mismo formato (estado, score, epp_status, ...) calculada sobre el
+            estado suavizado, más 'estado_frame' con el estado del frame solo
+        """
+        if self.mode == 'off':
+            return dict(compliance, estado_frame=compliance['estado'])
+
+        now = time.monotonic()
+        if self._last_update and now - self._last_update > MAX_GAP_SECONDS:
+            # Detección pausada (sin clientes) o cámara reconectada
+            self.reset()
+        self._last_update = now
+
+        person = bool(compliance['person_detected'])
+        epp_status = compliance['epp_status']
+        obs = np.fromiter((epp_status.get(epp, False) for epp in self.epp_types),
+                          dtype=bool, count=len(self.epp_types))
+        obs = np.concatenate(([person], obs))
+        # Sin persona en el frame los EPP no se observan (no cuentan como ausentes)
+        valid = np.full(obs.shape, person)
+        valid[0] = True
+
+        if self.mode == 'votos':
+            self._obs[self._pos] = obs
+            self._valid[self._pos] = valid
+            self._pos = (self._pos + 1) % self.window
+            present = np.count_nonzero(self._obs & self._valid, axis=0)
+            absent = np.count_nonzero(~self._obs & self._valid, axis=0)
+            rise = present >= self.votes
+            fall = absent >= self.votes
+        else:
+            self._ema = np.where(valid, self.alpha * obs + (1 - self.alpha) * self._ema, self._ema)
+            rise = self._ema >= 0.5 + self.band
+            fall = self._ema <= 0.5 - self.band
+
+        # Histéresis: fuera de los umbrales se mantiene el estado anterior
+        self._state = np.where(rise, True, np.where(fall, False, self._state))
+
+        smoothed = compliance_from_status(
+            dict(zip(self.epp_types, self._state[1:].tolist())), bool(self._state[0]))
+        smoothed['estado_frame'] = compliance['estado']
+        return smoothed
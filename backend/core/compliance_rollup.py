@@ -0,0 +1,495 @@
+"""
+Resúmenes de cumplimiento por periodo (minuto, hora, día)
+Las muestras de cumplimiento y las alertas se acumulan en memoria y se escriben
+cada pocos segundos como incrementos sobre las tablas de resumen, así el dashboard
+y los reportes no recorren las tablas crudas de detecciones
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import update, delete, and_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from backend.core.database import (SessionLocal, engine, ResumenCumplimiento, ResumenFaltaEPP,
+                                   Deteccion, DeteccionEPP, Alerta, TipoEPP, Camera)
+
+from backend.core.logging_config import get_logger
+load_dotenv()
+
+logger = get_logger("db")
+
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))
+
+GRANULARIDADES = ('minuto', 'hora', 'dia')
+ESTADOS_MUESTRA = {'C': 'muestras_c', 'I': 'muestras_i', 'N': 'muestras_n'}
+SEVERIDADES = {'baja': 'alertas_baja', 'media': 'alertas_media', 'alta': 'alertas_alta', 'critica': 'alertas_critica'}
+CONTADORES = list(ESTADOS_MUESTRA.values()) + list(SEVERIDADES.values())
+
+# Granularidad automática según el rango consultado (acota las filas leídas)
+MAX_RANGO_MINUTO = timedelta(hours=6)
+MAX_RANGO_HORA = timedelta(days=14)
+
+
+def bucket_start(ts: datetime, granularidad: str) -> datetime:
+    """Inicio del periodo que contiene ts"""
+    if granularidad == 'minuto':
+        return ts.replace(second=0, microsecond=0)
+    if granularidad == 'hora':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    if granularidad == 'dia':
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Granularidad inválida: {granularidad}")
+
+
+def auto_granularidad(desde: datetime, hasta: datetime) -> str:
+    """Granularidad adecuada para graficar el rango"""
+    rango = hasta - desde
+    if rango <= MAX_RANGO_MINUTO:
+        return 'minuto'
+    if rango <= MAX_RANGO_HORA:
+        return 'hora'
+    return 'dia'
+
+
+class _Acumulado:
+    """Incrementos pendientes por (cámara, minuto)"""
+
+    def __init__(self):
+        self.contadores: Dict[Tuple[int, datetime], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.faltas: Dict[Tuple[int, datetime, str], int] = defaultdict(int)
+
+    def __bool__(self):
+        return bool(self.contadores) or bool(self.faltas)
+
+    def expand(self) -> Tuple[Dict, Dict]:
+        """Reparte los incrementos por minuto en las tres granularidades"""
+        contadores = defaultdict(lambda: defaultdict(int))
+        faltas = defaultdict(int)
+        for (camera_id, minuto), valores in self.contadores.items():
+            for granularidad in GRANULARIDADES:
+                destino = contadores[(camera_id, granularidad, bucket_start(minuto, granularidad))]
+                for columna, n in valores.items():
+                    destino[columna] += n
+        for (camera_id, minuto, epp), n in self.faltas.items():
+            for granularidad in GRANULARIDADES:
+                faltas[(camera_id, granularidad, bucket_start(minuto, granularidad), epp)] += n
+        return contadores, faltas
+
+
+class ComplianceRollup:
+    def __init__(self, flush_interval: float = ROLLUP_FLUSH_INTERVAL):
+        """
+        Mantiene las tablas resumen_cumplimiento y resumen_faltas_epp
+
+        Args:
+            flush_interval: Segundos entre escrituras a la base de datos
+        """
+        self.flush_interval = flush_interval
+        self._pending = _Acumulado()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._tables_ready = False
+
+    def _get_db(self) -> Session:
+        """Sesión de base de datos (crea las tablas la primera vez)"""
+        if not self._tables_ready:
+            ResumenCumplimiento.__table__.create(bind=engine, checkfirst=True)
+            ResumenFaltaEPP.__table__.create(bind=engine, checkfirst=True)
+            self._tables_ready = True
+        return SessionLocal()
+
+    # ---------- Registro (llamado desde los hilos de detección) ----------
+
+    def record_sample(self, camera_id: int, compliance: Dict, ts: datetime = None):
+        """
+        Registra una muestra de cumplimiento de una cámara (ignora el estado P, sin persona)
+
+        Args:
+            camera_id: ID de la cámara
+            compliance: Resultado de classify_compliance()
+            ts: Momento de la muestra (por defecto ahora)
+        """
+        columna = ESTADOS_MUESTRA.get(compliance['estado'])
+        if columna is None:
+            return
+        minuto = bucket_start(ts or datetime.now(), 'minuto')
+        with self._lock:
+            self._pending.contadores[(camera_id, minuto)][columna] += 1
+            if compliance['estado'] != 'C':
+                for epp, present in compliance['epp_status'].items():
+                    if not present:
+                        self._pending.faltas[(camera_id, minuto, epp)] += 1
+        self._ensure_started()
+
+    def record_alert(self, camera_id: int, severidad: str, ts: datetime = None):
+        """Registra una alerta generada"""
+        columna = SEVERIDADES.get(severidad)
+        if columna is None:
+            return
+        minuto = bucket_start(ts or datetime.now(), 'minuto')
+        with self._lock:
+            self._pending.contadores[(camera_id, minuto)][columna] += 1
+        self._ensure_started()
+
+    # ---------- Escritura ----------
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._loop, name="resumen-cumplimiento", daemon=True)
+                    self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        """Detiene el hilo y escribe lo pendiente"""
+        self._stop.set()
+        self.flush()
+
+    def flush(self) -> int:
+        """
+        Escribe los incrementos pendientes
+
+        Returns:
+            Filas de resumen actualizadas o insertadas
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, _Acumulado()
+            if not pending:
+                return 0
+
+            contadores, faltas = pending.expand()
+            db = self._get_db()
+            try:
+                for (camera_id, granularidad, bucket), valores in contadores.items():
+                    self._upsert(db, ResumenCumplimiento,
+                                 dict(camera_id=camera_id, granularidad=granularidad, bucket=bucket), valores)
+                for (camera_id, granularidad, bucket, epp), n in faltas.items():
+                    self._upsert(db, ResumenFaltaEPP,
+                                 dict(camera_id=camera_id, granularidad=granularidad, bucket=bucket, epp=epp),
+                                 {'faltas': n})
+                db.commit()
+                return len(contadores) + len(faltas)
+            except Exception as e:
+                db.rollback()
+                logger.error("No se pudieron escribir los resúmenes: %s", e)
+                # Devolver los incrementos para el próximo intento
+                self._merge_back(pending)
+                return 0
+            finally:
+                db.close()
+
+    def _merge_back(self, pending: _Acumulado):
+        with self._lock:
+            for key, valores in pending.contadores.items():
+                for columna, n in valores.items():
+                    self._pending.contadores[key][columna] += n
+            for key, n in pending.faltas.items():
+                self._pending.faltas[key] += n
+
+    @staticmethod
+    def _upsert(db: Session, model, keys: Dict, deltas: Dict[str, int]):
+        """UPDATE col = col + n; si la fila no existe, INSERT (portable entre MySQL y SQLite)"""
+        condition = and_(*[getattr(model, k) == v for k, v in keys.items()])
+        values = {col: getattr(model, col) + n for col, n in deltas.items()}
+        if db.execute(update(model).where(condition).values(**values)).rowcount:
+            return
+        try:
+            with db.begin_nested():
+                db.add(model(**keys, **deltas))
+        except IntegrityError:
+            # Otro proceso insertó la fila entre el UPDATE y el INSERT
+            db.execute(update(model).where(condition).values(**values))
+
+    # ---------- Reconstrucción desde las tablas crudas ----------
+
+    def backfill(self, desde: datetime, hasta: datetime, batch_size: int = 5000) -> Dict:
+        """
+        Reconstruye los resúmenes de un rango desde detecciones, detecciones_epp y alertas
+
+        Se procesa día por día: se borran los resúmenes del día y se vuelven a calcular.
+        Solo las detecciones guardadas cuentan como muestras (las muestras C en vivo
+        no se guardan como detecciones, así que no se pueden reconstruir): el rango se
+        recorta al primer resumen existente para no reemplazar historia en vivo.
+
+        Args:
+            desde: Inicio del rango (se ajusta al inicio del día)
+            hasta: Fin del rango (exclusivo; como máximo first_bucket())
+            batch_size: Filas leídas por lote
+
+        Returns:
+            Totales procesados
+        """
+        self.flush()
+        limite = self.first_bucket()
+        if limite is not None and hasta > limite:
+            logger.warning("Reconstrucción recortada a %s: desde ahí hay resúmenes en vivo", limite.date())
+            hasta = limite
+        db = self._get_db()
+        try:
+            epp_names = {t.id: t.nombre.lower() for t in db.query(TipoEPP).all()}
+        finally:
+            db.close()
+
+        totals = {'dias': 0, 'detecciones': 0, 'alertas': 0}
+        dia = bucket_start(desde, 'dia')
+        while dia < hasta:
+            fin = min(dia + timedelta(days=1), hasta)
+            acumulado = _Acumulado()
+            db = self._get_db()
+            try:
+                totals['detecciones'] += self._backfill_detections(db, acumulado, dia, fin, epp_names, batch_size)
+                totals['alertas'] += self._backfill_alerts(db, acumulado, dia, fin, batch_size)
+
+                # Reemplazar los resúmenes del día
+                for granularidad in GRANULARIDADES:
+                    inicio = bucket_start(dia, granularidad)
+                    for model in (ResumenCumplimiento, ResumenFaltaEPP):
+                        db.execute(delete(model).where(
+                            model.granularidad == granularidad, model.bucket >= inicio, model.bucket < fin
+                        ))
+                contadores, faltas = acumulado.expand()
+                for (camera_id, granularidad, bucket), valores in contadores.items():
+                    db.add(ResumenCumplimiento(camera_id=camera_id, granularidad=granularidad,
+                                               bucket=bucket, **valores))
+                for (camera_id, granularidad, bucket, epp), n in faltas.items():
+                    db.add(ResumenFaltaEPP(camera_id=camera_id, granularidad=granularidad,
+                                           bucket=bucket, epp=epp, faltas=n))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+            totals['dias'] += 1
+            logger.info("Resumen de %s reconstruido", dia.date())
+            dia += timedelta(days=1)
+        return totals
+
+    @staticmethod
+    def _backfill_detections(db: Session, acumulado: _Acumulado, desde: datetime, hasta: datetime,
+                             epp_names: Dict[int, str], batch_size: int) -> int:
+        count = 0
+        detecciones = (
+            db.query(Deteccion.id, Deteccion.camera_id, Deteccion.timestamp, Deteccion.estado_epp)
+            .filter(Deteccion.timestamp >= desde, Deteccion.timestamp < hasta)
+            .order_by(Deteccion.id)
+            .yield_per(batch_size)
+        )
+        lote: List = []
+        for row in detecciones:
+            lote.append(row)
+            if len(lote) >= batch_size:
+                ComplianceRollup._accumulate_detections(db, acumulado, lote, epp_names)
+                count += len(lote)
+                lote = []
+        if lote:
+            ComplianceRollup._accumulate_detections(db, acumulado, lote, epp_names)
+            count += len(lote)
+        return count
+
+    @staticmethod
+    def _accumulate_detections(db: Session, acumulado: _Acumulado, lote: List, epp_names: Dict[int, str]):
+        # EPP presentes por detección (uso_correcto=1 en alguna fila de ese tipo) y tipos evaluados
+        evaluados = defaultdict(set)
+        correctos = defaultdict(set)
+        filas = db.query(DeteccionEPP.deteccion_id, DeteccionEPP.tipo_epp_id, DeteccionEPP.uso_correcto).filter(
+            DeteccionEPP.deteccion_id.in_([row.id for row in lote])
+        )
+        for deteccion_id, tipo_epp_id, uso_correcto in filas:
+            evaluados[deteccion_id].add(tipo_epp_id)
+            if uso_correcto == 1:
+                correctos[deteccion_id].add(tipo_epp_id)
+
+        for row in lote:
+            columna = ESTADOS_MUESTRA.get(row.estado_epp)
+            if columna is None:
+                continue
+            minuto = bucket_start(row.timestamp, 'minuto')
+            acumulado.contadores[(row.camera_id, minuto)][columna] += 1
+            if row.estado_epp != 'C':
+                for tipo_epp_id in evaluados[row.id] - correctos[row.id]:
+                    epp = epp_names.get(tipo_epp_id)
+                    if epp:
+                        acumulado.faltas[(row.camera_id, minuto, epp)] += 1
+
+    @staticmethod
+    def _backfill_alerts(db: Session, acumulado: _Acumulado, desde: datetime, hasta: datetime,
+                         batch_size: int) -> int:
+        count = 0
+        alertas = (
+            db.query(Alerta.camera_id, Alerta.timestamp, Alerta.severidad)
+            .filter(Alerta.timestamp >= desde, Alerta.timestamp < hasta)
+            .yield_per(batch_size)
+        )
+        for camera_id, timestamp, severidad in alertas:
+            columna = SEVERIDADES.get(severidad)
+            if columna is not None:
+                acumulado.contadores[(camera_id, bucket_start(timestamp, 'minuto'))][columna] += 1
+                count += 1
+        return count
+
+    def first_bucket(self) -> Optional[datetime]:
+        """Inicio del primer resumen diario existente (None si no hay)"""
+        db = self._get_db()
+        try:
+            row = (db.query(ResumenCumplimiento.bucket)
+                   .filter(ResumenCumplimiento.granularidad == 'dia')
+                   .order_by(ResumenCumplimiento.bucket.asc()).first())
+            return row[0] if row else None
+        finally:
+            db.close()
+
+    # ---------- Consultas (solo leen resúmenes) ----------
+
+    @staticmethod
+    def _camera_filter(db: Session, camera_id: Optional[int], zona: Optional[str]) -> Optional[List[int]]:
+        if camera_id is not None:
+            return [camera_id]
+        if zona:
+            return [row.id for row in db.query(Camera.id).filter(Camera.zona == zona)]
+        return None
+
+    def _base_query(self, db: Session, model, columns, granularidad: str, desde: datetime, hasta: datetime,
+                    camera_ids: Optional[List[int]]):
+        query = db.query(*columns).filter(
+            model.granularidad == granularidad,
+            model.bucket >= bucket_start(desde, granularidad),
+            model.bucket < hasta
+        )
+        if camera_ids is not None:
+            query = query.filter(model.camera_id.in_(camera_ids))
+        return query
+
+    def series(self, desde: datetime, hasta: datetime, granularidad: str = None,
+               camera_id: int = None, zona: str = None) -> Dict:
+        """Serie temporal de muestras y alertas (sumadas sobre las cámaras filtradas)"""
+        granularidad = granularidad or auto_granularidad(desde, hasta)
+        db = self._get_db()
+        try:
+            camera_ids = self._camera_filter(db, camera_id, zona)
+            columns = [ResumenCumplimiento.bucket] + [
+                func.sum(getattr(ResumenCumplimiento, col)).label(col) for col in CONTADORES
+            ]
+            rows = (self._base_query(db, ResumenCumplimiento, columns, granularidad, desde, hasta, camera_ids)
+                    .group_by(ResumenCumplimiento.bucket)
+                    .order_by(ResumenCumplimiento.bucket)
+                    .all())
+            return {
+                'granularidad': granularidad,
+                'serie': [{'bucket': row.bucket.isoformat(), **self._with_rate(row)} for row in rows]
+            }
+        finally:
+            db.close()
+
+    def by_camera(self, desde: datetime, hasta: datetime, granularidad: str = None, zona: str = None) -> List[Dict]:
+        """Totales del rango por cámara"""
+        granularidad = granularidad or auto_granularidad(desde, hasta)
+        db = self._get_db()
+        try:
+            camera_ids = self._camera_filter(db, None, zona)
+            columns = [ResumenCumplimiento.camera_id] + [
+                func.sum(getattr(ResumenCumplimiento, col)).label(col) for col in CONTADORES
+            ]
+            rows = (self._base_query(db, ResumenCumplimiento, columns, granularidad, desde, hasta, camera_ids)
+                    .group_by(ResumenCumplimiento.camera_id)
+                    .all())
+            cameras = {c.id: c for c in db.query(Camera).all()}
+            result = []
+            for row in rows:
+                camera = cameras.get(row.camera_id)
+                result.append({
+                    'camera_id': row.camera_id,
+                    'camera_nombre': camera.nombre if camera else 'Desconocida',
+                    'zona': camera.zona if camera else '',
+                    **self._with_rate(row)
+                })
+            return result
+        finally:
+            db.close()
+
+    def by_zone(self, desde: datetime, hasta: datetime, granularidad: str = None) -> List[Dict]:
+        """Totales del rango por zona (suma de sus cámaras)"""
+        zonas: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for camera in self.by_camera(desde, hasta, granularidad):
+            for col in CONTADORES:
+                zonas[camera['zona']][col] += camera[col]
+        return [{'zona': zona, **self._with_rate(valores)} for zona, valores in zonas.items()]
+
+    def missing_epp(self, desde: datetime, hasta: datetime, granularidad: str = None,
+                    camera_id: int = None, zona: str = None) -> List[Dict]:
+        """Muestras con cada EPP faltante en el rango"""
+        granularidad = granularidad or auto_granularidad(desde, hasta)
+        db = self._get_db()
+        try:
+            camera_ids = self._camera_filter(db, camera_id, zona)
+            columns = [ResumenFaltaEPP.epp, func.sum(ResumenFaltaEPP.faltas).label('faltas')]
+            rows = (self._base_query(db, ResumenFaltaEPP, columns, granularidad, desde, hasta, camera_ids)
+                    .group_by(ResumenFaltaEPP.epp)
+                    .order_by(func.sum(ResumenFaltaEPP.faltas).desc())
+                    .all())
+            return [{'epp': row.epp, 'faltas': int(row.faltas or 0)} for row in rows]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _with_rate(row) -> Dict:
+        """Contadores como enteros más la tasa de cumplimiento (% de muestras C)"""
+        get = row.get if isinstance(row, dict) else lambda col: getattr(row, col)
+        valores = {col: int(get(col) or 0) for col in CONTADORES}
+        muestras = valores['muestras_c'] + valores['muestras_i'] + valores['muestras_n']
+        valores['muestras'] = muestras
+        valores['alertas'] = sum(valores[col] for col in SEVERIDADES.values())
+        valores['tasa_cumplimiento'] = round(valores['muestras_c'] * 100 / muestras, 2) if muestras else None
+        return valores
+
+
+# Instancia global
+compliance_rollup = ComplianceRollup()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Reconstruye los resúmenes de cumplimiento desde las tablas crudas")
+    parser.add_argument("--desde", help="Fecha inicial YYYY-MM-DD (por defecto, la detección más antigua)")
+    parser.add_argument("--hasta", help="Fecha final exclusiva YYYY-MM-DD (por defecto, el primer resumen existente)")
+    args = parser.parse_args()
+
+    if args.desde:
+        desde = datetime.strptime(args.desde, "%Y-%m-%d")
+    else:
+        db = SessionLocal()
+        try:
+            row = db.query(Deteccion.timestamp).order_by(Deteccion.timestamp.asc()).first()
+        finally:
+            db.close()
+        if row is None:
+            print("No hay detecciones para reconstruir")
+            raise SystemExit(0)
+        desde = row[0]
+
+    # Solo se completa la historia anterior a los resúmenes en vivo
+    limite = compliance_rollup.first_bucket()
+    hasta = datetime.strptime(args.hasta, "%Y-%m-%d") if args.hasta else (limite or datetime.now())
+    if limite is not None and (hasta > limite or desde >= limite):
+        print(f"❌ El rango se superpone con los resúmenes en vivo (desde {limite.date()}): "
+              f"use --hasta {limite.date()} o anterior")
+        raise SystemExit(2)
+
+    inicio = time.time()
+    totals = compliance_rollup.backfill(desde, hasta)
+    print(f"✅ Resúmenes reconstruidos: {totals['dias']} días, {totals['detecciones']} detecciones, "
+          f"{totals['alertas']} alertas en {time.time() - inicio:.1f}s")
@@ -0,0 +1,280 @@
+"""
+Motor de reglas de cumplimiento
+Lee de la BD los EPP obligatorios (tipos_epp.obligatorio) y los parámetros de
+configuracion_ia, con overrides por zona y por cámara, y los compila en reglas ya
+resueltas por cámara: en cada frame solo hay una búsqueda en un diccionario, sin
+consultar la BD. Las reglas se recargan en segundo plano cada RULES_RELOAD_INTERVAL
+segundos (o con reload()) sin reiniciar los streams; cada proceso worker recarga las suyas
+
+Parámetros de configuracion_ia. El nombre es global ('confianza_minima') o con alcance:
+'zona:<zona>:<parametro>' o 'camara:<id>:<parametro>' (la cámara gana sobre la zona y la
+zona sobre el global)
+    confianza_minima    Confianza mínima para que una detección cuente (0-1)
+    fps_procesamiento   Frames analizados por segundo por cámara como máximo (0 = sin límite)
+    prioridad           Peso de la cámara en el reparto del presupuesto de inferencia (1 = normal)
+    alertas_activas     1 = generar alertas, 0 = solo registrar cumplimiento
+    epp_obligatorio     EPP requeridos separados por coma (por defecto los tipos_epp obligatorios)
+    severidad_<epp>     Severidad si falta ese EPP (baja, media, alta, critica)
+    severidad_sin_epp   Severidad si falta todo el EPP
+    severidad_multiple  Severidad si faltan 3 o más
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from backend.core.logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("detector")
+
+RULES_RELOAD_INTERVAL = float(os.getenv("RULES_RELOAD_INTERVAL", "30"))
+
+SEVERIDADES = ('baja', 'media', 'alta', 'critica')
+_SEVERITY_RANK = {sev: rank for rank, sev in enumerate(SEVERIDADES)}
+
+# Reglas previas al motor: se usan mientras la BD no responde o si no hay filas
+DEFAULT_REQUIRED = ('casco', 'chaleco', 'guantes', 'botas', 'gafas')
+DEFAULT_SEVERITIES = {'casco': 'critica', 'chaleco': 'alta'}
+DEFAULT_PARAMS = {
+    'alertas_activas': '1',
+    'severidad_sin_epp': 'critica',
+    'severidad_multiple': 'alta',
+}
+# Faltantes a partir de los cuales aplica severidad_multiple
+MULTIPLE_MISSING = 3
+
+
+class CameraRules:
+    """Reglas compiladas de una cámara (solo lectura: se reemplazan enteras al recargar)"""
+    __slots__ = ('camera_id', 'zona', 'required', 'confidence', 'fps', 'priority', 'alerts_enabled',
+                 'severities', 'severity_none', 'severity_multiple', 'default_severity')
+
+    def __init__(self, camera_id: Optional[int], zona: Optional[str], params: Dict[str, str],
+                 default_required: Tuple[str, ...]):
+        """
+        Args:
+            camera_id: ID de la cámara (None = reglas globales)
+            zona: Zona de la cámara
+            params: Parámetros ya resueltos (global < zona < cámara)
+            default_required: EPP obligatorios según tipos_epp
+        """
+        self.camera_id = camera_id
+        self.zona = zona
+
+        required = params.get('epp_obligatorio')
+        if required is None:
+            self.required = tuple(default_required)
+        else:
+            self.required = tuple(epp.strip().lower() for epp in required.split(',') if epp.strip())
+
+        confidence = _parse(params, 'confianza_minima', float, camera_id)
+        self.confidence = min(1.0, max(0.0, confidence)) if confidence else None
+        fps = _parse(params, 'fps_procesamiento', float, camera_id)
+        self.fps = fps if fps and fps > 0 else None
+        priority = _parse(params, 'prioridad', float, camera_id)
+        self.priority = priority if priority is not None and priority > 0 else 1.0
+        alerts = _parse(params, 'alertas_activas', int, camera_id)
+        self.alerts_enabled = alerts is None or alerts != 0
+
+        self.severities = {}
+        for epp in self.required:
+            severity = _severity(params, f'severidad_{epp}', DEFAULT_SEVERITIES.get(epp), camera_id)
+            if severity is not None:
+                self.severities[epp] = severity
+        self.severity_none = _severity(params, 'severidad_sin_epp', 'critica', camera_id)
+        self.severity_multiple = _severity(params, 'severidad_multiple', 'alta', camera_id)
+        self.default_severity = 'media'
+
+    def filter_detections(self, detections: List[Dict]) -> List[Dict]:
+        """Descarta las detecciones bajo la confianza mínima de la cámara"""
+        if not self.confidence:
+            return detections
+        return [det for det in detections if det['confidence'] >= self.confidence]
+
+    def classify_alert(self, compliance: Dict) -> Tuple[str, str, str]:
+        """
+        Tipo, severidad y mensaje de la alerta de un incumplimiento
+
+        Returns:
+            (tipo, severidad, mensaje)
+        """
+        if compliance['estado'] == 'N':
+            return 'sin_epp', self.severity_none, 'Trabajador sin EPP detectado'
+
+        missing = [epp for epp, present in compliance['epp_status'].items() if not present]
+        tipo, severidad = 'epp_incorrecto', self.default_severity
+        rank = _SEVERITY_RANK[severidad]
+        # El EPP faltante más grave decide (a igual severidad, el primero de la lista)
+        for epp in missing:
+            severity = self.severities.get(epp)
+            if severity is not None and _SEVERITY_RANK[severity] > rank:
+                tipo, severidad, rank = f'sin_{epp}', severity, _SEVERITY_RANK[severity]
+        if len(missing) >= MULTIPLE_MISSING and _SEVERITY_RANK[self.severity_multiple] > rank:
+            tipo, severidad = 'epp_multiple_faltante', self.severity_multiple
+        return tipo, severidad, f"EPP incorrecto: Falta {', '.join(missing)}"
+
+    def to_dict(self) -> Dict:
+        return {
+            'camera_id': self.camera_id,
+            'zona': self.zona,
+            'epp_obligatorio': list(self.required),
+            'confianza_minima': self.confidence,
+            'fps_procesamiento': self.fps,
+            'prioridad': self.priority,
+            'alertas_activas': self.alerts_enabled,
+            'severidades': dict(self.severities, sin_epp=self.severity_none, multiple=self.severity_multiple),
+        }
+
+
+def _parse(params: Dict[str, str], name: str, cast, camera_id):
+    value = params.get(name)
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return cast(str(value).strip())
+    except ValueError:
+        logger.warning("configuracion_ia: valor inválido para %s=%r (camera_id=%s), se ignora", name, value, camera_id)
+        return None
+
+
+def _severity(params: Dict[str, str], name: str, default: Optional[str], camera_id) -> Optional[str]:
+    value = params.get(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value not in _SEVERITY_RANK:
+        logger.warning("configuracion_ia: severidad inválida %s=%r (camera_id=%s), se ignora", name, value, camera_id)
+        return default
+    return value
+
+
+def _scope(parametro: str) -> Tuple[Optional[str], Optional[str], str]:
+    """'zona:Norte:confianza_minima' -> ('zona', 'Norte', 'confianza_minima')"""
+    scope, sep, rest = parametro.partition(':')
+    if sep and scope in ('zona', 'camara') and ':' in rest:
+        target, name = rest.rsplit(':', 1)
+        return scope, target, name.strip()
+    return None, None, parametro.strip()
+
+
+class RulesEngine:
+    def __init__(self, reload_interval: float = None):
+        """
+        Reglas por cámara compiladas desde la BD
+
+        Args:
+            reload_interval: Segundos entre recargas (RULES_RELOAD_INTERVAL por defecto)
+        """
+        self.reload_interval = reload_interval if reload_interval is not None else RULES_RELOAD_INTERVAL
+        self._global = CameraRules(None, None, DEFAULT_PARAMS, DEFAULT_REQUIRED)
+        self._cameras: Dict[int, CameraRules] = {}
+        self._unknown: set = set()
+        self.version = 0
+        self.loaded_at: Optional[float] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._loading = False
+
+    def for_camera(self, camera_id: int) -> CameraRules:
+        """Reglas vigentes de una cámara (sin acceso a BD salvo la primera carga)"""
+        if time.monotonic() >= self._next_check:
+            self._schedule_reload()
+        rules = self._cameras.get(camera_id)
+        if rules is None:
+            if camera_id not in self._unknown and self.loaded_at is not None:
+                # Cámara agregada después de la última carga: recargar una vez
+                self._unknown.add(camera_id)
+                self._next_check = 0.0
+            return self._global
+        return rules
+
+    def _schedule_reload(self):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+            self._next_check = time.monotonic() + self.reload_interval
+        if self.loaded_at is None:
+            # Primera carga en línea: los primeros frames ya usan las reglas configuradas
+            self._reload_guarded()
+        else:
+            threading.Thread(target=self._reload_guarded, name="reglas-recarga", daemon=True).start()
+
+    def _reload_guarded(self):
+        try:
+            self.reload()
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def reload(self) -> bool:
+        """
+        Lee tipos_epp, configuracion_ia y cameras y reemplaza las reglas compiladas
+
+        Returns:
+            True si la carga fue exitosa
+        """
+        from backend.core.database import SessionLocal, TipoEPP, ConfiguracionIA, Camera
+        db = SessionLocal()
+        try:
+            tipos = [(t.nombre, t.obligatorio) for t in db.query(TipoEPP).all()]
+            params = [(c.parametro, c.valor) for c in db.query(ConfiguracionIA).all()]
+            cameras = [(c.id, c.zona) for c in db.query(Camera).all()]
+        except Exception as e:
+            logger.error("Error cargando reglas de cumplimiento: %s", e, extra={'rate_key': 'reglas'})
+            return False
+        finally:
+            db.close()
+
+        default_required = tuple(nombre.strip().lower() for nombre, obligatorio in tipos if obligatorio) \
+            if tipos else DEFAULT_REQUIRED
+        global_params = dict(DEFAULT_PARAMS)
+        zone_params: Dict[str, Dict[str, str]] = {}
+        camera_params: Dict[str, Dict[str, str]] = {}
+        for parametro, valor in params:
+            scope, target, name = _scope(parametro)
+            if valor is None:
+                continue
+            if scope == 'zona':
+                zone_params.setdefault(target, {})[name] = valor
+            elif scope == 'camara':
+                camera_params.setdefault(target, {})[name] = valor
+            else:
+                global_params[name] = valor
+
+        compiled = {
+            camera_id: CameraRules(camera_id, zona,
+                                   {**global_params, **zone_params.get(zona, {}),
+                                    **camera_params.get(str(camera_id), {})},
+                                   default_required)
+            for camera_id, zona in cameras
+        }
+        global_rules = CameraRules(None, None, global_params, default_required)
+
+        changed = self.loaded_at is None or global_rules.to_dict() != self._global.to_dict() or \
+            {k: v.to_dict() for k, v in compiled.items()} != {k: v.to_dict() for k, v in self._cameras.items()}
+        # Reemplazo atómico: los streams leen el diccionario anterior o el nuevo, nunca uno a medias
+        self._global = global_rules
+        self._cameras = compiled
+        self.loaded_at = time.time()
+        if changed:
+            self.version += 1
+            logger.info("Reglas de cumplimiento cargadas (v%s): %s cámaras, EPP obligatorio global: %s",
+                        self.version, len(compiled), ', '.join(global_rules.required) or 'ninguno')
+        return True
+
+    def status(self) -> Dict:
+        """Reglas vigentes (para /api/admin/rules)"""
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'reload_interval_s': self.reload_interval,
+            'global': self._global.to_dict(),
+            'cameras': [rules.to_dict() for rules in self._cameras.values()],
+        }
+
+
+# Instancia global
+rules_engine = RulesEngine()
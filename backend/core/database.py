@@ -1,11 +1,15 @@
 """
-Configuración de Base de Datos MySQL
+Configuración de Base de Datos
+MySQL por defecto (DB_*); con DATABASE_URL=sqlite:///... usa un archivo SQLite local en
+modo WAL (nodos chicos sin servidor de BD, benchmarks y CI)
 """
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, ForeignKey, Text, Enum
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Float, ForeignKey, Text, Enum, UniqueConstraint, Index
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,9 +21,48 @@ DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "3306")
 DB_NAME = os.getenv("DB_NAME", "vision_epp")
 
-DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# URL completa (p.ej. sqlite:///backend/data/eppvision.db); vacío = MySQL con DB_*
+DATABASE_URL = os.getenv("DATABASE_URL", "") or \
+    f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# SQLite: milisegundos que una escritura espera a que otra libere el archivo
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
-engine = create_engine(DATABASE_URL, echo=False)
+def create_db_engine(url: str):
+    """
+    Crea el engine; en SQLite configura cada conexión para escrituras concurrentes
+    
+    WAL deja leer mientras otro hilo escribe, synchronous=NORMAL hace fsync solo en los
+    checkpoints (suficiente con WAL) y busy_timeout espera el bloqueo en lugar de fallar
+    con "database is locked". foreign_keys replica las restricciones de InnoDB
+    """
+    if not url.startswith("sqlite"):
+        return create_engine(url, echo=False)
+    
+    path = make_url(url).database
+    if path and path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    sqlite_engine = create_engine(url, echo=False, connect_args={
+        # Las sesiones se usan desde hilos de detección, workers de retención y el servidor
+        "check_same_thread": False,
+        "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+    })
+    
+    @event.listens_for(sqlite_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+    
+    return sqlite_engine
+
+def _enum(*values: str, name: str) -> Enum:
+    """ENUM nativo en MySQL; VARCHAR con CHECK en SQLite (mismos valores válidos)"""
+    return Enum(*values, name=name, create_constraint=True)
+
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -30,7 +73,8 @@ class Camera(Base):
     __tablename__ = "cameras"
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    physical_id = Column(Integer, unique=True, nullable=False)  # ID físico de Windows
+    physical_id = Column(Integer, unique=True, nullable=True)  # ID de cámara local (USB); NULL en cámaras IP/archivo
+    fuente = Column(String(500), nullable=True)  # rtsp://..., http(s)://..., usb:N o ruta de video (vacío = physical_id)
     nombre = Column(String(100), nullable=False)
     zona = Column(String(100), nullable=False)
     estado = Column(String(20), default="activa")  # activa, inactiva, error
@@ -91,7 +135,7 @@ class Deteccion(Base):
     imagen_path = Column(String(500))  # Ruta a imagen guardada
     
     # Estado general de EPP
-    estado_epp = Column(Enum('C', 'I', 'N', name='estado_epp_enum'), nullable=False)
+    estado_epp = Column(_enum('C', 'I', 'N', name='estado_epp_enum'), nullable=False)
     # C = Correcto (todos los EPP OK)
     # I = Incorrecto (EPP mal usado o incompleto)
     # N = No uso (sin EPP)
@@ -127,8 +171,11 @@ class DeteccionEPP(Base):
     tipo_epp = relationship("TipoEPP", back_populates="detecciones_epp")
 
 class Alerta(Base):
-    """Alertas generadas por incumplimiento de EPP"""
+    """Alertas generadas por incumplimiento de EPP (un incidente agrupa las ocurrencias repetidas)"""
     __tablename__ = "alertas"
+    __table_args__ = (
+        Index('ix_alertas_incidente', 'camera_id', 'tipo', 'estado'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     deteccion_id = Column(Integer, ForeignKey("detecciones.id"), nullable=False)
@@ -136,9 +183,13 @@ class Alerta(Base):
     
     timestamp = Column(DateTime, default=datetime.now, nullable=False)
     tipo = Column(String(50), nullable=False)  # sin_casco, sin_chaleco, epp_incorrecto, etc.
-    severidad = Column(Enum('baja', 'media', 'alta', 'critica', name='severidad_enum'), default='media')
+    severidad = Column(_enum('baja', 'media', 'alta', 'critica', name='severidad_enum'), default='media')
     mensaje = Column(String(500))
     
+    # Incidente: ocurrencias de la misma (cámara, tipo) agrupadas mientras sigan llegando
+    ocurrencias = Column(Integer, default=1, nullable=False)
+    ultima_ocurrencia = Column(DateTime)
+    
     # Estado de la alerta
     estado = Column(String(20), default="pendiente")  # pendiente, revisada, resuelta, descartada
     revisada_por = Column(String(100))
@@ -156,7 +207,7 @@ class EventoSistema(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     timestamp = Column(DateTime, default=datetime.now, nullable=False)
     tipo = Column(String(50))  # camara_conectada, camara_desconectada, error_modelo, etc.
-    nivel = Column(Enum('info', 'warning', 'error', 'critical', name='nivel_enum'), default='info')
+    nivel = Column(_enum('info', 'warning', 'error', 'critical', name='nivel_enum'), default='info')
     mensaje = Column(Text)
     detalles = Column(Text)  # JSON con detalles adicionales
 
@@ -170,6 +221,77 @@ class ConfiguracionIA(Base):
     descripcion = Column(String(500))
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
+class TrabajoVideo(Base):
+    """Videos subidos para procesamiento temporal (registro compartido entre workers)"""
+    __tablename__ = "trabajos_video"
+
+    id = Column(String(36), primary_key=True)  # video_id (uuid)
+    nombre_archivo = Column(String(255), nullable=False)
+    ruta = Column(String(500), nullable=False)
+    content_hash = Column(String(64))  # SHA-256 del archivo (caché de resultados)
+
+    estado = Column(String(20), default="en_cola", nullable=False)  # en_cola, procesando, completado, fallido
+    subida_completa = Column(Integer, default=1)  # 0 = se puede analizar el prefijo ya subido
+    error = Column(Text)
+    worker = Column(String(100))  # host:pid que lo está procesando
+
+    # Metadatos del video
+    total_frames = Column(Integer, default=0)
+    fps = Column(Float, default=0)
+    duracion = Column(Float, default=0)
+    ancho = Column(Integer)
+    alto = Column(Integer)
+
+    # Progreso (se actualiza con UPDATE col = col + n)
+    frames_procesados = Column(Integer, default=0, nullable=False)
+    detecciones_totales = Column(Integer, default=0, nullable=False)
+    personas_detectadas = Column(Integer, default=0, nullable=False)
+    epp_incorrecto = Column(Integer, default=0, nullable=False)
+    cache_hit = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    expires_at = Column(DateTime, nullable=False, index=True)  # Después se borra el archivo temporal
+
+class ResumenCumplimiento(Base):
+    """Resumen de cumplimiento por cámara y periodo (minuto/hora/día), se mantiene incrementalmente"""
+    __tablename__ = "resumen_cumplimiento"
+    __table_args__ = (
+        UniqueConstraint('camera_id', 'granularidad', 'bucket', name='uq_resumen_cumplimiento'),
+        Index('ix_resumen_cumplimiento_periodo', 'granularidad', 'bucket'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    camera_id = Column(Integer, nullable=False)  # Sin FK: el resumen sobrevive al borrado de la cámara
+    granularidad = Column(String(10), nullable=False)  # minuto, hora, dia
+    bucket = Column(DateTime, nullable=False)  # Inicio del periodo
+
+    # Muestras de cumplimiento por estado (C = correcto, I = incorrecto, N = sin EPP)
+    muestras_c = Column(Integer, default=0, nullable=False)
+    muestras_i = Column(Integer, default=0, nullable=False)
+    muestras_n = Column(Integer, default=0, nullable=False)
+
+    # Alertas generadas por severidad
+    alertas_baja = Column(Integer, default=0, nullable=False)
+    alertas_media = Column(Integer, default=0, nullable=False)
+    alertas_alta = Column(Integer, default=0, nullable=False)
+    alertas_critica = Column(Integer, default=0, nullable=False)
+
+class ResumenFaltaEPP(Base):
+    """Muestras con cada EPP faltante por cámara y periodo"""
+    __tablename__ = "resumen_faltas_epp"
+    __table_args__ = (
+        UniqueConstraint('camera_id', 'granularidad', 'bucket', 'epp', name='uq_resumen_faltas_epp'),
+        Index('ix_resumen_faltas_epp_periodo', 'granularidad', 'bucket'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    camera_id = Column(Integer, nullable=False)
+    granularidad = Column(String(10), nullable=False)
+    bucket = Column(DateTime, nullable=False)
+    epp = Column(String(50), nullable=False)  # casco, chaleco, guantes, botas, gafas
+    faltas = Column(Integer, default=0, nullable=False)
+
 # ============= FUNCIONES AUXILIARES =============
 
 def get_db():
@@ -183,8 +305,59 @@ def get_db():
 def init_database():
     """Inicializa todas las tablas"""
     Base.metadata.create_all(bind=engine)
+    migrate_schema()
     print("✅ Tablas creadas exitosamente")
 
+def migrate_schema():
+    """
+    Agrega a tablas existentes las columnas nuevas (create_all no altera tablas ya creadas)
+    Es idempotente: se puede llamar en cada arranque
+    """
+    from sqlalchemy import inspect, text
+    from backend.core.logging_config import get_logger
+    logger = get_logger("db")
+
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    if "cameras" not in tables:
+        return
+    columns = {column['name']: column for column in inspector.get_columns("cameras")}
+
+    with engine.begin() as conn:
+        if "fuente" not in columns:
+            conn.execute(text("ALTER TABLE cameras ADD COLUMN fuente VARCHAR(500) NULL"))
+            logger.info("Migración: columna cameras.fuente agregada")
+        if not columns["physical_id"]["nullable"]:
+            if engine.dialect.name == "mysql":
+                conn.execute(text("ALTER TABLE cameras MODIFY physical_id INTEGER NULL"))
+                logger.info("Migración: cameras.physical_id ahora admite NULL (cámaras IP/archivo)")
+            else:
+                logger.warning("cameras.physical_id no admite NULL: las cámaras IP/archivo no se podrán agregar")
+
+        if "alertas" in tables:
+            alert_columns = {column['name'] for column in inspector.get_columns("alertas")}
+            if "ocurrencias" not in alert_columns:
+                conn.execute(text("ALTER TABLE alertas ADD COLUMN ocurrencias INTEGER NOT NULL DEFAULT 1"))
+                logger.info("Migración: columna alertas.ocurrencias agregada")
+            if "ultima_ocurrencia" not in alert_columns:
+                conn.execute(text("ALTER TABLE alertas ADD COLUMN ultima_ocurrencia DATETIME NULL"))
+                logger.info("Migración: columna alertas.ultima_ocurrencia agregada")
+            if "ix_alertas_incidente" not in {index['name'] for index in inspector.get_indexes("alertas")}:
+                conn.execute(text("CREATE INDEX ix_alertas_incidente ON alertas (camera_id, tipo, estado)"))
+                logger.info("Migración: índice ix_alertas_incidente creado")
+
+_schema_checked = False
+_schema_lock = threading.Lock()
+
+def ensure_schema():
+    """Ejecuta migrate_schema() una vez por proceso (antes de usar las columnas nuevas)"""
+    global _schema_checked
+    if not _schema_checked:
+        with _schema_lock:
+            if not _schema_checked:
+                migrate_schema()
+                _schema_checked = True
+
 def seed_initial_data():
     """Inserta datos iniciales"""
     db = SessionLocal()
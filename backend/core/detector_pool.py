@@ -0,0 +1,212 @@
+"""
+Pool de Detectores EPP
+Controla cuántas inferencias YOLO corren en paralelo y cuántos hilos usa cada una
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from backend.core.logging_config import get_logger
+load_dotenv()
+
+logger = get_logger("detector")
+
+# Configuración (K instancias x N hilos debería igualar los núcleos de la máquina)
+POOL_SIZE = int(os.getenv("EPP_POOL_SIZE", "1"))
+THREADS_PER_INSTANCE = int(os.getenv("EPP_THREADS_PER_INSTANCE", "0"))  # 0 = núcleos / K
+POOL_TIMEOUT = float(os.getenv("EPP_POOL_TIMEOUT", "10"))  # Segundos máximos esperando un detector
+
+
+class EPPDetectorPool:
+    def __init__(self, model_path: str = "models/best.pt", size: int = None,
+                 threads_per_instance: int = None, conf_threshold: float = 0.25,
+                 model_factory: Callable[[], object] = None):
+        """
+        Inicializa el pool con K instancias del detector
+
+        Args:
+            model_path: Ruta al modelo YOLOv8 entrenado
+            size: Número de instancias del modelo (inferencias simultáneas)
+            threads_per_instance: Hilos de torch por inferencia (0 = núcleos / size)
+            conf_threshold: Umbral de confianza para detecciones (0-1)
+            model_factory: Crea el modelo de cada instancia en lugar de cargar model_path
+                           (p.ej. el stub de benchmarks)
+        """
+        from backend.core.epp_detector import EPPDetector
+
+        self.size = max(1, size if size is not None else POOL_SIZE)
+        cores = os.cpu_count() or 1
+        threads = threads_per_instance if threads_per_instance is not None else THREADS_PER_INSTANCE
+        self.threads_per_instance = threads if threads > 0 else max(1, cores // self.size)
+
+        self._configure_torch_threads(self.threads_per_instance)
+
+        logger.info("Pool: creando %s instancia(s) x %s hilo(s) (%s núcleos disponibles)",
+                    self.size, self.threads_per_instance, cores)
+        if self.size * self.threads_per_instance > cores:
+            logger.warning("%s x %s hilos supera los %s núcleos", self.size, self.threads_per_instance, cores)
+
+        self.detectors: List[EPPDetector] = [
+            EPPDetector(model_path=model_path, conf_threshold=conf_threshold,
+                        model=model_factory() if model_factory else None)
+            for _ in range(self.size)
+        ]
+
+        # Cola de detectores libres: get() bloquea como un semáforo de K permisos
+        self._available: "queue.Queue[EPPDetector]" = queue.Queue()
+        for detector in self.detectors:
+            self._available.put(detector)
+
+        # Métricas de espera en cola
+        self._stats_lock = threading.Lock()
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._recent_waits = deque(maxlen=500)
+
+    @staticmethod
+    def _configure_torch_threads(threads: int):
+        """Limita los hilos intra-op de torch (cada inferencia concurrente usa hasta N)"""
+        try:
+            import torch
+            torch.set_num_threads(threads)
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                # Solo se puede fijar antes del primer trabajo paralelo
+                pass
+        except ImportError:
+            pass
+
+    @property
+    def reference(self):
+        """Detector de referencia para operaciones sin modelo (clases, dibujo)"""
+        return self.detectors[0]
+
+    @contextmanager
+    def acquire(self, timeout: float = None):
+        """
+        Reserva un detector libre durante el bloque with
+
+        Args:
+            timeout: Segundos máximos de espera (None = EPP_POOL_TIMEOUT)
+
+        Raises:
+            TimeoutError: Si no se liberó ningún detector a tiempo
+        """
+        start = time.perf_counter()
+        with self._stats_lock:
+            self._waiting += 1
+        try:
+            detector = self._available.get(timeout=timeout if timeout is not None else POOL_TIMEOUT)
+        except queue.Empty:
+            with self._stats_lock:
+                self._waiting -= 1
+                self._timeouts += 1
+            raise TimeoutError("No hay detectores EPP libres en el pool")
+
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self._waiting -= 1
+            self._acquisitions += 1
+            self._in_use += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._recent_waits.append(waited)
+
+        try:
+            yield detector
+        finally:
+            with self._stats_lock:
+                self._in_use -= 1
+            self._available.put(detector)
+
+    def process_frame(self, frame, draw: bool = True, in_place: bool = False) -> Tuple:
+        """
+        Igual que EPPDetector.process_frame, pero solo ocupa el modelo durante la inferencia
+
+        Args:
+            frame: Frame de video
+            draw: Si True, dibuja las detecciones en el frame
+            in_place: Si True, dibuja sobre el mismo frame sin copiarlo
+
+        Returns:
+            (frame_procesado, detections, compliance)
+        """
+        with self.acquire() as detector:
+            detections = detector.detect(frame)
+            compliance = detector.classify_compliance(detections)
+
+        # Dibujar no usa el modelo: se hace fuera del pool para liberarlo antes
+        if draw:
+            frame = self.reference.draw_detections(frame, detections, compliance, in_place=in_place)
+
+        return frame, detections, compliance
+
+    def measure_throughput(self, shape: Tuple[int, int, int] = (480, 640, 3), runs: int = 5) -> float:
+        """
+        Mide cuántas inferencias por segundo sostiene el pool (con un frame en negro)
+
+        Args:
+            shape: Forma del frame de prueba
+            runs: Inferencias cronometradas (después de una de calentamiento)
+
+        Returns:
+            Inferencias por segundo de una instancia multiplicadas por el tamaño del pool
+        """
+        import numpy as np
+        frame = np.zeros(shape, dtype=np.uint8)
+        with self.acquire() as detector:
+            detector.detect(frame)
+            start = time.perf_counter()
+            for _ in range(runs):
+                detector.detect(frame)
+            elapsed = time.perf_counter() - start
+        per_instance = runs / elapsed if elapsed > 0 else 0.0
+        return per_instance * self.size
+
+    def get_stats(self) -> Dict:
+        """Obtiene estadísticas de uso y tiempos de espera del pool"""
+        with self._stats_lock:
+            waits = sorted(self._recent_waits)
+            p95 = waits[int(len(waits) * 0.95) - 1] if waits else 0.0
+            return {
+                'size': self.size,
+                'threads_per_instance': self.threads_per_instance,
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'utilization': round(self._in_use / self.size, 3),
+                'acquisitions': self._acquisitions,
+                'timeouts': self._timeouts,
+                'avg_wait_ms': round(self._total_wait / self._acquisitions * 1000, 3) if self._acquisitions else 0.0,
+                'p95_wait_ms': round(p95 * 1000, 3),
+                'max_wait_ms': round(self._max_wait * 1000, 3)
+            }
+
+
+# Instancia global (se carga bajo demanda)
+_pool: Optional[EPPDetectorPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_detector_pool() -> EPPDetectorPool:
+    """Obtiene el pool global, cargando los modelos la primera vez"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = EPPDetectorPool()
+    return _pool
+
+
+def get_loaded_pool() -> Optional[EPPDetectorPool]:
+    """Obtiene el pool global solo si ya está cargado (no dispara la carga del modelo)"""
+    return _pool
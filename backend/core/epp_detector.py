@@ -1,33 +1,95 @@
 """
 Detector de EPP usando YOLOv8
 """
+import time
 import cv2
 import numpy as np
-from ultralytics import YOLO
+from functools import lru_cache
 from typing import List, Dict, Tuple, Optional
+from backend.core.logging_config import get_logger
+
+logger = get_logger("detector")
+
+# Panel de estado translúcido (esquina superior izquierda)
+PANEL_X1, PANEL_Y1 = 10, 10
+PANEL_X2, PANEL_Y2 = 250, 120
+PANEL_ALPHA = 0.3  # Fracción del frame original que se conserva bajo el panel
+
+@lru_cache(maxsize=1024)
+def _text_size(text: str, font_scale: float, thickness: int = 1) -> Tuple[int, int]:
+    """Tamaño de texto cacheado por (texto, escala): las etiquetas se repiten frame a frame"""
+    size, _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    return size
+
+def compliance_from_status(epp_status: Dict[str, bool], person_detected: bool) -> Dict:
+    """
+    Clasificación de cumplimiento a partir de la presencia de cada EPP
+    (la usan classify_compliance y el filtro temporal de compliance_filter)
+
+    Args:
+        epp_status: EPP requerido -> presente
+        person_detected: Si hay una persona en la escena
+
+    Returns:
+        Diccionario con estado, score, epp_status, mensaje y person_detected
+    """
+    # Si NO hay persona, retornar estado especial (no alertar)
+    if not person_detected:
+        return {
+            'estado': 'P',  # P = Sin Persona (no alertar)
+            'score': 0,
+            'epp_status': {epp: False for epp in epp_status},
+            'mensaje': 'Área vacía',
+            'person_detected': False
+        }
+
+    # Contar EPP presentes
+    compliant_count = sum(epp_status.values())
+    total_required = len(epp_status)
+
+    # Calcular score (0-100%)
+    score = (compliant_count / total_required) * 100 if total_required else 100
+
+    # Determinar estado
+    if compliant_count == total_required:
+        estado = 'C'  # Correcto
+        mensaje = 'EPP Completo'
+    elif compliant_count > 0:
+        estado = 'I'  # Incorrecto (uso parcial)
+        missing = [epp for epp, present in epp_status.items() if not present]
+        mensaje = f'Falta: {", ".join(missing)}'
+    else:
+        estado = 'N'  # No uso
+        mensaje = 'Sin EPP'
+
+    return {
+        'estado': estado,
+        'score': score,
+        'epp_status': epp_status,
+        'mensaje': mensaje,
+        'person_detected': True
+    }
 
 class EPPDetector:
-    def __init__(self, model_path: str = "models/best.pt", conf_threshold: float = 0.25):
+    def __init__(self, model_path: str = "models/best.pt", conf_threshold: float = 0.25, model=None):
         """
         Inicializa el detector de EPP
         
         Args:
             model_path: Ruta al modelo YOLOv8 entrenado
             conf_threshold: Umbral de confianza para detecciones (0-1)
+            model: Modelo ya construido con la interfaz de ultralytics (p.ej. el stub de benchmarks);
+                   si se pasa, no se carga model_path
         """
         self.model_path = model_path
         self.conf_threshold = conf_threshold
         self.iou_threshold = 0.45
         
         # Cargar modelo
-        print(f"[EPP Detector] Cargando modelo desde: {model_path}")
-        try:
-            self.model = YOLO(model_path)
-            print(f"[EPP Detector] Modelo cargado exitosamente")
-            print(f"[EPP Detector] Clases del modelo: {self.model.names}")
-        except Exception as e:
-            print(f"[EPP Detector ERROR] No se pudo cargar el modelo: {e}")
-            raise
+        if model is not None:
+            self.model = model
+        else:
+            self._load_model(model_path)
         
         # Mapeo de clases del modelo a nombres en español
         self.class_mapping = {
@@ -60,6 +122,22 @@ class EPPDetector:
         # EPP requerido (5 tipos según la tesis)
         self.epp_types = ['casco', 'chaleco', 'guantes', 'botas', 'gafas']
         
+        # Tiempos (ms) de preprocess/inference/postprocess de la última llamada a detect()
+        self.last_speed: Dict[str, float] = {}
+        
+    def _load_model(self, model_path: str):
+        """Carga el modelo YOLOv8 con ultralytics"""
+        from ultralytics import YOLO
+        
+        logger.info("Cargando modelo desde: %s", model_path)
+        try:
+            self.model = YOLO(model_path)
+            logger.info("Modelo cargado exitosamente")
+            logger.info("Clases del modelo: %s", self.model.names)
+        except Exception as e:
+            logger.error("No se pudo cargar el modelo: %s", e)
+            raise
+        
     def detect(self, frame: np.ndarray) -> List[Dict]:
         """
         Ejecuta detección en un frame
@@ -81,8 +159,11 @@ class EPPDetector:
         """
         results = self.model(frame, conf=self.conf_threshold, iou=self.iou_threshold, verbose=False)
         
+        start = time.perf_counter()
         detections = []
+        speed = {}
         for result in results:
+            speed = dict(getattr(result, 'speed', None) or {})
             boxes = result.boxes
             for box in boxes:
                 # Obtener datos de la caja
@@ -93,32 +174,48 @@ class EPPDetector:
                 # Nombre de clase original del modelo
                 class_name = self.model.names[cls_id]
                 
-                # Determinar si es EPP presente o ausente
-                has_epp = not class_name.lower().startswith(('no_', 'no-'))
-                
-                # Mapear a nombre en español y tipo de EPP
-                epp_type = self.class_mapping.get(class_name, class_name.lower())
-                
-                # Normalizar tipo de EPP (quitar "sin_")
-                if epp_type.startswith('sin_'):
-                    epp_type = epp_type.replace('sin_', '')
-                
-                detections.append({
-                    'bbox': [int(x1), int(y1), int(x2), int(y2)],
-                    'confidence': conf,
-                    'class': class_name,
-                    'has_epp': has_epp,
-                    'epp_type': epp_type
-                })
+                detections.append(self.build_detection(class_name, conf, [int(x1), int(y1), int(x2), int(y2)]))
         
+        # Tiempos por etapa (ms) de la última inferencia: los de ultralytics más la conversión de cajas
+        speed['postprocess'] = speed.get('postprocess', 0.0) + (time.perf_counter() - start) * 1000
+        self.last_speed = speed
         return detections
     
-    def classify_compliance(self, detections: List[Dict]) -> Dict:
+    def build_detection(self, class_name: str, confidence: float, bbox: List[int]) -> Dict:
+        """
+        Construye una detección a partir de la salida cruda del modelo
+        (también se usa para reconstruir detecciones guardadas en caché)
+        
+        Args:
+            class_name: Nombre de clase original del modelo
+            confidence: Confianza de la detección (0-1)
+            bbox: [x1, y1, x2, y2]
+        """
+        # Determinar si es EPP presente o ausente
+        has_epp = not class_name.lower().startswith(('no_', 'no-'))
+        
+        # Mapear a nombre en español y tipo de EPP
+        epp_type = self.class_mapping.get(class_name, class_name.lower())
+        
+        # Normalizar tipo de EPP (quitar "sin_")
+        if epp_type.startswith('sin_'):
+            epp_type = epp_type.replace('sin_', '')
+        
+        return {
+            'bbox': bbox,
+            'confidence': confidence,
+            'class': class_name,
+            'has_epp': has_epp,
+            'epp_type': epp_type
+        }
+    
+    def classify_compliance(self, detections: List[Dict], required: Optional[Tuple[str, ...]] = None) -> Dict:
         """
         Clasifica el cumplimiento de EPP en: Correcto (C), Incorrecto (I), No uso (N), Sin Persona (P)
         
         Args:
             detections: Lista de detecciones del método detect()
+            required: EPP obligatorios (reglas de la cámara); None = todos los que detecta el modelo
             
         Returns:
             {
@@ -144,68 +241,34 @@ class EPPDetector:
             len(detections) > 0  # Si hay cualquier detección, asumimos persona presente
         )
         
-        # Si NO hay detecciones, retornar estado especial (no alertar)
-        if not person_detected:
-            return {
-                'estado': 'P',  # P = Sin Persona (no alertar)
-                'score': 0,
-                'epp_status': {epp: False for epp in self.epp_types},
-                'mensaje': 'Área vacía',
-                'person_detected': False
-            }
-        
         # PASO 2: Si HAY persona, evaluar EPP
-        epp_status = {epp: False for epp in self.epp_types}
-        
-        # Revisar detecciones de EPP
-        for det in detections:
-            epp_type = det['epp_type']
-            has_epp = det['has_epp']
-            
+        epp_status = {epp: False for epp in (self.epp_types if required is None else required)}
+        if person_detected:
             # Solo marcar como presente si tiene EPP correcto
-            if epp_type in epp_status and has_epp:
-                epp_status[epp_type] = True
-        
-        # Contar EPP presentes
-        compliant_count = sum(epp_status.values())
-        total_required = len(self.epp_types)
-        
-        # Calcular score (0-100%)
-        score = (compliant_count / total_required) * 100
-        
-        # Determinar estado
-        if compliant_count == total_required:
-            estado = 'C'  # Correcto
-            mensaje = 'EPP Completo'
-        elif compliant_count > 0:
-            estado = 'I'  # Incorrecto (uso parcial)
-            missing = [epp for epp, present in epp_status.items() if not present]
-            mensaje = f'Falta: {", ".join(missing)}'
-        else:
-            estado = 'N'  # No uso
-            mensaje = 'Sin EPP'
-        
-        return {
-            'estado': estado,
-            'score': score,
-            'epp_status': epp_status,
-            'mensaje': mensaje,
-            'person_detected': True
-        }
+            for det in detections:
+                if det['epp_type'] in epp_status and det['has_epp']:
+                    epp_status[det['epp_type']] = True
+
+        return compliance_from_status(epp_status, person_detected)
     
-    def draw_detections(self, frame: np.ndarray, detections: List[Dict], compliance: Dict) -> np.ndarray:
+    @staticmethod
+    def draw_detections(frame: np.ndarray, detections: List[Dict], compliance: Dict,
+                        in_place: bool = False) -> np.ndarray:
         """
         Dibuja las detecciones y estado de cumplimiento en el frame
+        (no usa el modelo: se puede llamar como EPPDetector.draw_detections)
         
         Args:
             frame: Frame original
             detections: Detecciones del método detect()
             compliance: Clasificación del método classify_compliance()
+            in_place: Si True, dibuja directamente sobre frame (sin copia defensiva).
+                      Usar solo cuando el llamador es dueño del frame.
             
         Returns:
             Frame con anotaciones dibujadas
         """
-        frame_annotated = frame.copy()
+        frame_annotated = frame if in_place else frame.copy()
         
         # Colores
         COLOR_CORRECTO = (0, 255, 0)  # Verde
@@ -227,7 +290,7 @@ class EPPDetector:
             
             # Etiqueta
             label = f"{epp_type} {conf:.2f}"
-            label_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+            label_size = _text_size(label, 0.5)
             
             # Fondo de etiqueta
             cv2.rectangle(frame_annotated, 
@@ -257,12 +320,11 @@ class EPPDetector:
         else:
             panel_color = COLOR_INCORRECTO
         
-        # Dibujar panel de estado
-        panel_height = 120
-        panel_width = 250
-        overlay = frame_annotated.copy()
-        cv2.rectangle(overlay, (10, 10), (panel_width, panel_height), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.7, frame_annotated, 0.3, 0, frame_annotated)
+        # Dibujar panel de estado: oscurecer solo la región del panel (fondo negro al 70%)
+        panel_height = PANEL_Y2
+        roi = frame_annotated[PANEL_Y1:PANEL_Y2 + 1, PANEL_X1:PANEL_X2 + 1]
+        if roi.size:
+            roi[:] = cv2.addWeighted(roi, PANEL_ALPHA, roi, 0, 0)
         
         # Texto del panel
         cv2.putText(frame_annotated, f"Estado: {estado}", 
@@ -286,13 +348,15 @@ class EPPDetector:
         
         return frame_annotated
     
-    def process_frame(self, frame: np.ndarray, draw: bool = True) -> Tuple[np.ndarray, List[Dict], Dict]:
+    def process_frame(self, frame: np.ndarray, draw: bool = True,
+                      in_place: bool = False) -> Tuple[np.ndarray, List[Dict], Dict]:
         """
         Procesa un frame completo: detecta, clasifica y opcionalmente dibuja
         
         Args:
             frame: Frame de video
             draw: Si True, dibuja las detecciones en el frame
+            in_place: Si True, dibuja sobre el mismo frame sin copiarlo
             
         Returns:
             (frame_procesado, detections, compliance)
@@ -305,6 +369,6 @@ class EPPDetector:
         
         # Dibujar si se solicita
         if draw:
-            frame = self.draw_detections(frame, detections, compliance)
+            frame = self.draw_detections(frame, detections, compliance, in_place=in_place)
         
         return frame, detections, compliance
@@ -0,0 +1,133 @@
+"""
+Anillo de buffers de frames preasignados por cámara, con conteo de referencias
+La captura decodifica directamente en un slot libre (VideoCapture.read(image=...)) y
+detección, dibujo y codificación trabajan sobre vistas del slot: en régimen estable el
+stream no asigna memoria por frame. Un slot se reutiliza solo cuando nadie lo retiene.
+Con shm_name los slots viven en memoria compartida (ShmRing) y otro proceso puede leer
+el frame más reciente sin que se copie antes
+"""
+import os
+import threading
+from collections import deque
+from typing import Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from backend.core.shm_ring import ShmRing
+
+load_dotenv()
+
+# Slots por cámara: el último frame + el que se está capturando + los retenidos por
+# detección, dibujo y clientes. Si se agotan, la captura asigna un frame suelto
+FRAME_RING_SLOTS = int(os.getenv("FRAME_RING_SLOTS", "8"))
+
+
+class FrameRing:
+    def __init__(self, shape: Tuple[int, ...], dtype=np.uint8, slots: int = None, shm_name: str = None):
+        """
+        Reserva los slots de una vez
+
+        Args:
+            shape: Forma de los frames (alto, ancho, canales)
+            dtype: Tipo de los píxeles
+            slots: Cantidad de slots (FRAME_RING_SLOTS por defecto)
+            shm_name: Si se indica, los slots se crean en memoria compartida con ese nombre
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = max(3, slots or FRAME_RING_SLOTS)
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        self.shm: Optional[ShmRing] = None
+        if shm_name:
+            self.shm = ShmRing.create(shm_name, nbytes, self.slots)
+            self._views = [self.shm.slot_array(i, self.shape, self.dtype) for i in range(self.slots)]
+        else:
+            storage = np.empty((self.slots,) + self.shape, dtype=self.dtype)
+            self._views = list(storage)
+
+        self._refs = [0] * self.slots
+        # Slots en orden de uso: se reutiliza primero el que se liberó hace más tiempo
+        self._order = deque(range(self.slots))
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    @property
+    def name(self) -> Optional[str]:
+        return self.shm.name if self.shm is not None else None
+
+    def fits(self, frame: np.ndarray) -> bool:
+        return frame.shape == self.shape and frame.dtype == self.dtype
+
+    def acquire(self) -> Optional[int]:
+        """
+        Reserva un slot libre para escribir (queda con una referencia del escritor)
+
+        Returns:
+            Índice del slot o None si todos están retenidos
+        """
+        with self._lock:
+            for index in self._order:
+                if self._refs[index] == 0:
+                    self._refs[index] = 1
+                    self._order.remove(index)
+                    self._order.append(index)
+                    break
+            else:
+                self.exhausted += 1
+                return None
+        if self.shm is not None:
+            self.shm.begin_write(index)
+        return index
+
+    def view(self, index: int) -> np.ndarray:
+        return self._views[index]
+
+    def publish(self, index: int):
+        """Marca el slot como el frame más reciente para los lectores de otros procesos"""
+        if self.shm is not None:
+            self.shm.commit(index, self.shape, self.dtype.str)
+
+    def incref(self, index: int):
+        with self._lock:
+            self._refs[index] += 1
+
+    def release(self, index: int):
+        with self._lock:
+            self._refs[index] = max(0, self._refs[index] - 1)
+
+    def in_use(self) -> int:
+        with self._lock:
+            return sum(1 for refs in self._refs if refs)
+
+    def close(self):
+        """Libera la memoria compartida (las vistas locales siguen válidas hasta que el GC las recoja)"""
+        if self.shm is not None:
+            self.shm.close()
+
+
+class FrameLease:
+    """
+    Frame retenido: el slot no se reutiliza hasta release() (o al salir del bloque with)
+    Se puede desempaquetar como la tupla (seq, frame) de antes
+    """
+    __slots__ = ('seq', 'frame', '_ring', '_index')
+
+    def __init__(self, seq: int, frame: np.ndarray, ring: Optional[FrameRing] = None, index: int = None):
+        self.seq = seq
+        self.frame = frame
+        self._ring = ring
+        self._index = index
+
+    def release(self):
+        if self._ring is not None:
+            self._ring.release(self._index)
+            self._ring = None
+
+    def __enter__(self) -> "FrameLease":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __iter__(self):
+        return iter((self.seq, self.frame))
@@ -0,0 +1,354 @@
+"""
+Streaming HLS (segmentos fMP4 H.264) como alternativa a MJPEG
+Codifica por software con libx264 mediante un subproceso FFmpeg: mucho menos ancho
+de banda por espectador que MJPEG, a cambio de unos segundos de latencia
+"""
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+from backend.core.logging_config import get_logger
+load_dotenv()
+
+logger = get_logger("video")
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+HLS_DIR = Path("backend/temp_hls")
+HLS_FPS = int(os.getenv("HLS_FPS", "15"))
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "2"))
+HLS_LIST_SIZE = 6  # Segmentos en la playlist en vivo
+HLS_BITRATE = os.getenv("HLS_BITRATE", "1500k")
+HLS_IDLE_TIMEOUT = float(os.getenv("HLS_IDLE_TIMEOUT", "30"))  # Seg. sin peticiones antes de cerrar
+
+# Archivos que se sirven desde el directorio de una sesión
+HLS_FILE_PATTERN = re.compile(r"^(index\.m3u8|init\.mp4|seg_\d{5}\.m4s)$")
+HLS_MEDIA_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.mp4': 'video/mp4',
+    '.m4s': 'video/iso.segment',
+}
+
+
+def ffmpeg_available() -> bool:
+    """True si el ejecutable de FFmpeg está disponible"""
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+class HLSEncoder:
+    def __init__(self, output_dir: Path, width: int, height: int, fps: int = HLS_FPS,
+                 live: bool = True, scale_width: int = None):
+        """
+        Codificador HLS: recibe frames BGR y escribe playlist + segmentos fMP4
+
+        Args:
+            output_dir: Directorio de salida (index.m3u8, init.mp4, seg_NNNNN.m4s)
+            width, height: Tamaño de los frames de entrada
+            fps: Frames por segundo de entrada
+            live: True = ventana deslizante de segmentos; False = playlist completa (video subido)
+            scale_width: Ancho de salida opcional (mantiene proporción)
+        """
+        self.output_dir = Path(output_dir)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.live = live
+        self.scale_width = scale_width
+        self.process: Optional[subprocess.Popen] = None
+        self._log = None
+
+    @property
+    def playlist_path(self) -> Path:
+        return self.output_dir / "index.m3u8"
+
+    def _command(self) -> list:
+        gop = self.fps * HLS_SEGMENT_SECONDS
+        cmd = [
+            FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{self.width}x{self.height}",
+            "-r", str(self.fps), "-i", "-",
+            "-an", "-c:v", "libx264", "-preset", "veryfast", "-tune", "zerolatency",
+            "-pix_fmt", "yuv420p",
+            # Un keyframe al inicio de cada segmento
+            "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+            "-b:v", HLS_BITRATE, "-maxrate", HLS_BITRATE, "-bufsize", HLS_BITRATE,
+        ]
+        if self.scale_width and self.scale_width < self.width:
+            cmd += ["-vf", f"scale={self.scale_width}:-2"]
+        cmd += [
+            "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS),
+            "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+            "-hls_segment_filename", str(self.output_dir / "seg_%05d.m4s"),
+        ]
+        if self.live:
+            cmd += ["-hls_list_size", str(HLS_LIST_SIZE),
+                    "-hls_flags", "delete_segments+independent_segments"]
+        else:
+            cmd += ["-hls_list_size", "0", "-hls_playlist_type", "event",
+                    "-hls_flags", "independent_segments"]
+        cmd.append(str(self.playlist_path))
+        return cmd
+
+    def start(self):
+        """Lanza el subproceso FFmpeg"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._log = open(self.output_dir / "ffmpeg.log", "wb")
+        self.process = subprocess.Popen(self._command(), stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=self._log)
+
+    def write(self, frame) -> bool:
+        """Envía un frame BGR al codificador (False si FFmpeg terminó)"""
+        if self.process is None or self.process.poll() is not None:
+            return False
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            import cv2
+            frame = cv2.resize(frame, (self.width, self.height))
+        try:
+            self.process.stdin.write(memoryview(frame).cast('B') if frame.flags['C_CONTIGUOUS'] else frame.tobytes())
+            return True
+        except (BrokenPipeError, OSError):
+            return False
+
+    def close(self, timeout: float = 10):
+        """Cierra la entrada y espera a que FFmpeg escriba los últimos segmentos"""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        if self._log is not None:
+            self._log.close()
+
+
+class HLSSession:
+    def __init__(self, key: str, output_dir: Path):
+        """
+        Sesión HLS: un hilo que alimenta un HLSEncoder y se cierra al quedar sin espectadores
+
+        Args:
+            key: Identificador de la sesión (cámara/video + variante)
+            output_dir: Directorio donde se escribe la playlist
+        """
+        self.key = key
+        self.output_dir = output_dir
+        self.last_access = time.time()
+        self.finished = False
+        self.error: Optional[str] = None
+        self.running = True
+        self._thread: Optional[threading.Thread] = None
+
+    def touch(self):
+        self.last_access = time.time()
+
+    def idle(self) -> bool:
+        return time.time() - self.last_access > HLS_IDLE_TIMEOUT
+
+    def start(self, target, *args):
+        self._thread = threading.Thread(target=target, args=(self, *args), name=f"hls-{self.key}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+
+class HLSManager:
+    def __init__(self, base_dir: Path = HLS_DIR):
+        """Registro de sesiones HLS activas (cámaras en vivo y videos subidos)"""
+        self.base_dir = Path(base_dir)
+        self._sessions: Dict[str, HLSSession] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, key: str, target, *args) -> HLSSession:
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and (session.running or session.finished):
+                session.touch()
+                return session
+
+            output_dir = self.base_dir / key
+            shutil.rmtree(output_dir, ignore_errors=True)
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            session = HLSSession(key, output_dir)
+            self._sessions[key] = session
+            session.start(target, *args)
+            return session
+
+    def camera_session(self, stream_hub, camera_id: int, annotate: bool, width: int = None) -> HLSSession:
+        """Sesión en vivo de una cámara (se comparte entre espectadores con la misma variante)"""
+        key = f"cam{camera_id}_{'det' if annotate else 'raw'}_{width or 'full'}"
+        return self._get_or_create(key, _feed_camera, stream_hub, camera_id, annotate, width)
+
+    def video_session(self, video_id: str, video_path: str, annotate: bool, width: int = None,
+                      content_hash: str = None) -> HLSSession:
+        """Sesión de un video subido (playlist completa, se puede reproducir mientras codifica)"""
+        key = f"video_{video_id}_{'det' if annotate else 'raw'}_{width or 'full'}"
+        return self._get_or_create(key, _feed_video, video_path, annotate, width, content_hash)
+
+    def get_session(self, key: str) -> Optional[HLSSession]:
+        session = self._sessions.get(key)
+        if session is not None:
+            session.touch()
+        return session
+
+    def active_count(self) -> int:
+        """Sesiones que siguen codificando"""
+        with self._lock:
+            return sum(1 for session in self._sessions.values() if session.running)
+
+    def remove_video(self, video_id: str):
+        """Detiene y borra las sesiones de un video subido"""
+        with self._lock:
+            keys = [k for k in self._sessions if k.startswith(f"video_{video_id}_")]
+            for key in keys:
+                self._sessions.pop(key).stop()
+        for key in keys:
+            shutil.rmtree(self.base_dir / key, ignore_errors=True)
+
+    def resolve_file(self, key: str, filename: str) -> Optional[Tuple[Path, str]]:
+        """Ruta y media type de un archivo de la sesión (None si el nombre no es válido)"""
+        if not HLS_FILE_PATTERN.match(filename) or key not in self._sessions:
+            return None
+        path = self.base_dir / key / filename
+        return path, HLS_MEDIA_TYPES[path.suffix]
+
+
+def _feed_camera(session: HLSSession, stream_hub, camera_id: int, annotate: bool, width: Optional[int]):
+    """Alimenta el codificador con la cámara a FPS constante (repite o descarta frames)"""
+    stream = stream_hub.subscribe(camera_id, detect=annotate)
+    if stream is None:
+        session.error = "camara_no_disponible"
+        session.running = False
+        return
+
+    encoder = None
+    # Frame actual retenido (se repite si la cámara no entrega uno nuevo a tiempo)
+    current = None
+    try:
+        current = stream.wait_frame(0)
+        if current is None:
+            session.error = "sin_frames"
+            return
+        seq, frame = current
+        height, frame_width = frame.shape[:2]
+        encoder = HLSEncoder(session.output_dir, frame_width, height, live=True, scale_width=width)
+        encoder.start()
+
+        interval = 1.0 / encoder.fps
+        next_tick = time.monotonic()
+        while session.running and not session.idle():
+            item = stream.wait_frame(seq, timeout=interval)
+            if item is None and not stream.running:
+                # Captura perdida o stream detenido: terminar la sesión (FFmpeg cierra la
+                # playlist con ENDLIST) en lugar de repetir el último frame indefinidamente
+                session.error = "camara_detenida"
+                break
+            if item is not None:
+                current.release()
+                current = item
+                seq, frame = item
+            if annotate:
+                with stream.render(seq, frame) as rendered:
+                    written = encoder.write(rendered.frame)
+            else:
+                written = encoder.write(frame)
+            if not written:
+                session.error = "ffmpeg_termino"
+                break
+
+            next_tick += interval
+            remaining = next_tick - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                next_tick = time.monotonic()
+    finally:
+        if current is not None:
+            current.release()
+        if encoder is not None:
+            encoder.close()
+        stream_hub.unsubscribe(stream, detect=annotate)
+        session.running = False
+        logger.info("Sesión HLS %s finalizada", session.key)
+
+
+def _feed_video(session: HLSSession, video_path: str, annotate: bool, width: Optional[int],
+                content_hash: Optional[str] = None):
+    """Codifica un video subido completo (con detección opcional) lo más rápido posible"""
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        session.error = "video_no_disponible"
+        session.running = False
+        return
+
+    pool = None
+    results = None
+    if annotate:
+        from backend.core.detector_pool import get_detector_pool
+        from backend.core.result_cache import result_cache, VideoResultSource
+        try:
+            pool = get_detector_pool()
+            results = VideoResultSource(result_cache, pool, content_hash)
+        except Exception as e:
+            logger.error("No se pudo cargar modelo EPP: %s", e)
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or HLS_FPS
+    encoder = HLSEncoder(session.output_dir,
+                         int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                         fps=max(1, round(fps)), live=False, scale_width=width)
+    encoder.start()
+    frame_index = 0
+    try:
+        while session.running:
+            ret, frame = cap.read()
+            if not ret:
+                session.finished = True
+                break
+            if results is not None:
+                detections = results.detections(frame_index, frame)
+                compliance = pool.reference.classify_compliance(detections)
+                pool.reference.draw_detections(frame, detections, compliance, in_place=True)
+            frame_index += 1
+            if not encoder.write(frame):
+                session.error = "ffmpeg_termino"
+                break
+    finally:
+        cap.release()
+        encoder.close()
+        if results is not None:
+            results.finish(session.finished)
+        session.running = False
+        logger.info("Video HLS %s codificado (%s)", session.key, 'completo' if session.finished else 'interrumpido')
+
+
+# Instancia global
+hls_manager = HLSManager()
+
+
+if __name__ == "__main__":
+    # Prueba con un video local: python -m backend.core.hls_streamer video.mp4 salida/
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Uso: python -m backend.core.hls_streamer <video> <directorio_salida>")
+        sys.exit(1)
+    if not ffmpeg_available():
+        print(f"FFmpeg no encontrado ({FFMPEG_BIN})")
+        sys.exit(1)
+
+    test_session = HLSSession("prueba", Path(sys.argv[2]))
+    Path(sys.argv[2]).mkdir(parents=True, exist_ok=True)
+    _feed_video(test_session, sys.argv[1], annotate=False, width=None)
+    print(f"Playlist: {Path(sys.argv[2]) / 'index.m3u8'} ({'OK' if test_session.finished else test_session.error})")
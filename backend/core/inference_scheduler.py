@@ -0,0 +1,224 @@
+"""
+Planificador de inferencias por cámara
+Reparte un presupuesto global de inferencias por segundo (lo que sostiene la máquina,
+medido al cargar el modelo o fijado con INFERENCE_BUDGET) entre las cámaras con detección
+activa, según su prioridad y su fps_procesamiento (reglas de compliance_rules, por zona o
+por cámara). Cada cámara consume de un token bucket con la tasa asignada: una cámara no
+puede acaparar el modelo y dejar sin inferencias al resto
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from backend.core import metrics
+from backend.core.logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("detector")
+
+# Inferencias/seg a repartir (0 = medir el pool al cargar el modelo)
+INFERENCE_BUDGET = float(os.getenv("INFERENCE_BUDGET", "0"))
+# Fracción del throughput medido que se reparte (margen para picos y otras tareas)
+BUDGET_HEADROOM = 0.85
+# Segundos sin pedir inferencias tras los que una cámara deja de contar en el reparto
+ACTIVE_WINDOW = 3.0
+REBALANCE_INTERVAL = 1.0
+# Ráfaga máxima de un bucket, en segundos de su tasa (mínimo 1 inferencia)
+BURST_SECONDS = 0.2
+
+
+class TokenBucket:
+    def __init__(self, rate: Optional[float], capacity: float = None):
+        """
+        Args:
+            rate: Eventos por segundo (None = sin límite)
+            capacity: Ráfaga máxima (None = BURST_SECONDS de la tasa, mínimo 1)
+        """
+        self.rate = None
+        self._fixed_capacity = capacity
+        self.capacity = 1.0
+        self.tokens = capacity or 1.0
+        self._last = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: Optional[float]):
+        self._refill(time.monotonic())
+        self.rate = rate if rate and rate > 0 else None
+        self.capacity = self._fixed_capacity or max(1.0, (self.rate or 0) * BURST_SECONDS)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        """
+        Toma un token si hay
+
+        Returns:
+            0 si se tomó, o los segundos hasta que haya uno
+        """
+        if self.rate is None:
+            return 0.0
+        self._refill(time.monotonic())
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def refund(self):
+        """Devuelve un token tomado que al final no se usó"""
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + 1.0)
+
+
+class _Demand:
+    __slots__ = ('priority', 'cap', 'zona', 'last_seen')
+
+    def __init__(self, priority: float, cap: Optional[float], zona: Optional[str], now: float):
+        self.priority = priority
+        self.cap = cap
+        self.zona = zona
+        self.last_seen = now
+
+
+class InferenceScheduler:
+    def __init__(self, budget: float = None):
+        """
+        Args:
+            budget: Inferencias/seg a repartir (None = INFERENCE_BUDGET o medición del pool)
+        """
+        configured = budget if budget is not None else INFERENCE_BUDGET
+        self.budget: Optional[float] = configured if configured > 0 else None
+        self.measured: Optional[float] = None
+        self._measure_done = self.budget is not None
+        self._lock = threading.Lock()
+        self._demand: Dict[int, _Demand] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._allocation: Dict[int, Optional[float]] = {}
+        self._next_rebalance = 0.0
+
+    def ensure_budget(self, pool):
+        """Mide el presupuesto con el pool recién cargado (solo la primera vez)"""
+        if self._measure_done:
+            return
+        with self._lock:
+            if self._measure_done:
+                return
+            self._measure_done = True
+        try:
+            throughput = pool.measure_throughput()
+        except Exception as e:
+            logger.error("No se pudo medir el throughput del detector: %s", e)
+            return
+        if throughput > 0:
+            self.measured = throughput
+            with self._lock:
+                self.budget = throughput * BUDGET_HEADROOM
+                self._next_rebalance = 0.0
+            logger.info("Presupuesto de inferencia: %.1f/s (medido %.1f/s con %s instancia(s))",
+                        self.budget, throughput, pool.size)
+
+    def reserve(self, camera_id: int, rules) -> float:
+        """
+        Pide una inferencia para la cámara
+
+        Args:
+            camera_id: ID de la cámara
+            rules: CameraRules vigentes (prioridad, fps_procesamiento, zona)
+
+        Returns:
+            0 si puede inferir ya, o los segundos a esperar antes de volver a pedir
+        """
+        now = time.monotonic()
+        with self._lock:
+            demand = self._demand.get(camera_id)
+            if demand is None:
+                self._demand[camera_id] = _Demand(rules.priority, rules.fps, rules.zona, now)
+                self._next_rebalance = 0.0
+            else:
+                if demand.priority != rules.priority or demand.cap != rules.fps:
+                    # Reglas recargadas
+                    self._next_rebalance = 0.0
+                demand.priority, demand.cap, demand.zona = rules.priority, rules.fps, rules.zona
+                demand.last_seen = now
+            if now >= self._next_rebalance:
+                self._rebalance(now)
+            return self._buckets[camera_id].reserve()
+
+    def release(self, camera_id: int):
+        """La cámara dejó de detectar: su parte vuelve al reparto"""
+        with self._lock:
+            if self._demand.pop(camera_id, None) is not None:
+                self._rebalance(time.monotonic())
+
+    def _rebalance(self, now: float):
+        """Reparto ponderado max-min (llamar con el lock tomado)"""
+        for camera_id in [c for c, d in self._demand.items() if now - d.last_seen > ACTIVE_WINDOW]:
+            del self._demand[camera_id]
+
+        rates: Dict[int, Optional[float]] = {}
+        if self.budget is None:
+            # Sin presupuesto conocido: solo el tope de cada cámara
+            rates = {camera_id: d.cap for camera_id, d in self._demand.items()}
+        else:
+            remaining = self.budget
+            pending = dict(self._demand)
+            while pending:
+                total = sum(d.priority for d in pending.values())
+                capped = [c for c, d in pending.items()
+                          if d.cap is not None and d.cap <= remaining * d.priority / total]
+                if not capped:
+                    for camera_id, d in pending.items():
+                        rates[camera_id] = remaining * d.priority / total
+                    break
+                # Las cámaras con tope bajo liberan su sobrante para el resto
+                for camera_id in capped:
+                    rates[camera_id] = pending.pop(camera_id).cap
+                    remaining -= rates[camera_id]
+
+        for camera_id, rate in rates.items():
+            bucket = self._buckets.get(camera_id)
+            if bucket is None:
+                self._buckets[camera_id] = TokenBucket(rate)
+            elif bucket.rate != rate:
+                bucket.set_rate(rate)
+        for camera_id in [c for c in self._buckets if c not in rates]:
+            del self._buckets[camera_id]
+        self._allocation = rates
+        self._next_rebalance = now + REBALANCE_INTERVAL
+
+    def allocation(self) -> Dict:
+        """Presupuesto y tasa asignada a cada cámara activa"""
+        with self._lock:
+            cameras = [{
+                'camera_id': camera_id,
+                'zona': d.zona,
+                'prioridad': d.priority,
+                'fps_maximo': d.cap,
+                'fps_asignado': round(self._allocation[camera_id], 2)
+                if self._allocation.get(camera_id) is not None else None,
+            } for camera_id, d in self._demand.items()]
+            assigned = sum(r for r in self._allocation.values() if r is not None)
+            return {
+                'budget': round(self.budget, 2) if self.budget is not None else None,
+                'measured': round(self.measured, 2) if self.measured is not None else None,
+                'assigned': round(assigned, 2),
+                'cameras': sorted(cameras, key=lambda c: c['camera_id']),
+            }
+
+    def collect_metrics(self):
+        """Actualiza los gauges de reparto antes de exponer /metrics"""
+        with self._lock:
+            metrics.INFERENCE_BUDGET.set(self.budget or 0)
+            metrics.INFERENCE_RATE.clear()
+            for camera_id, rate in self._allocation.items():
+                if rate is not None:
+                    metrics.INFERENCE_RATE.set(rate, camera_id)
+
+
+# Instancia global
+inference_scheduler = InferenceScheduler()
@@ -0,0 +1,146 @@
+"""
+Codificación JPEG para streams MJPEG
+Parámetros por cliente (ancho, calidad, fps máximo) y modo automático que
+baja calidad o resolución cuando el cliente no alcanza a recibir los frames
+"""
+from typing import List, Optional, Tuple
+import cv2
+
+DEFAULT_QUALITY = 85
+MIN_QUALITY = 40
+MAX_QUALITY = 95
+MIN_WIDTH = 160
+WIDTH_STEP = 16  # Anchos múltiplos de 16: clientes con tamaños parecidos comparten codificación
+QUALITY_STEP = 5
+
+
+def normalize_width(width: Optional[int], source_width: int) -> int:
+    """Ajusta el ancho pedido al rango válido y a múltiplos de WIDTH_STEP"""
+    if not width or width >= source_width:
+        return source_width
+    width = max(MIN_WIDTH, width)
+    return max(MIN_WIDTH, width - width % WIDTH_STEP)
+
+
+def normalize_quality(quality: Optional[int]) -> int:
+    """Ajusta la calidad pedida al rango válido y a múltiplos de QUALITY_STEP"""
+    if quality is None:
+        return DEFAULT_QUALITY
+    quality = min(MAX_QUALITY, max(MIN_QUALITY, quality))
+    return quality - quality % QUALITY_STEP
+
+
+def resized_shape(shape: Tuple[int, ...], width: Optional[int]) -> Tuple[int, ...]:
+    """Forma del frame tras encode_jpeg(width=...) (la misma si no se reduce)"""
+    height, source_width = shape[:2]
+    if not width or width >= source_width:
+        return tuple(shape)
+    return (max(1, round(height * width / source_width)), width) + tuple(shape[2:])
+
+
+def encode_jpeg(frame, width: Optional[int] = None, quality: int = DEFAULT_QUALITY,
+                dst=None) -> Optional[bytes]:
+    """
+    Redimensiona (si hace falta) y codifica un frame a JPEG
+
+    Args:
+        frame: Frame BGR
+        width: Ancho de salida (None = ancho original, se mantiene la proporción)
+        quality: Calidad JPEG (0-100)
+        dst: Buffer reutilizable para el frame redimensionado (forma de resized_shape())
+
+    Returns:
+        Bytes del JPEG o None si falló la codificación
+    """
+    shape = resized_shape(frame.shape, width)
+    if shape != frame.shape:
+        size = (shape[1], shape[0])
+        if dst is not None and dst.shape == shape and dst.dtype == frame.dtype:
+            frame = cv2.resize(frame, size, dst=dst, interpolation=cv2.INTER_AREA)
+        else:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ret:
+        return None
+    return buffer.tobytes()
+
+
+class AdaptiveEncodeController:
+    # Frames seguidos con presión antes de bajar un nivel / sin presión antes de subir
+    DEGRADE_AFTER = 5
+    UPGRADE_AFTER = 90
+
+    def __init__(self, width: Optional[int] = None, quality: Optional[int] = None,
+                 max_fps: Optional[float] = None, auto: bool = False):
+        """
+        Controla los parámetros de codificación de un cliente
+
+        Args:
+            width: Ancho pedido por el cliente (None = original)
+            quality: Calidad JPEG pedida (None = 85)
+            max_fps: FPS máximos a enviar (None = todos los frames)
+            auto: Si True, ajusta calidad/resolución según la presión de envío
+        """
+        self.requested_width = width
+        self.quality = normalize_quality(quality)
+        self.max_fps = max_fps if max_fps and max_fps > 0 else None
+        self.auto = auto
+
+        # Presupuesto de envío por frame (a 30 FPS si el cliente no fija max_fps)
+        self.frame_budget = 1.0 / (self.max_fps or 30.0)
+        self.min_interval = 1.0 / self.max_fps if self.max_fps else 0.0
+
+        self.level = 0
+        self._levels: Optional[List[Tuple[int, int]]] = None
+        self._send_ema = 0.0
+        self._pressure = 0
+        self._healthy = 0
+
+    def _build_levels(self, source_width: int) -> List[Tuple[int, int]]:
+        """Escalera de (ancho, calidad): primero baja calidad, luego resolución"""
+        width = normalize_width(self.requested_width, source_width)
+        levels = [(width, self.quality)]
+        quality = self.quality - 15
+        while quality >= MIN_QUALITY:
+            levels.append((width, normalize_quality(quality)))
+            quality -= 15
+        for factor in (0.75, 0.5, 0.35):
+            scaled = normalize_width(int(width * factor), source_width)
+            if scaled >= MIN_WIDTH and scaled < levels[-1][0]:
+                levels.append((scaled, MIN_QUALITY))
+        return levels
+
+    def current(self, source_width: int) -> Tuple[int, int]:
+        """(ancho, calidad) a usar para el próximo frame"""
+        if self._levels is None:
+            self._levels = self._build_levels(source_width)
+        return self._levels[self.level]
+
+    def report(self, send_seconds: float, skipped_frames: int):
+        """
+        Registra cuánto tardó el envío del último frame
+
+        Args:
+            send_seconds: Tiempo hasta que el servidor pidió el siguiente frame
+            skipped_frames: Frames de la cámara que este cliente se saltó
+        """
+        if not self.auto or self._levels is None:
+            return
+
+        self._send_ema = 0.8 * self._send_ema + 0.2 * send_seconds
+        # Con max_fps los saltos son intencionales: solo cuenta el tiempo de envío
+        backed_up = self._send_ema > self.frame_budget or (self.max_fps is None and skipped_frames >= 2)
+
+        if backed_up:
+            self._pressure += 1
+            self._healthy = 0
+            if self._pressure >= self.DEGRADE_AFTER and self.level < len(self._levels) - 1:
+                self.level += 1
+                self._pressure = 0
+        else:
+            self._healthy += 1
+            self._pressure = 0
+            if self._healthy >= self.UPGRADE_AFTER and self._send_ema < self.frame_budget / 2 and self.level > 0:
+                self.level -= 1
+                self._healthy = 0
@@ -0,0 +1,208 @@
+"""
+Logging estructurado por subsistema (video, detector, alerts, db)
+Los hilos de video solo encolan el registro (sin bloquear); un hilo aparte lo formatea
+y lo escribe en consola o archivo, en texto o JSON. Los mensajes repetidos desde el
+mismo punto del código se limitan por ventana de tiempo o se muestrean, para que una
+tormenta de errores (p.ej. una cámara desconectada) no frene el loop
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text | json
+LOG_FILE = os.getenv("LOG_FILE", "")  # Vacío = solo consola
+LOG_FILE_MAX_MB = int(os.getenv("LOG_FILE_MAX_MB", "20"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Máximo de mensajes del mismo punto del código por ventana (0 = sin límite)
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "5"))
+LOG_RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "10"))
+
+ROOT_LOGGER = "eppvision"
+SUBSYSTEMS = ('video', 'detector', 'alerts', 'db')
+
+# Atributos propios de LogRecord (el resto viene de extra= y va como campo en JSON)
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {'message', 'asctime'}
+_INTERNAL_ATTRS = {'rate_key', 'sample', 'suppressed', 'dropped'}
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW):
+        """
+        Limita los mensajes repetidos por punto del código (archivo:línea)
+
+        Args:
+            limit: Mensajes permitidos por ventana (0 = sin límite)
+            window: Duración de la ventana en segundos
+
+        Extra por llamada:
+            rate_key: Separa el límite por valor (p.ej. camera_id: una cámara caída no silencia a otra)
+            sample: Emite solo 1 de cada N mensajes (además del límite por ventana)
+        """
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # clave -> [inicio de ventana, emitidos, suprimidos, ocurrencias]
+        self._state: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample = getattr(record, 'sample', None)
+        if not self.limit and not sample:
+            return True
+        key = (record.pathname, record.lineno, getattr(record, 'rate_key', None))
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                if len(self._state) > 10000:
+                    self._state.clear()
+                state = self._state[key] = [now, 0, 0, 0]
+            state[3] += 1
+            if sample and (state[3] - 1) % sample:
+                state[2] += 1
+                return False
+            if now - state[0] >= self.window:
+                state[0], state[1] = now, 0
+            if self.limit and state[1] >= self.limit:
+                state[2] += 1
+                return False
+            state[1] += 1
+            if state[2]:
+                record.suppressed = state[2]
+                state[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Encola el registro sin formatearlo; si la cola está llena lo descarta y lo cuenta"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # El formateo (mensaje y traceback) se hace en el hilo del listener
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.dropped:
+            record.dropped, self.dropped = self.dropped, 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 + getattr(record, 'dropped', 0)
+
+
+def _notes(record: logging.LogRecord) -> str:
+    notes = []
+    if getattr(record, 'suppressed', 0):
+        notes.append(f"{record.suppressed} repetidos omitidos")
+    if getattr(record, 'dropped', 0):
+        notes.append(f"{record.dropped} descartados por cola llena")
+    return f" ({', '.join(notes)})" if notes else ""
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(subsystem)-8s %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.subsystem = record.name.rsplit(".", 1)[-1]
+        return super().format(record) + _notes(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """Un objeto JSON por línea con los campos extra= del registro"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'subsystem': record.name.rsplit(".", 1)[-1],
+            'msg': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in _INTERNAL_ATTRS and key != 'subsystem':
+                payload[key] = value
+        if getattr(record, 'suppressed', 0):
+            payload['suppressed'] = record.suppressed
+        if getattr(record, 'dropped', 0):
+            payload['dropped'] = record.dropped
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+_listener: Optional[QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: str = None, fmt: str = None, log_file: str = None):
+    """
+    Configura el logger 'eppvision' (idempotente; get_logger lo llama la primera vez)
+
+    Args:
+        level: Nivel por defecto (LOG_LEVEL); cada subsistema se ajusta con LOG_LEVEL_<SUBSISTEMA>
+        fmt: 'text' o 'json' (LOG_FORMAT)
+        log_file: Archivo de log rotativo además de la consola (LOG_FILE)
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        formatter = JSONFormatter() if (fmt or LOG_FORMAT) == 'json' else TextFormatter()
+        handlers = [logging.StreamHandler(sys.stderr)]
+        log_file = log_file if log_file is not None else LOG_FILE
+        if log_file:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            handlers.append(RotatingFileHandler(log_file, maxBytes=LOG_FILE_MAX_MB * 1024 * 1024,
+                                                backupCount=5, encoding="utf-8"))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.handlers = [queue_handler]
+        root.propagate = False
+        root.setLevel(level or LOG_LEVEL)
+        for subsystem in SUBSYSTEMS:
+            sub_level = os.getenv(f"LOG_LEVEL_{subsystem.upper()}")
+            if sub_level:
+                logging.getLogger(f"{ROOT_LOGGER}.{subsystem}").setLevel(sub_level.upper())
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Escribe los mensajes pendientes y detiene el hilo de logging"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(subsystem: str) -> logging.Logger:
+    """Logger de un subsistema ('video', 'detector', 'alerts', 'db')"""
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
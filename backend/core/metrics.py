@@ -0,0 +1,371 @@
+"""
+Métricas en formato de texto Prometheus (/metrics)
+Contadores, gauges e histogramas mínimos, sin dependencias externas: registrar una
+observación cuesta un lock y una búsqueda binaria, apto para los hilos de video.
+En modo workers cada proceso worker envía con el latido lo que cambió (drain) y el
+proceso web lo agrega (merge) a sus métricas con la etiqueta worker
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+from backend.core.logging_config import get_logger
+from backend.core.profiler import stage_tracer
+
+logger = get_logger("video")
+
+# Buckets de tiempo por etapa (segundos)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple = ()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        """Registro de métricas y de funciones que actualizan gauges al momento de leer"""
+        self._metrics: List["_Metric"] = []
+        self._by_name: Dict[str, "_Metric"] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+            self._by_name[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Función llamada antes de cada lectura (p.ej. para fijar gauges de estado)"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def _collect(self):
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception as e:
+                logger.error("Error en colector: %s", e)
+
+    def drain(self) -> Dict[str, list]:
+        """
+        Cambios desde la última llamada, para enviarlos a otro proceso (workers)
+
+        Returns:
+            {nombre: payload}: incrementos de contadores e histogramas y valores actuales de
+            los gauges (siempre, aunque estén vacíos, para que el receptor los reemplace)
+        """
+        self._collect()
+        payload = {}
+        for metric in list(self._metrics):
+            values = metric.drain()
+            if values or isinstance(metric, Gauge):
+                payload[metric.name] = values
+        return payload
+
+    def merge(self, worker: str, payload: Dict[str, list]):
+        """Agrega lo enviado por un worker (se expone con la etiqueta worker)"""
+        for name, values in payload.items():
+            metric = self._by_name.get(name)
+            if metric is not None:
+                metric.merge(worker, values)
+
+    def forget(self, worker: str):
+        """Descarta los gauges de un worker (proceso terminado o reiniciado); los contadores siguen"""
+        for metric in list(self._metrics):
+            metric.forget(worker)
+
+    def render(self) -> str:
+        """Texto en formato de exposición de Prometheus"""
+        self._collect()
+        lines = []
+        for metric in list(self._metrics):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        # Valores recibidos de workers: (worker, etiquetas) -> valor
+        self._remote: Dict[Tuple[str, Tuple[str, ...]], object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labelvalues) -> Tuple[str, ...]:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} espera etiquetas {self.labelnames}")
+        return tuple(str(v) for v in labelvalues)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], Tuple, object]]:
+        """(etiquetas, etiquetas extra, valor) locales y de workers (llamar con el lock tomado)"""
+        items = [(key, (), value) for key, value in self._values.items()]
+        items += [(key, (("worker", worker),), value) for (worker, key), value in self._remote.items()]
+        return items
+
+    def drain(self) -> List:
+        """Valores actuales (gauges)"""
+        with self._lock:
+            return list(self._values.items())
+
+    def merge(self, worker: str, values: List):
+        """Valores de un worker: reemplazan los que había enviado antes (gauges)"""
+        with self._lock:
+            self._remote = {k: v for k, v in self._remote.items() if k[0] != worker}
+            for key, value in values:
+                self._remote[(worker, tuple(key))] = value
+
+    def forget(self, worker: str):
+        with self._lock:
+            self._remote = {k: v for k, v in self._remote.items() if k[0] != worker}
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = self._items()
+        lines = self._header()
+        for key, extra, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        # Valores ya enviados por drain() (solo en workers)
+        self._shipped: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def drain(self) -> List:
+        """Incrementos desde la última llamada"""
+        with self._lock:
+            deltas = []
+            for key, value in self._values.items():
+                delta = value - self._shipped.get(key, 0)
+                if delta:
+                    deltas.append((key, delta))
+                    self._shipped[key] = value
+            return deltas
+
+    def merge(self, worker: str, values: List):
+        """Suma los incrementos de un worker (siguen creciendo aunque el worker se reinicie)"""
+        with self._lock:
+            for key, delta in values:
+                remote_key = (worker, tuple(key))
+                self._remote[remote_key] = self._remote.get(remote_key, 0) + delta
+
+    def forget(self, worker: str):
+        pass
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labelvalues):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labelvalues, amount: float = 1):
+        key = self._key(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labelvalues, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._shipped: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, *labelvalues):
+        key = self._key(labelvalues)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [conteos por bucket (+Inf al final), suma, total]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """Mide la duración del bloque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def drain(self) -> List:
+        """Observaciones desde la última llamada: (etiquetas, (conteos, suma, total))"""
+        with self._lock:
+            deltas = []
+            for key, (counts, total_sum, count) in self._values.items():
+                shipped = self._shipped.get(key)
+                if shipped is None:
+                    shipped = ([0] * len(counts), 0.0, 0)
+                if count == shipped[2]:
+                    continue
+                deltas.append((key, ([n - s for n, s in zip(counts, shipped[0])],
+                                     total_sum - shipped[1], count - shipped[2])))
+                self._shipped[key] = (list(counts), total_sum, count)
+            return deltas
+
+    def merge(self, worker: str, values: List):
+        """Suma las observaciones de un worker"""
+        with self._lock:
+            for key, (counts, total_sum, count) in values:
+                remote_key = (worker, tuple(key))
+                state = self._remote.get(remote_key)
+                if state is None:
+                    state = self._remote[remote_key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total_sum
+                state[2] += count
+
+    def forget(self, worker: str):
+        pass
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, extra, (list(state[0]), state[1], state[2])) for key, extra, state in self._items()]
+        lines = self._header()
+        for key, extra, (counts, total_sum, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, extra + (("le", _format_value(float(bound))),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, extra)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total_sum)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# ============= MÉTRICAS DEL SISTEMA =============
+
+# Etapas: capture, preprocess, inference, postprocess, draw, encode, db_write
+STAGE_SECONDS = Histogram("epp_stage_seconds", "Duracion de cada etapa del pipeline por camara", ["stage", "camera"])
+
+FRAMES_CAPTURED = Counter("epp_frames_captured_total", "Frames capturados", ["camera"])
+FRAMES_DETECTED = Counter("epp_frames_detected_total", "Frames analizados por el detector", ["camera"])
+# reason: deteccion (el detector no alcanzó el ritmo de captura), cliente (cliente MJPEG lento),
+#         planificador (fuera de la tasa de inferencia asignada a la cámara)
+FRAMES_DROPPED = Counter("epp_frames_dropped_total", "Frames descartados", ["camera", "reason"])
+ALERTS = Counter("epp_alerts_total", "Alertas generadas", ["camera", "severidad"])
+# Ocurrencias sumadas a un incidente abierto y incidentes descartados por tope (limite: camara, global)
+ALERTS_COALESCED = Counter("epp_alerts_coalesced_total", "Ocurrencias agrupadas en una alerta abierta", ["camera"])
+ALERTS_SUPPRESSED = Counter("epp_alerts_suppressed_total", "Alertas descartadas por tope de frecuencia",
+                            ["camera", "limite"])
+COMPLIANCE_FLICKER = Counter("epp_compliance_flicker_total",
+                             "Frames con incumplimiento aun no confirmado por el filtro temporal", ["camera"])
+# stage: captura (frame suelto fuera del anillo), render (dibujo con copia)
+FRAME_RING_EXHAUSTED = Counter("epp_frame_ring_exhausted_total",
+                               "Frames asignados fuera del anillo por tener todos los slots retenidos",
+                               ["camera", "stage"])
+
+STREAMS_ACTIVE = Gauge("epp_streams_active", "Camaras con captura activa")
+STREAM_SUBSCRIBERS = Gauge("epp_stream_subscribers", "Clientes conectados por camara", ["camera", "tipo"])
+DETECTION_LAG = Gauge("epp_detection_lag_frames", "Frames capturados pendientes de deteccion", ["camera"])
+POOL_SIZE = Gauge("epp_detector_pool_size", "Instancias del pool de detectores")
+POOL_IN_USE = Gauge("epp_detector_pool_in_use", "Detectores en uso")
+POOL_WAITING = Gauge("epp_detector_pool_waiting", "Hilos esperando un detector")
+INFERENCE_BUDGET = Gauge("epp_inference_budget", "Inferencias por segundo repartidas entre las camaras")
+INFERENCE_RATE = Gauge("epp_inference_rate_allocated", "Inferencias por segundo asignadas por camara", ["camera"])
+POOL_UTILIZATION = Gauge("epp_detector_pool_utilization", "Fraccion del pool en uso")
+HLS_SESSIONS = Gauge("epp_hls_sessions_active", "Sesiones HLS activas")
+# Modo workers (CAMERA_WORKERS > 0): las etapas, frames y alertas se miden dentro de cada
+# worker y llegan con el latido (etiqueta worker)
+WORKERS_ALIVE = Gauge("epp_workers_alive", "Procesos worker de captura/inferencia vivos")
+WORKER_CAMERAS = Gauge("epp_worker_cameras", "Camaras asignadas por worker", ["worker"])
+WORKER_RESTARTS = Counter("epp_worker_restarts_total", "Reinicios de workers caidos o colgados", ["worker"])
+
+
+def observe_stage(stage: str, camera, seconds: float, end: float = None):
+    """Registra la duración de una etapa (y la agrega a la traza si está activa)"""
+    STAGE_SECONDS.observe(seconds, stage, camera)
+    if stage_tracer.active:
+        stage_tracer.add(stage, camera, seconds, end)
+
+
+@contextmanager
+def stage_timer(stage: str, camera):
+    """Mide la duración del bloque como una etapa del pipeline"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, camera, time.perf_counter() - start)
+
+
+def observe_model_speed(camera, speed: Dict[str, float]):
+    """Registra los tiempos de ultralytics (result.speed, en milisegundos) por etapa"""
+    # Las etapas terminaron en orden y la última recién: la traza se reconstruye hacia atrás
+    end = time.time()
+    for stage in ("postprocess", "inference", "preprocess"):
+        ms = speed.get(stage)
+        if ms is not None:
+            observe_stage(stage, camera, ms / 1000.0, end)
+            end -= ms / 1000.0
+
+
+def collect_pool():
+    """Gauges del pool de detectores (si ya está cargado)"""
+    from backend.core.detector_pool import get_loaded_pool
+    pool = get_loaded_pool()
+    if pool is None:
+        return
+    stats = pool.get_stats()
+    POOL_SIZE.set(stats['size'])
+    POOL_IN_USE.set(stats['in_use'])
+    POOL_WAITING.set(stats['waiting'])
+    POOL_UTILIZATION.set(stats['utilization'])
+
+
+REGISTRY.add_collector(collect_pool)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
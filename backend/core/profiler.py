@@ -0,0 +1,231 @@
+"""
+Profiler por muestreo del proceso en ejecución (todos los hilos)
+Un hilo toma la pila de cada hilo cada pocos milisegundos con sys._current_frames()
+y acumula pilas colapsadas (formato de flamegraph.pl / speedscope): sin reiniciar el
+servidor ni instrumentar código. El modo traza registra además las etapas del pipeline
+(captura, inferencia, dibujo, JPEG, BD) con su camera_id en formato Chrome trace
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from backend.core.logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("video")
+
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "10"))
+PROFILER_MAX_SECONDS = int(os.getenv("PROFILER_MAX_SECONDS", "300"))
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "200000"))
+
+# Raíz del proyecto: las rutas de archivo se muestran relativas
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _frame_label(code, cache: Dict) -> str:
+    """'funcion (archivo:línea)' con la línea de la definición: una función = un nodo"""
+    label = cache.get(code)
+    if label is None:
+        filename = code.co_filename
+        if filename.startswith(_PROJECT_ROOT):
+            filename = os.path.relpath(filename, _PROJECT_ROOT)
+        else:
+            filename = os.path.basename(filename)
+        # ';' separa marcos en el formato colapsado
+        label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+        cache[code] = label
+    return label
+
+
+class SamplingProfiler:
+    def __init__(self):
+        """Sesión de muestreo única por proceso (se reemplaza al iniciar otra)"""
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: Counter = Counter()
+        self._stacks_lock = threading.Lock()
+        self._labels: Dict = {}
+        self.samples = 0
+        self.interval = PROFILER_INTERVAL_MS / 1000
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.duration = 0.0
+        self.sampling_time = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval_ms: float = None) -> Dict:
+        """
+        Inicia el muestreo durante N segundos (se detiene solo)
+
+        Args:
+            seconds: Duración máxima (se limita a PROFILER_MAX_SECONDS)
+            interval_ms: Milisegundos entre muestras (PROFILER_INTERVAL_MS por defecto)
+
+        Raises:
+            RuntimeError: Si ya hay un muestreo en curso
+        """
+        with self._lock:
+            if self.running:
+                raise RuntimeError("Ya hay un muestreo en curso")
+            self.duration = max(0.1, min(float(seconds), PROFILER_MAX_SECONDS))
+            self.interval = max(1.0, interval_ms or PROFILER_INTERVAL_MS) / 1000
+            self._stacks = Counter()
+            self.samples = 0
+            self.sampling_time = 0.0
+            self.started_at = time.time()
+            self.finished_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        logger.info("Profiler iniciado por %.0fs (cada %.0f ms)", self.duration, self.interval * 1000)
+        return self.status()
+
+    def stop(self, wait: float = 2.0) -> Dict:
+        """Detiene el muestreo en curso (los resultados se conservan)"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=wait)
+        return self.status()
+
+    def wait(self, timeout: float = None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names: Dict[int, str] = {}
+        names_refreshed = 0.0
+        deadline = time.monotonic() + self.duration
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                tick = time.perf_counter()
+
+                # Nombres de hilos (se refrescan cada segundo: hilos de captura y workers van y vienen)
+                if tick - names_refreshed > 1.0:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                    names_refreshed = tick
+
+                sample = []
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_label(frame.f_code, self._labels))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, f"hilo-{ident}").replace(";", ","))
+                    stack.reverse()
+                    sample.append(";".join(stack))
+                with self._stacks_lock:
+                    self._stacks.update(sample)
+                self.samples += 1
+
+                spent = time.perf_counter() - tick
+                self.sampling_time += spent
+                self._stop.wait(max(0.0, self.interval - spent))
+        finally:
+            self.finished_at = time.time()
+            logger.info("Profiler detenido: %s muestras", self.samples)
+
+    def status(self) -> Dict:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            'running': self.running,
+            'started_at': self.started_at,
+            'elapsed_s': round(elapsed, 2),
+            'duration_s': self.duration,
+            'interval_ms': round(self.interval * 1000, 1),
+            'samples': self.samples,
+            'stacks': len(self._stacks),
+            # Fracción del tiempo que el hilo del profiler pasó tomando muestras
+            'overhead': round(self.sampling_time / elapsed, 4) if elapsed else 0.0,
+        }
+
+    def collapsed(self, thread_prefix: str = None) -> str:
+        """
+        Pilas colapsadas: 'hilo;marco;marco;... cantidad' por línea
+
+        Args:
+            thread_prefix: Solo hilos cuyo nombre empieza así (p.ej. 'captura-cam', 'deteccion-cam')
+        """
+        with self._stacks_lock:
+            stacks = self._stacks.copy()
+        lines = [
+            f"{stack} {count}" for stack, count in stacks.most_common()
+            if not thread_prefix or stack.startswith(thread_prefix)
+        ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+class StageTracer:
+    def __init__(self, max_events: int = TRACE_MAX_EVENTS):
+        """Registro de etapas del pipeline con camera_id (solo mientras está activo)"""
+        self.active = False
+        self.camera_id: Optional[str] = None
+        self._events: deque = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._until = 0.0
+
+    def start(self, seconds: float, camera_id=None):
+        """Activa la traza durante N segundos (opcionalmente de una sola cámara)"""
+        with self._lock:
+            self._events.clear()
+            self.camera_id = str(camera_id) if camera_id is not None else None
+            self._until = time.monotonic() + max(0.1, min(float(seconds), PROFILER_MAX_SECONDS))
+            self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def add(self, stage: str, camera, seconds: float, end: float = None):
+        """Registra una etapa terminada (end en time.time(); por defecto, ahora)"""
+        if not self.active:
+            return
+        if time.monotonic() > self._until:
+            self.active = False
+            return
+        camera = str(camera)
+        if self.camera_id is not None and camera != self.camera_id:
+            return
+        end = end if end is not None else time.time()
+        with self._lock:
+            self._events.append((stage, camera, end - seconds, seconds, threading.current_thread().name))
+
+    def chrome_trace(self) -> Dict:
+        """Eventos en formato Chrome trace (chrome://tracing, Perfetto): un proceso por cámara"""
+        with self._lock:
+            events = list(self._events)
+        cameras: Dict[str, int] = {}
+        threads: Dict[tuple, int] = {}
+        trace: List[Dict] = []
+        for stage, camera, start, seconds, thread in events:
+            pid = cameras.get(camera)
+            if pid is None:
+                pid = cameras[camera] = len(cameras) + 1
+                trace.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                              'args': {'name': f"camera {camera}"}})
+            tid = threads.get((pid, thread))
+            if tid is None:
+                tid = threads[(pid, thread)] = len(threads) + 1
+                trace.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}})
+            trace.append({
+                'name': stage, 'cat': 'pipeline', 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': round(start * 1e6), 'dur': round(seconds * 1e6),
+                'args': {'camera_id': camera},
+            })
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+# Instancias globales
+profiler = SamplingProfiler()
+stage_tracer = StageTracer()
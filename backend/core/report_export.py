@@ -0,0 +1,332 @@
+"""
+Exportación de reportes (alertas y detecciones) en CSV, Parquet o XLSX
+Las filas se leen por páginas de EXPORT_CHUNK_ROWS (keyset sobre (timestamp, id), una
+consulta corta por página) y cada lote se escribe y se envía enseguida: memoria acotada
+y primer byte inmediato en cualquier motor (mysqlconnector no tiene cursores del lado
+del servidor y cargaría el resultado completo)
+"""
+import csv
+import io
+import zipfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from xml.sax.saxutils import escape
+from sqlalchemy import select, and_, or_
+from backend.core.database import engine, Alerta, Deteccion, Camera, ensure_schema
+
+EXPORT_CHUNK_ROWS = 5000
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# Columnas exportadas por conjunto de datos: (nombre, expresión, tipo)
+DATASETS = {
+    'alertas': [
+        ('id', Alerta.id, 'int'),
+        ('fecha', Alerta.timestamp, 'datetime'),
+        ('camera_id', Alerta.camera_id, 'int'),
+        ('camera_nombre', Camera.nombre, 'str'),
+        ('zona', Camera.zona, 'str'),
+        ('tipo', Alerta.tipo, 'str'),
+        ('severidad', Alerta.severidad, 'str'),
+        ('mensaje', Alerta.mensaje, 'str'),
+        ('estado', Alerta.estado, 'str'),
+        ('ocurrencias', Alerta.ocurrencias, 'int'),
+        ('ultima_ocurrencia', Alerta.ultima_ocurrencia, 'datetime'),
+        ('revisada_por', Alerta.revisada_por, 'str'),
+        ('revisada_at', Alerta.revisada_at, 'datetime'),
+        ('deteccion_id', Alerta.deteccion_id, 'int'),
+    ],
+    'detecciones': [
+        ('id', Deteccion.id, 'int'),
+        ('fecha', Deteccion.timestamp, 'datetime'),
+        ('camera_id', Deteccion.camera_id, 'int'),
+        ('camera_nombre', Camera.nombre, 'str'),
+        ('zona', Camera.zona, 'str'),
+        ('estado_epp', Deteccion.estado_epp, 'str'),
+        ('observaciones', Deteccion.observaciones, 'str'),
+        ('imagen_path', Deteccion.imagen_path, 'str'),
+    ],
+}
+
+# Límite de filas por hoja de Excel (sin contar el encabezado)
+XLSX_MAX_ROWS = 1048575
+
+
+class ExportError(Exception):
+    """Parámetros de exportación inválidos o formato no disponible"""
+    pass
+
+
+MODELS = {'alertas': Alerta, 'detecciones': Deteccion}
+
+
+def build_query(dataset: str, desde: datetime = None, hasta: datetime = None, camera_id: int = None,
+                zona: str = None, tipo: str = None, severidad: str = None, estado: str = None):
+    """Consulta Core (sin objetos ORM) con los filtros pedidos"""
+    if dataset not in DATASETS:
+        raise ExportError(f"Conjunto de datos inválido. Use: {', '.join(DATASETS)}")
+    model = MODELS[dataset]
+    ensure_schema()
+    columns = [expr.label(name) for name, expr, _ in DATASETS[dataset]]
+
+    query = select(*columns).select_from(model).outerjoin(Camera, Camera.id == model.camera_id)
+    if desde is not None:
+        query = query.where(model.timestamp >= desde)
+    if hasta is not None:
+        query = query.where(model.timestamp < hasta)
+    if camera_id is not None:
+        query = query.where(model.camera_id == camera_id)
+    if zona:
+        query = query.where(Camera.zona == zona)
+    if dataset == 'alertas':
+        if tipo and tipo != 'todas':
+            query = query.where(Alerta.tipo.contains(tipo))
+        if severidad:
+            query = query.where(Alerta.severidad == severidad)
+        if estado:
+            query = query.where(Alerta.estado == estado)
+    elif estado:
+        query = query.where(Deteccion.estado_epp == estado)
+    return query.order_by(model.timestamp, model.id)
+
+
+def iter_chunks(dataset: str, query, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[List]:
+    """
+    Lotes de filas paginados por (timestamp, id), como la retención recorre por PK
+
+    Cada página es una consulta con LIMIT en una conexión que se devuelve al pool antes
+    de enviar el lote: un cliente lento no retiene una conexión ni un resultado abierto
+    """
+    model = MODELS[dataset]
+    last = None
+    while True:
+        page = query
+        if last is not None:
+            last_ts, last_id = last
+            page = page.where(or_(model.timestamp > last_ts,
+                                  and_(model.timestamp == last_ts, model.id > last_id)))
+        with engine.connect() as conn:
+            rows = conn.execute(page.limit(chunk_rows)).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_rows:
+            return
+        last = (rows[-1].fecha, rows[-1].id)
+
+
+class _StreamSink:
+    """Archivo de solo escritura que acumula bytes para enviarlos por partes"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+
+def export_csv(dataset: str, query) -> Iterator[bytes]:
+    """CSV UTF-8 (con BOM para que Excel respete los acentos)"""
+    names = [name for name, _, _ in DATASETS[dataset]]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+
+    for chunk in iter_chunks(dataset, query):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_cell_text(v) for v in row] for row in chunk)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def export_parquet(dataset: str, query) -> Iterator[bytes]:
+    """Parquet (zstd), un row group por lote"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("La exportación a Parquet requiere pyarrow")
+
+    pa_types = {'int': pa.int64(), 'str': pa.string(), 'datetime': pa.timestamp("us")}
+    columns = DATASETS[dataset]
+    schema = pa.schema([pa.field(name, pa_types[kind]) for name, _, kind in columns])
+
+    def generate():
+        sink = _StreamSink()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        yield sink.drain()  # Encabezado "PAR1"
+        for chunk in iter_chunks(dataset, query):
+            data = {name: [row[i] for row in chunk] for i, (name, _, _) in enumerate(columns)}
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+    return generate()
+
+
+class _StreamingXLSX:
+    """XLSX mínimo escrito en streaming (zip sin seek, hojas con cadenas en línea)"""
+
+    def __init__(self, names: List[str], kinds: List[str]):
+        self.names = names
+        self.kinds = kinds
+        self.sink = _StreamSink()
+        self.zip = zipfile.ZipFile(self.sink, "w", compression=zipfile.ZIP_DEFLATED)
+        self.sheets = 0
+        self._sheet = None
+        self._rows = 0
+
+    def _open_sheet(self):
+        self.sheets += 1
+        self._sheet = self.zip.open(f"xl/worksheets/sheet{self.sheets}.xml", "w", force_zip64=True)
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        self._rows = 0
+        self._write_row(self.names, ['str'] * len(self.names))
+
+    def _close_sheet(self):
+        self._sheet.write(b"</sheetData></worksheet>")
+        self._sheet.close()
+        self._sheet = None
+
+    def _write_row(self, values, kinds):
+        self._rows += 1
+        cells = []
+        for value, kind in zip(values, kinds):
+            if value is None:
+                cells.append("<c/>")
+            elif kind == 'int':
+                cells.append(f'<c t="n"><v>{value}</v></c>')
+            else:
+                cells.append(f'<c t="inlineStr"><is><t>{escape(_cell_text(value))}</t></is></c>')
+        self._sheet.write(f'<row r="{self._rows}">{"".join(cells)}</row>'.encode("utf-8"))
+
+    def write_rows(self, rows) -> bytes:
+        if self._sheet is None and self.sheets == 0:
+            self._open_sheet()
+        for row in rows:
+            if self._sheet is None or self._rows > XLSX_MAX_ROWS:
+                if self._sheet is not None:
+                    self._close_sheet()
+                self._open_sheet()
+            self._write_row(row, self.kinds)
+        return self.sink.drain()
+
+    def close(self) -> bytes:
+        if self._sheet is None:
+            self._open_sheet()
+        self._close_sheet()
+
+        sheets = range(1, self.sheets + 1)
+        ns = 'xmlns="http://schemas.openxmlformats.org/package/2006/relationships"'
+        self.zip.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+                      'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                      for i in sheets)
+            + '</Types>'
+        ))
+        self.zip.writestr("_rels/.rels", (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><Relationships {ns}>'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>'
+        ))
+        self.zip.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + "".join(f'<sheet name="Hoja{i}" sheetId="{i}" r:id="rId{i}"/>' for i in sheets)
+            + '</sheets></workbook>'
+        ))
+        self.zip.writestr("xl/_rels/workbook.xml.rels", (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><Relationships {ns}>'
+            + "".join(f'<Relationship Id="rId{i}" '
+                      'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                      f'Target="worksheets/sheet{i}.xml"/>' for i in sheets)
+            + '</Relationships>'
+        ))
+        self.zip.close()
+        return self.sink.drain()
+
+
+def export_xlsx(dataset: str, query) -> Iterator[bytes]:
+    """XLSX escrito en streaming (se reparte en varias hojas si supera el límite de Excel)"""
+    columns = DATASETS[dataset]
+    workbook = _StreamingXLSX([name for name, _, _ in columns], [kind for _, _, kind in columns])
+    yield workbook.write_rows([])  # Encabezado del zip y de la primera hoja
+    for chunk in iter_chunks(dataset, query):
+        data = workbook.write_rows(chunk)
+        if data:
+            yield data
+    yield workbook.close()
+
+
+EXPORTERS = {
+    'csv': export_csv,
+    'parquet': export_parquet,
+    'xlsx': export_xlsx,
+}
+
+
+def export_report(dataset: str, formato: str, filters: Optional[Dict] = None) -> Iterator[bytes]:
+    """
+    Generador de bytes del reporte
+
+    Args:
+        dataset: 'alertas' o 'detecciones'
+        formato: 'csv', 'parquet' o 'xlsx'
+        filters: desde, hasta, camera_id, zona, tipo, severidad, estado
+
+    Raises:
+        ExportError si los parámetros no son válidos (antes de empezar a enviar)
+    """
+    if formato not in EXPORTERS:
+        raise ExportError(f"Formato inválido. Use: {', '.join(EXPORTERS)}")
+    query = build_query(dataset, **(filters or {}))
+    return EXPORTERS[formato](dataset, query)
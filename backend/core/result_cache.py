@@ -0,0 +1,218 @@
+"""
+Caché de resultados de detección para videos subidos
+Las detecciones por frame se guardan en disco (.npz columnar) con una clave que combina
+el hash del contenido del video, la huella del modelo y los umbrales de detección.
+El cumplimiento se recalcula al leer, así que cambiar las reglas no invalida la caché.
+"""
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+from backend.core import metrics
+
+from backend.core.logging_config import get_logger
+load_dotenv()
+
+logger = get_logger("video")
+
+RESULT_CACHE_DIR = Path(os.getenv("RESULT_CACHE_DIR", "backend/data/result_cache"))
+CACHE_FORMAT_VERSION = 1
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+_model_fingerprints: Dict[tuple, str] = {}
+_fingerprint_lock = threading.Lock()
+
+
+def file_sha256(path: str) -> str:
+    """Hash SHA-256 del contenido de un archivo (lectura en bloques)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_fingerprint(model_path: str) -> str:
+    """Huella del archivo de pesos del modelo (se recalcula solo si cambia tamaño o fecha)"""
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return f"missing:{model_path}"
+    key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+    with _fingerprint_lock:
+        if key not in _model_fingerprints:
+            _model_fingerprints[key] = file_sha256(model_path)[:16]
+        return _model_fingerprints[key]
+
+
+def cache_key(content_hash: str, detector) -> str:
+    """
+    Clave de caché para un video analizado con un detector
+
+    Args:
+        content_hash: SHA-256 del archivo de video
+        detector: EPPDetector (aporta ruta del modelo y umbrales)
+    """
+    parts = [
+        f"v{CACHE_FORMAT_VERSION}",
+        content_hash,
+        model_fingerprint(detector.model_path),
+        f"conf={detector.conf_threshold:.4f}",
+        f"iou={detector.iou_threshold:.4f}",
+    ]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+class CachedResults:
+    def __init__(self, path: Path):
+        """Detecciones cacheadas de un video (columnas en memoria)"""
+        with np.load(path, allow_pickle=False) as data:
+            self.frame_offsets = data['frame_offsets']
+            self.bbox = data['bbox']
+            self.conf = data['conf']
+            self.class_id = data['class_id']
+            self.class_names = [str(name) for name in data['class_names']]
+
+    @property
+    def total_frames(self) -> int:
+        return len(self.frame_offsets) - 1
+
+    def frame_detections(self, frame_index: int, detector) -> List[Dict]:
+        """
+        Detecciones del frame (índice desde 0) en el mismo formato que EPPDetector.detect()
+        """
+        if frame_index >= self.total_frames:
+            return []
+        start, end = self.frame_offsets[frame_index], self.frame_offsets[frame_index + 1]
+        return [
+            detector.build_detection(self.class_names[self.class_id[i]], float(self.conf[i]),
+                                     [int(v) for v in self.bbox[i]])
+            for i in range(start, end)
+        ]
+
+
+class ResultCacheWriter:
+    def __init__(self):
+        """Acumula detecciones frame a frame para guardarlas al terminar el video"""
+        self._counts: List[int] = []
+        self._bbox: List[List[int]] = []
+        self._conf: List[float] = []
+        self._class_id: List[int] = []
+        self._class_index: Dict[str, int] = {}
+
+    @property
+    def frames(self) -> int:
+        return len(self._counts)
+
+    def add(self, detections: List[Dict]):
+        """Agrega las detecciones del siguiente frame (en orden)"""
+        self._counts.append(len(detections))
+        for det in detections:
+            self._bbox.append(det['bbox'])
+            self._conf.append(det['confidence'])
+            self._class_id.append(self._class_index.setdefault(det['class'], len(self._class_index)))
+
+    def save(self, path: Path):
+        """Escribe el archivo .npz de forma atómica"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        offsets = np.zeros(len(self._counts) + 1, dtype=np.int64)
+        np.cumsum(self._counts, out=offsets[1:])
+        class_names = sorted(self._class_index, key=self._class_index.get)
+
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez_compressed(
+            tmp_path,
+            frame_offsets=offsets,
+            bbox=np.asarray(self._bbox, dtype=np.int32).reshape(-1, 4),
+            conf=np.asarray(self._conf, dtype=np.float32),
+            class_id=np.asarray(self._class_id, dtype=np.int16),
+            class_names=np.asarray(class_names, dtype=str),
+        )
+        os.replace(tmp_path, path)
+
+
+class ResultCache:
+    def __init__(self, cache_dir: Path = RESULT_CACHE_DIR):
+        """Caché en disco de resultados por clave (hash de contenido + modelo + umbrales)"""
+        self.cache_dir = Path(cache_dir)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.npz"
+
+    def load(self, key: str) -> Optional[CachedResults]:
+        """Carga resultados cacheados (None si no existen o el archivo está dañado)"""
+        path = self._path(key)
+        if not path.exists():
+            return None
+        try:
+            return CachedResults(path)
+        except Exception as e:
+            logger.error("Archivo de caché inválido %s: %s", path.name, e)
+            return None
+
+    def store(self, key: str, writer: ResultCacheWriter):
+        try:
+            writer.save(self._path(key))
+            logger.info("Resultados guardados (%s frames) en %s...", writer.frames, key[:12])
+        except Exception as e:
+            logger.error("No se pudo guardar caché: %s", e)
+
+
+class VideoResultSource:
+    def __init__(self, cache: ResultCache, pool, content_hash: Optional[str]):
+        """
+        Entrega las detecciones de cada frame de un video: desde caché si el mismo contenido
+        ya se analizó con el mismo modelo y umbrales, o ejecutando el modelo y guardando el resultado
+
+        Args:
+            cache: Caché de resultados
+            pool: EPPDetectorPool
+            content_hash: SHA-256 del video (None = aún desconocido, no se usa caché)
+        """
+        self.cache = cache
+        self.pool = pool
+        self.key = cache_key(content_hash, pool.reference) if content_hash else None
+        self.cached = cache.load(self.key) if self.key else None
+        self.writer = None if self.cached is not None else ResultCacheWriter()
+
+    @property
+    def cache_hit(self) -> bool:
+        return self.cached is not None
+
+    def detections(self, frame_index: int, frame) -> List[Dict]:
+        """Detecciones del frame (índice desde 0, en orden)"""
+        if self.cached is not None:
+            return self.cached.frame_detections(frame_index, self.pool.reference)
+
+        with self.pool.acquire() as detector:
+            detections = detector.detect(frame)
+            metrics.observe_model_speed("video", detector.last_speed)
+        if self.writer is not None:
+            if frame_index == self.writer.frames:
+                self.writer.add(detections)
+            else:
+                # Frames fuera de orden: el resultado no sería reproducible
+                self.writer = None
+        return detections
+
+    def finish(self, completed: bool, content_hash: Optional[str] = None):
+        """
+        Guarda los resultados si se analizó el video completo
+
+        Args:
+            completed: True si se llegó al final del video
+            content_hash: Hash del contenido si se conoció después de empezar (subida en curso)
+        """
+        if self.writer is None or not completed or self.writer.frames == 0:
+            return
+        key = self.key or (cache_key(content_hash, self.pool.reference) if content_hash else None)
+        if key is not None:
+            self.cache.store(key, self.writer)
+        self.writer = None
+
+
+# Instancia global
+result_cache = ResultCache()
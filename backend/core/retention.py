@@ -0,0 +1,530 @@
+"""
+Retención del historial de detecciones
+Borra por lotes cortos (commit por lote, sin bloquear save_detection) las filas más
+antiguas que la política de cada tabla, archivándolas antes en archivos columnares
+comprimidos, y recorta o recomprime los snapshots viejos
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import delete, update, exists, and_, or_, inspect, Integer, Float, DateTime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from backend.core.database import (SessionLocal, engine, Deteccion, DeteccionEPP, Alerta, EventoSistema,
+                                   ResumenCumplimiento, ResumenFaltaEPP, ConfiguracionIA)
+
+from backend.core.logging_config import get_logger
+load_dotenv()
+
+logger = get_logger("db")
+
+
+def _days(name: str, default: str = "0") -> int:
+    """Días de retención desde el entorno (0 = conservar siempre)"""
+    return int(os.getenv(name, default))
+
+
+# Políticas (días; 0 = no borrar)
+RETENTION_DETECCIONES_DAYS = _days("RETENTION_DETECCIONES_DAYS")  # detecciones + detecciones_epp
+RETENTION_ALERTAS_DAYS = _days("RETENTION_ALERTAS_DAYS")
+RETENTION_EVENTOS_DAYS = _days("RETENTION_EVENTOS_DAYS")
+RETENTION_RESUMEN_MINUTO_DAYS = _days("RETENTION_RESUMEN_MINUTO_DAYS")
+RETENTION_RESUMEN_HORA_DAYS = _days("RETENTION_RESUMEN_HORA_DAYS")
+RETENTION_SNAPSHOTS_DAYS = _days("RETENTION_SNAPSHOTS_DAYS")
+SNAPSHOT_COMPACT_DAYS = _days("SNAPSHOT_COMPACT_DAYS")
+
+RETENTION_ARCHIVE = os.getenv("RETENTION_ARCHIVE", "1") == "1"
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "backend/data/archive"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+
+# Lotes cortos: cada DELETE toca pocas filas por PK y hace commit enseguida
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+ARCHIVE_FILE_ROWS = 50000  # Filas por archivo de archivo (se escribe completo antes de borrar)
+
+# Compactación de snapshots
+SNAPSHOT_COMPACT_WIDTH = 640
+SNAPSHOT_COMPACT_QUALITY = 60
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SNAPSHOTS_DIR = Path(PROJECT_ROOT) / "backend" / "static" / "snapshots"
+COMPACT_STATE_FILE = ".compactado.json"
+
+# Bloqueo entre procesos: fila de configuracion_ia con el proceso que ejecuta la retención
+# (valor) y su último latido (updated_at); vence si el proceso muere a mitad de camino
+RUN_LOCK_PARAM = "retencion_en_curso"
+RUN_LOCK_TTL = timedelta(minutes=30)
+RUN_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _chunks(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ArchiveWriter:
+    def __init__(self, archive_dir: Path, table: str, columns: List):
+        """
+        Escribe filas de una tabla en archivos columnares comprimidos
+
+        Parquet (zstd) si pyarrow está instalado; si no, .npz comprimido con una
+        columna de texto por campo.
+
+        Args:
+            archive_dir: Directorio base del archivo
+            table: Nombre de la tabla (subdirectorio)
+            columns: Columnas SQLAlchemy a archivar (en orden)
+        """
+        self.dir = Path(archive_dir) / table
+        self.table = table
+        self.columns = columns
+        try:
+            import pyarrow
+            self._pa = pyarrow
+        except ImportError:
+            self._pa = None
+
+    def _schema(self):
+        pa = self._pa
+        fields = []
+        for column in self.columns:
+            if isinstance(column.type, Integer):
+                pa_type = pa.int64()
+            elif isinstance(column.type, Float):
+                pa_type = pa.float64()
+            elif isinstance(column.type, DateTime):
+                pa_type = pa.timestamp("us")
+            else:
+                pa_type = pa.string()
+            fields.append(pa.field(column.name, pa_type))
+        return pa.schema(fields)
+
+    def write(self, rows: List, suffix: str) -> Path:
+        """
+        Escribe un archivo completo (atómico: tmp + rename) y devuelve su ruta
+
+        Args:
+            rows: Tuplas en el orden de las columnas
+            suffix: Sufijo del nombre (rango de ids)
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        names = [column.name for column in self.columns]
+        values = {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+        if self._pa is not None:
+            import pyarrow.parquet as pq
+            path = self.dir / f"{self.table}_{stamp}_{suffix}.parquet"
+            tmp_path = path.with_suffix(".tmp")
+            table = self._pa.Table.from_pydict(values, schema=self._schema())
+            pq.write_table(table, tmp_path, compression="zstd")
+        else:
+            import numpy as np
+            path = self.dir / f"{self.table}_{stamp}_{suffix}.npz"
+            tmp_path = path.with_suffix(".tmp.npz")
+            np.savez_compressed(tmp_path, **{
+                name: np.asarray(["" if v is None else str(v) for v in column], dtype=str)
+                for name, column in values.items()
+            })
+        os.replace(tmp_path, path)
+        return path
+
+
+class RetentionManager:
+    def __init__(self, archive: bool = RETENTION_ARCHIVE, archive_dir: Path = ARCHIVE_DIR,
+                 batch_size: int = RETENTION_BATCH_SIZE, batch_pause: float = RETENTION_BATCH_PAUSE):
+        """
+        Aplica las políticas de retención
+
+        Args:
+            archive: Archivar las filas antes de borrarlas
+            archive_dir: Directorio de archivos
+            batch_size: Filas por DELETE/commit
+            batch_pause: Pausa entre lotes (deja pasar las escrituras en vivo)
+        """
+        self.archive = archive
+        self.archive_dir = Path(archive_dir)
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+
+    def _get_db(self) -> Session:
+        return SessionLocal()
+
+    # ---------- Bloqueo entre procesos ----------
+
+    def _acquire_run_lock(self) -> bool:
+        """
+        Toma el bloqueo de retención en la BD (un solo proceso la ejecuta a la vez)
+
+        Returns:
+            True si este proceso lo tomó
+        """
+        db = self._get_db()
+        try:
+            if db.query(ConfiguracionIA.id).filter_by(parametro=RUN_LOCK_PARAM).first() is None:
+                try:
+                    db.add(ConfiguracionIA(parametro=RUN_LOCK_PARAM, valor=None,
+                                           descripcion="Proceso que ejecuta la retención (bloqueo)"))
+                    db.commit()
+                except IntegrityError:
+                    # Otro proceso creó la fila al mismo tiempo
+                    db.rollback()
+            now = datetime.now()
+            result = db.execute(
+                update(ConfiguracionIA)
+                .where(ConfiguracionIA.parametro == RUN_LOCK_PARAM,
+                       or_(ConfiguracionIA.valor.is_(None), ConfiguracionIA.valor == RUN_ID,
+                           ConfiguracionIA.updated_at < now - RUN_LOCK_TTL))
+                .values(valor=RUN_ID, updated_at=now)
+            )
+            db.commit()
+            return result.rowcount == 1
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _renew_run_lock(self):
+        """Latido del bloqueo (llamar entre lotes largos)"""
+        self._set_run_lock(RUN_ID, datetime.now())
+
+    def _release_run_lock(self):
+        self._set_run_lock(None, datetime.now())
+
+    def _set_run_lock(self, valor: Optional[str], updated_at: datetime):
+        db = self._get_db()
+        try:
+            db.execute(update(ConfiguracionIA)
+                       .where(ConfiguracionIA.parametro == RUN_LOCK_PARAM, ConfiguracionIA.valor == RUN_ID)
+                       .values(valor=valor, updated_at=updated_at))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("Retención: no se pudo actualizar el bloqueo: %s", e)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _cutoff(days: int) -> datetime:
+        return datetime.now() - timedelta(days=days)
+
+    def _purge(self, model, condition, label: str, dry_run: bool = False,
+               children: List = (), archive: bool = True,
+               on_deleted: Callable[[List], None] = None) -> int:
+        """
+        Borra por lotes las filas de model que cumplen condition (recorrido por PK)
+
+        Args:
+            model: Modelo a purgar
+            condition: Filtro SQLAlchemy
+            label: Nombre para logs y archivos
+            children: Pares (modelo hijo, columna FK) que se borran antes que el padre
+            archive: Archivar filas (y las de los hijos) antes de borrar
+            on_deleted: Callback con las filas borradas de cada lote
+
+        Returns:
+            Filas borradas (o que se borrarían en dry_run)
+        """
+        columns = list(model.__table__.columns)
+        writer = ArchiveWriter(self.archive_dir, model.__tablename__, columns) if self.archive and archive else None
+        total = 0
+        last_id = 0
+
+        while not self._stop.is_set():
+            # 1) Leer (sin bloquear) hasta ARCHIVE_FILE_ROWS filas, paginando por id
+            rows = []
+            db = self._get_db()
+            try:
+                while len(rows) < ARCHIVE_FILE_ROWS:
+                    page = (db.query(*columns)
+                            .filter(condition, model.id > last_id)
+                            .order_by(model.id)
+                            .limit(self.batch_size)
+                            .all())
+                    if not page:
+                        break
+                    rows.extend(page)
+                    last_id = page[-1].id
+            finally:
+                db.close()
+            if not rows:
+                break
+
+            total += len(rows)
+            if dry_run:
+                continue
+            self._renew_run_lock()
+
+            ids = [row.id for row in rows]
+
+            # 2) Archivar completo antes de borrar nada
+            if writer is not None:
+                suffix = f"{ids[0]}-{ids[-1]}"
+                writer.write(rows, suffix)
+                for child, fk in children:
+                    child_columns = list(child.__table__.columns)
+                    child_rows = []
+                    db = self._get_db()
+                    try:
+                        for chunk in _chunks(ids, self.batch_size):
+                            child_rows.extend(db.query(*child_columns).filter(fk.in_(chunk)).all())
+                    finally:
+                        db.close()
+                    if child_rows:
+                        ArchiveWriter(self.archive_dir, child.__tablename__, child_columns).write(child_rows, suffix)
+
+            # 3) Borrar en lotes cortos, un commit por lote
+            for chunk_rows in _chunks(rows, self.batch_size):
+                chunk = [row.id for row in chunk_rows]
+                db = self._get_db()
+                try:
+                    for child, fk in children:
+                        db.execute(delete(child).where(fk.in_(chunk)))
+                    db.execute(delete(model).where(model.id.in_(chunk)))
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
+                    db.close()
+                if on_deleted is not None:
+                    on_deleted(chunk_rows)
+                time.sleep(self.batch_pause)
+
+        if total:
+            accion = "a borrar" if dry_run else "borradas"
+            logger.info("Retención %s: %s filas %s", label, total, accion)
+        return total
+
+    # ---------- Políticas ----------
+
+    def purge_alertas(self, days: int = RETENTION_ALERTAS_DAYS, dry_run: bool = False) -> int:
+        if days <= 0:
+            return 0
+        removed = self._purge(Alerta, Alerta.timestamp < self._cutoff(days), "alertas", dry_run)
+        if removed and not dry_run:
+            from backend.core.alert_counters import alert_counters
+            alert_counters.invalidate()
+        return removed
+
+    def purge_detecciones(self, days: int = RETENTION_DETECCIONES_DAYS, dry_run: bool = False) -> int:
+        """Detecciones viejas sin alertas vigentes (con su detalle de EPP y snapshot)"""
+        if days <= 0:
+            return 0
+        condition = and_(
+            Deteccion.timestamp < self._cutoff(days),
+            ~exists().where(Alerta.deteccion_id == Deteccion.id)
+        )
+        return self._purge(Deteccion, condition, "detecciones", dry_run,
+                           children=[(DeteccionEPP, DeteccionEPP.deteccion_id)],
+                           on_deleted=self._delete_snapshots)
+
+    def purge_eventos(self, days: int = RETENTION_EVENTOS_DAYS, dry_run: bool = False) -> int:
+        if days <= 0:
+            return 0
+        return self._purge(EventoSistema, EventoSistema.timestamp < self._cutoff(days), "eventos_sistema", dry_run)
+
+    def purge_resumenes(self, dry_run: bool = False) -> int:
+        """Resúmenes por minuto y por hora viejos (los diarios se conservan; no se archivan, son derivados)"""
+        total = 0
+        for granularidad, days in (('minuto', RETENTION_RESUMEN_MINUTO_DAYS), ('hora', RETENTION_RESUMEN_HORA_DAYS)):
+            if days <= 0:
+                continue
+            cutoff = self._cutoff(days)
+            for model in (ResumenCumplimiento, ResumenFaltaEPP):
+                if not inspect(engine).has_table(model.__tablename__):
+                    continue
+                condition = and_(model.granularidad == granularidad, model.bucket < cutoff)
+                total += self._purge(model, condition, f"{model.__tablename__} ({granularidad})", dry_run,
+                                     archive=False)
+        return total
+
+    @staticmethod
+    def _snapshot_file(imagen_path: Optional[str]) -> Optional[Path]:
+        if not imagen_path:
+            return None
+        return Path(PROJECT_ROOT) / "backend" / imagen_path
+
+    def _delete_snapshots(self, rows: List):
+        for row in rows:
+            path = self._snapshot_file(row.imagen_path)
+            if path is not None and path.exists():
+                try:
+                    path.unlink()
+                except OSError as e:
+                    logger.error("Retención: no se pudo borrar %s: %s", path.name, e)
+
+    def _alerted_snapshots(self, paths: List[str]) -> set:
+        """Rutas de snapshots de detecciones con alertas (se conservan mientras exista la alerta)"""
+        db = self._get_db()
+        try:
+            rows = (db.query(Deteccion.imagen_path)
+                    .filter(Deteccion.imagen_path.in_(paths),
+                            exists().where(Alerta.deteccion_id == Deteccion.id))
+                    .all())
+            return {row.imagen_path for row in rows}
+        finally:
+            db.close()
+
+    def prune_snapshots(self, days: int = RETENTION_SNAPSHOTS_DAYS, dry_run: bool = False) -> int:
+        """
+        Borra snapshots viejos y limpia su referencia en detecciones
+
+        Los snapshots de detecciones con alertas se conservan: son la evidencia de la alerta y
+        se borran con su detección (purge_detecciones) cuando la retención de alertas la libera.
+        """
+        if days <= 0 or not SNAPSHOTS_DIR.exists():
+            return 0
+        cutoff = time.time() - days * 86400
+        old = [p for p in SNAPSHOTS_DIR.glob("*.jpg") if p.stat().st_mtime < cutoff]
+
+        removed = 0
+        for chunk in _chunks(old, self.batch_size):
+            paths = {f"static/snapshots/{p.name}": p for p in chunk}
+            keep = self._alerted_snapshots(list(paths))
+            chunk = [path for name, path in paths.items() if name not in keep]
+            removed += len(chunk)
+            if dry_run or not chunk:
+                continue
+            db = self._get_db()
+            try:
+                names = [f"static/snapshots/{p.name}" for p in chunk]
+                db.execute(update(Deteccion).where(Deteccion.imagen_path.in_(names)).values(imagen_path=None))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+            for path in chunk:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            time.sleep(self.batch_pause)
+        if removed:
+            accion = "a borrar" if dry_run else "borrados"
+            logger.info("Retención snapshots: %s archivos %s", removed, accion)
+        return removed
+
+    def compact_snapshots(self, days: int = SNAPSHOT_COMPACT_DAYS, dry_run: bool = False) -> int:
+        """
+        Recomprime snapshots con más de `days` días (ancho máximo y calidad menores)
+
+        Se guarda hasta qué fecha de modificación ya se compactó, así cada archivo se procesa una vez.
+        """
+        if days <= 0 or not SNAPSHOTS_DIR.exists():
+            return 0
+        import cv2
+
+        state_path = SNAPSHOTS_DIR / COMPACT_STATE_FILE
+        try:
+            done_until = json.loads(state_path.read_text())["hasta"]
+        except (OSError, ValueError, KeyError):
+            done_until = 0.0
+        cutoff = time.time() - days * 86400
+
+        pending = [p for p in SNAPSHOTS_DIR.glob("*.jpg") if done_until <= p.stat().st_mtime < cutoff]
+        if dry_run:
+            if pending:
+                logger.info("Retención snapshots: %s archivos a compactar", len(pending))
+            return len(pending)
+
+        saved = 0
+        for path in pending:
+            stat = path.stat()
+            image = cv2.imread(str(path))
+            if image is None:
+                continue
+            height, width = image.shape[:2]
+            if width > SNAPSHOT_COMPACT_WIDTH:
+                new_height = round(height * SNAPSHOT_COMPACT_WIDTH / width)
+                image = cv2.resize(image, (SNAPSHOT_COMPACT_WIDTH, new_height), interpolation=cv2.INTER_AREA)
+            ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_COMPACT_QUALITY])
+            if not ret or len(buffer) >= stat.st_size:
+                continue
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(buffer.tobytes())
+            os.replace(tmp_path, path)
+            # Conservar la fecha original (la usan la retención y la compactación)
+            os.utime(path, (stat.st_atime, stat.st_mtime))
+            saved += stat.st_size - len(buffer)
+
+        state_path.write_text(json.dumps({"hasta": cutoff}))
+        if pending:
+            logger.info("Retención snapshots: %s compactados (%.1f MB liberados)", len(pending), saved / 1024 / 1024)
+        return len(pending)
+
+    # ---------- Ejecución ----------
+
+    def run(self, dry_run: bool = False) -> Dict[str, int]:
+        """
+        Aplica todas las políticas (alertas antes que detecciones por la FK)
+
+        Con varios procesos web solo uno la ejecuta a la vez (bloqueo en configuracion_ia);
+        los demás la omiten y devuelven un diccionario vacío.
+        """
+        with self._run_lock:
+            if not dry_run and not self._acquire_run_lock():
+                logger.info("Retención omitida: otro proceso la está ejecutando")
+                return {}
+            try:
+                inicio = time.time()
+                result = {
+                    'alertas': self.purge_alertas(dry_run=dry_run),
+                    'detecciones': self.purge_detecciones(dry_run=dry_run),
+                    'eventos_sistema': self.purge_eventos(dry_run=dry_run),
+                    'resumenes': self.purge_resumenes(dry_run=dry_run),
+                    'snapshots_borrados': self.prune_snapshots(dry_run=dry_run),
+                    'snapshots_compactados': self.compact_snapshots(dry_run=dry_run),
+                }
+                logger.info("Retención completada en %.1fs", time.time() - inicio)
+                return result
+            finally:
+                if not dry_run:
+                    self._release_run_lock()
+
+    def start(self, interval_hours: float = RETENTION_INTERVAL_HOURS):
+        """Ejecuta la retención periódicamente en segundo plano (la primera vez al minuto de arrancar)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            wait = 60
+            while not self._stop.wait(wait):
+                try:
+                    self.run()
+                except Exception as e:
+                    logger.exception("Error en retención: %s", e)
+                wait = interval_hours * 3600
+
+        self._thread = threading.Thread(target=loop, name="retencion", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# Instancia global
+retention_manager = RetentionManager()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Aplica las políticas de retención del historial")
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta lo que se borraría")
+    args = parser.parse_args()
+
+    print(json.dumps(retention_manager.run(dry_run=args.dry_run), indent=2))
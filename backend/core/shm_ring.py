@@ -0,0 +1,196 @@
+"""
+Buffer circular en memoria compartida (multiprocessing.shared_memory)
+Un proceso escribe frames o mensajes en slots de tamaño fijo y otros procesos leen el
+más reciente sin serializarlo con pickle. Cada slot lleva su número de secuencia: el
+lector lo verifica antes y después de copiar (seqlock), así una escritura simultánea
+sobre el mismo slot se detecta y la lectura se reintenta
+"""
+import os
+import sys
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Slots por buffer: más slots toleran lectores más lentos antes de que se pise el frame leído
+SHM_RING_SLOTS = int(os.getenv("SHM_RING_SLOTS", "4"))
+
+# Cabecera: último seq escrito, slot que lo contiene, cantidad de slots, tamaño de slot
+_HEADER = np.dtype([('write_seq', '<u8'), ('latest', '<u4'), ('slots', '<u4'), ('slot_size', '<u8')])
+# Metadatos por slot: seq (0 = escribiendo), bytes útiles y forma del frame
+_SLOT_META = np.dtype([('seq', '<u8'), ('nbytes', '<u8'), ('shape', '<u4', 3), ('dtype', 'S8')])
+_HEADER_SIZE = 64
+
+
+class ShmRing:
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        """
+        Usar ShmRing.create() (escritor) o ShmRing.attach() (lector)
+
+        Args:
+            shm: Bloque de memoria compartida
+            owner: Si True, este proceso escribe y destruye el bloque al cerrar
+        """
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self._header = np.ndarray((1,), dtype=_HEADER, buffer=shm.buf)[0]
+        self.slots = int(self._header['slots'])
+        self.slot_size = int(self._header['slot_size'])
+        self._meta = np.ndarray((self.slots,), dtype=_SLOT_META, buffer=shm.buf, offset=_HEADER_SIZE)
+        self._data_offset = _HEADER_SIZE + self._meta.nbytes
+        self._data = np.ndarray((self.slots, self.slot_size), dtype=np.uint8, buffer=shm.buf,
+                                offset=self._data_offset)
+
+    @classmethod
+    def create(cls, name: str, slot_size: int, slots: int = None) -> "ShmRing":
+        """Crea el bloque (reemplaza uno huérfano con el mismo nombre)"""
+        slots = max(2, slots or SHM_RING_SLOTS)
+        size = _HEADER_SIZE + _SLOT_META.itemsize * slots + slot_size * slots
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Bloque de un worker anterior que terminó sin limpiar
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((1,), dtype=_HEADER, buffer=shm.buf)
+        header['write_seq'] = 0
+        header['latest'] = 0
+        header['slots'] = slots
+        header['slot_size'] = slot_size
+        np.ndarray((slots,), dtype=_SLOT_META, buffer=shm.buf, offset=_HEADER_SIZE)['seq'] = 0
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "ShmRing":
+        """Abre un bloque existente para leer"""
+        # Los workers comparten el resource_tracker del proceso web: el bloque ya está
+        # registrado y lo destruye su creador (o el tracker si el worker murió)
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, owner=False)
+
+    # ---------- Escritura (un solo proceso) ----------
+
+    def slot_array(self, index: int, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """Vista escribible de un slot (para decodificar o copiar directamente en él)"""
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._data[index, :nbytes].view(dtype).reshape(shape)
+
+    def begin_write(self, index: int):
+        """Marca el slot como en escritura: los lectores no lo toman hasta commit()"""
+        self._meta[index]['seq'] = 0
+
+    def commit(self, index: int, shape: Tuple[int, ...], dtype: str) -> int:
+        """Publica el contenido del slot como el más reciente; devuelve su seq"""
+        dtype = np.dtype(dtype)
+        seq = int(self._header['write_seq']) + 1
+        meta = self._meta[index]
+        meta['nbytes'] = int(np.prod(shape)) * dtype.itemsize
+        meta['shape'] = (tuple(shape) + (1, 1, 1))[:3]
+        meta['dtype'] = dtype.str.encode()
+        meta['seq'] = seq
+        # Orden: slot, luego 'latest', luego write_seq (el lector los lee al revés)
+        self._header['latest'] = index
+        self._header['write_seq'] = seq
+        return seq
+
+    def _write(self, payload: np.ndarray, shape: Tuple[int, ...], dtype: str) -> int:
+        nbytes = payload.nbytes
+        if nbytes > self.slot_size:
+            raise ValueError(f"{nbytes} bytes no caben en slots de {self.slot_size}")
+        index = (int(self._header['latest']) + 1) % self.slots
+        self.begin_write(index)
+        self._data[index, :nbytes] = payload.reshape(-1).view(np.uint8)
+        return self.commit(index, shape, dtype)
+
+    def write_frame(self, frame: np.ndarray) -> int:
+        """Copia un frame (alto x ancho x canales) al siguiente slot; devuelve su seq"""
+        frame = np.ascontiguousarray(frame)
+        return self._write(frame, frame.shape, frame.dtype.str)
+
+    def write_bytes(self, data: bytes) -> int:
+        """Copia un mensaje (p.ej. JSON) al siguiente slot; devuelve su seq"""
+        return self._write(np.frombuffer(data, dtype=np.uint8), (len(data),), "|u1")
+
+    # ---------- Lectura (cualquier proceso) ----------
+
+    def latest_seq(self) -> int:
+        return int(self._header['write_seq'])
+
+    def _read(self, out: Optional[np.ndarray] = None, retries: int = 3):
+        for _ in range(retries):
+            seq = int(self._header['write_seq'])
+            if seq == 0:
+                return None
+            index = int(self._header['latest'])
+            meta = self._meta[index]
+            if int(meta['seq']) != seq:
+                continue
+            nbytes = int(meta['nbytes'])
+            shape = tuple(int(v) for v in meta['shape'])
+            dtype = np.dtype(meta['dtype'].decode())
+            if out is None or out.nbytes != nbytes or out.dtype != dtype or not out.flags.c_contiguous:
+                out = np.empty(nbytes // dtype.itemsize, dtype=dtype)
+            out.reshape(-1).view(np.uint8)[:] = self._data[index, :nbytes]
+            # Si el escritor dio la vuelta al buffer mientras copiábamos, reintentar
+            if int(meta['seq']) == seq:
+                return seq, shape, out
+        return None
+
+    def read_frame(self, out: np.ndarray = None) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Copia el frame más reciente
+
+        Args:
+            out: Array a reutilizar si tiene el mismo tamaño y tipo (p.ej. un slot de FrameRing:
+                 evita una asignación por frame)
+
+        Returns:
+            (seq, frame) o None si no hay frames o no se logró una copia consistente
+        """
+        item = self._read(out)
+        if item is None:
+            return None
+        seq, shape, data = item
+        return seq, data.reshape(shape)
+
+    def read_bytes(self) -> Optional[Tuple[int, bytes]]:
+        """Copia el mensaje más reciente: (seq, bytes) o None"""
+        item = self._read()
+        if item is None:
+            return None
+        seq, shape, data = item
+        return seq, data.tobytes()
+
+    def close(self):
+        """Libera la vista local (y destruye el bloque si este proceso lo creó)"""
+        self._header = self._meta = self._data = None
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            self.shm.close()
+        except BufferError:
+            # Queda alguna vista viva: el mapeo se libera cuando la recolecte el GC
+            pass
+
+
+def unlink_ring(name: str):
+    """Destruye el bloque de un proceso que terminó sin limpiar (p.ej. un worker caído)"""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,619 @@
+"""
+Hub de Streams de Cámaras (fan-out)
+Una sola captura y una sola detección por cámara, compartidas por todos los clientes
+(MJPEG con overlay del servidor, MJPEG crudo y canal de metadatos de detección)
+Los frames se decodifican en un anillo de buffers preasignados (FrameRing) y se entregan
+como FrameLease: el slot no se reutiliza mientras algún consumidor lo retenga
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from backend.core.frame_ring import FrameRing, FrameLease
+from backend.core.jpeg_encoder import encode_jpeg, resized_shape
+from backend.core import metrics
+from backend.core.logging_config import get_logger
+
+load_dotenv()
+
+logger = get_logger("video")
+
+# Segundos sin suscriptores antes de liberar la cámara
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "5"))
+
+# Evaluación de alertas: revisar cada ~1 seg, mínimo 5 seg entre ocurrencias de la misma cámara
+ALERT_CHECK_INTERVAL = 1.0
+ALERT_MIN_INTERVAL = 5.0
+
+# Slots para frames anotados (uno por seq, compartido por los clientes con overlay)
+RENDER_RING_SLOTS = 4
+
+# Numeración de anillos en memoria compartida: nombres únicos en el proceso aunque una
+# cámara se reabra antes de que el stream anterior libere el suyo
+_shm_ring_ids = itertools.count(1)
+
+
+class CameraStream:
+    def __init__(self, camera_id: int, capture, on_stop: Callable[["CameraStream"], None],
+                 shared_frames: bool = False):
+        """
+        Stream compartido de una cámara
+
+        Args:
+            camera_id: ID de la cámara configurada
+            capture: Captura abierta (cv2.VideoCapture o compatible)
+            on_stop: Callback al terminar la captura (libera la cámara)
+            shared_frames: Si True, el anillo de frames vive en memoria compartida
+                           (lo usan los workers para servir al proceso web sin copiar)
+        """
+        self.camera_id = camera_id
+        self.capture = capture
+        self._on_stop = on_stop
+        self.shared_frames = shared_frames
+
+        self._cond = threading.Condition()
+        self.running = False
+
+        # Último frame capturado (los frames nuevos no se modifican: solo lectura)
+        self.seq = 0
+        self.frame = None
+        self.detected_seq = 0
+
+        # Anillo de frames (se crea con la forma del primer frame) y slot del último frame
+        self.frame_ring: Optional[FrameRing] = None
+        self._frame_slot: Optional[Tuple[FrameRing, int]] = None
+
+        # Última detección publicada
+        self.result: Optional[Dict] = None
+        self.result_json: Optional[str] = None
+        self.result_version = 0
+
+        # Suscriptores
+        self.subscribers = 0
+        self.detect_subscribers = 0
+        self._idle_since = time.time()
+
+        # Frame anotado cacheado por seq (compartido por clientes con overlay del servidor)
+        self._render_lock = threading.Lock()
+        self._render_ring: Optional[FrameRing] = None
+        self._rendered_seq = 0
+        self._rendered_frame = None
+        self._rendered_slot: Optional[Tuple[FrameRing, int]] = None
+
+        # JPEG cacheados por variante (overlay, ancho, calidad): clientes iguales comparten codificación
+        self._encode_lock = threading.Lock()
+        self._variant_locks: Dict[Tuple, threading.Lock] = {}
+        self._encoded: Dict[Tuple, Tuple[int, bytes]] = {}
+        self._resize_buffers: Dict[Tuple, np.ndarray] = {}
+        self._last_prune = 0
+
+        # Estado de alertas (el cumplimiento se suaviza en el tiempo antes de alertar)
+        self._compliance_filter = None
+        self._last_alert_check = 0.0
+        self._last_alert_time = 0.0
+
+        self._capture_thread = threading.Thread(
+            target=self._capture_loop, name=f"captura-cam{camera_id}", daemon=True)
+        self._detect_thread = threading.Thread(
+            target=self._detect_loop, name=f"deteccion-cam{camera_id}", daemon=True)
+
+    def start(self):
+        """Inicia los hilos de captura y detección"""
+        self.running = True
+        self._capture_thread.start()
+        self._detect_thread.start()
+
+    def stop(self, wait: float = 0):
+        """Detiene el stream (la cámara se libera al salir el hilo de captura)"""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if wait:
+            self.join(timeout=wait)
+
+    def join(self, timeout: float = None):
+        """Espera a que el hilo de captura termine y libere la cámara"""
+        if threading.current_thread() is not self._capture_thread and self._capture_thread.is_alive():
+            self._capture_thread.join(timeout=timeout)
+
+    # ---------- Suscriptores ----------
+
+    def add_subscriber(self, detect: bool = False):
+        with self._cond:
+            self.subscribers += 1
+            if detect:
+                self.detect_subscribers += 1
+            self._idle_since = None
+            self._cond.notify_all()
+
+    def remove_subscriber(self, detect: bool = False):
+        with self._cond:
+            self.subscribers = max(0, self.subscribers - 1)
+            if detect:
+                self.detect_subscribers = max(0, self.detect_subscribers - 1)
+            if self.subscribers == 0:
+                self._idle_since = time.time()
+
+    def wait_frame(self, last_seq: int, timeout: float = 5.0) -> Optional[FrameLease]:
+        """
+        Espera un frame más nuevo que last_seq
+
+        Returns:
+            FrameLease (seq, frame) que retiene el slot hasta release(), o None si el
+            stream terminó o no llegaron frames a tiempo
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not self.running or self.seq > last_seq, timeout)
+            if self.seq <= last_seq or (not self.running and self.frame is None):
+                return None
+            return self._lease_latest()
+
+    def _lease_latest(self) -> FrameLease:
+        """Retiene el último frame (llamar con self._cond tomado)"""
+        slot = self._frame_slot
+        if slot is None:
+            return FrameLease(self.seq, self.frame)
+        slot[0].incref(slot[1])
+        return FrameLease(self.seq, self.frame, *slot)
+
+    def wait_result(self, last_version: int, timeout: float = 15.0) -> Optional[Tuple[int, Optional[str]]]:
+        """
+        Espera una detección más nueva que last_version
+
+        Returns:
+            (version, json) | (last_version, None) si venció el timeout | None si el stream terminó
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: not self.running or self.result_version > last_version, timeout)
+            if not self.running:
+                return None
+            if self.result_version <= last_version:
+                return last_version, None
+            return self.result_version, self.result_json
+
+    def latest_result(self) -> Tuple[int, Optional[Dict], Optional[str]]:
+        """Última detección publicada: (versión, resultado, json) leídos juntos"""
+        with self._cond:
+            return self.result_version, self.result, self.result_json
+
+    def render(self, seq: int, frame) -> FrameLease:
+        """
+        Frame con las detecciones dibujadas (se dibuja una vez por seq para todos los clientes,
+        sobre un slot del anillo de frames anotados). El llamador libera el FrameLease devuelto
+        """
+        with self._render_lock:
+            if self._rendered_seq != seq:
+                result = self.result
+                if result is None:
+                    # Sin detección aún: el frame tal cual (lo retiene el lease del llamador)
+                    return FrameLease(seq, frame)
+
+                from backend.core.epp_detector import EPPDetector
+                ring = self._render_ring
+                if ring is None or not ring.fits(frame):
+                    ring = self._render_ring = FrameRing(frame.shape, frame.dtype, slots=RENDER_RING_SLOTS)
+                index = ring.acquire()
+                with metrics.stage_timer("draw", self.camera_id):
+                    if index is None:
+                        metrics.FRAME_RING_EXHAUSTED.inc(self.camera_id, "render")
+                        annotated = EPPDetector.draw_detections(frame, result['detections'], result['compliance'])
+                    else:
+                        annotated = ring.view(index)
+                        np.copyto(annotated, frame)
+                        EPPDetector.draw_detections(annotated, result['detections'], result['compliance'],
+                                                    in_place=True)
+
+                previous = self._rendered_slot
+                self._rendered_seq = seq
+                self._rendered_frame = annotated
+                self._rendered_slot = (ring, index) if index is not None else None
+                if previous is not None:
+                    previous[0].release(previous[1])
+
+            slot = self._rendered_slot
+            if slot is None:
+                return FrameLease(seq, self._rendered_frame)
+            slot[0].incref(slot[1])
+            return FrameLease(seq, self._rendered_frame, *slot)
+
+    def encode(self, seq: int, frame, width: int, quality: int, annotated: bool) -> Optional[bytes]:
+        """
+        JPEG del frame seq en la variante pedida (se codifica una vez por seq y variante)
+
+        Args:
+            seq: Número de frame
+            frame: Frame a codificar (crudo o anotado)
+            width: Ancho de salida
+            quality: Calidad JPEG
+            annotated: Si el frame lleva el overlay del servidor (parte de la clave de caché)
+        """
+        key = (annotated, width, quality)
+        with self._encode_lock:
+            lock = self._variant_locks.setdefault(key, threading.Lock())
+
+        with lock:
+            cached = self._encoded.get(key)
+            if cached is not None and cached[0] == seq:
+                return cached[1]
+
+            # Buffer de redimensionado reutilizado por variante (protegido por el lock de la variante)
+            shape = resized_shape(frame.shape, width)
+            buffer = None
+            if shape != frame.shape:
+                buffer = self._resize_buffers.get(key)
+                if buffer is None or buffer.shape != shape:
+                    buffer = self._resize_buffers[key] = np.empty(shape, dtype=frame.dtype)
+
+            with metrics.stage_timer("encode", self.camera_id):
+                data = encode_jpeg(frame, width, quality, dst=buffer)
+            if data is not None:
+                self._encoded[key] = (seq, data)
+
+        # Descartar variantes que ningún cliente pidió en los últimos frames
+        if seq - self._last_prune >= 100:
+            self._last_prune = seq
+            with self._encode_lock:
+                for stale in [k for k, (s, _) in self._encoded.items() if seq - s > 100]:
+                    self._encoded.pop(stale, None)
+                    self._variant_locks.pop(stale, None)
+                    self._resize_buffers.pop(stale, None)
+        return data
+
+    # ---------- Hilos ----------
+
+    def _idle_expired(self) -> bool:
+        """True si el stream lleva más de STREAM_IDLE_TIMEOUT sin clientes"""
+        idle_since = self._idle_since
+        return idle_since is not None and time.time() - idle_since > STREAM_IDLE_TIMEOUT
+
+    def _acquire_buffer(self) -> Tuple[Optional[int], Optional[np.ndarray]]:
+        """Slot libre del anillo para el próximo frame: (índice, vista) o (None, None)"""
+        ring = self.frame_ring
+        if ring is None:
+            return None, None
+        index = ring.acquire()
+        if index is None:
+            # Todos los slots retenidos por consumidores lentos: este frame va suelto
+            metrics.FRAME_RING_EXHAUSTED.inc(self.camera_id, "captura")
+            return None, None
+        return index, ring.view(index)
+
+    def _publish_frame(self, frame, index: Optional[int]):
+        """
+        Publica un frame capturado como el último
+
+        Args:
+            frame: Frame capturado
+            index: Slot del anillo en el que se escribió (None = frame suelto)
+        """
+        ring = self.frame_ring
+        if index is not None and not np.shares_memory(frame, ring.view(index)):
+            # La captura no usó el buffer (cambió la resolución)
+            ring.release(index)
+            index = None
+        # (un frame suelto con el anillo lleno no llega a los lectores de otros procesos)
+        if index is None and (ring is None or not ring.fits(frame)):
+            # Primer frame o resolución nueva: anillo con la forma actual para los siguientes
+            self._replace_ring(frame)
+
+        slot = None
+        if index is not None:
+            ring.publish(index)
+            slot = (ring, index)
+        with self._cond:
+            previous = self._frame_slot
+            self.seq += 1
+            self.frame = frame
+            self._frame_slot = slot
+            self._cond.notify_all()
+        if previous is not None:
+            previous[0].release(previous[1])
+
+    def _replace_ring(self, frame):
+        old = self.frame_ring
+        name = None
+        if self.shared_frames:
+            name = f"eppv{os.getpid()}c{self.camera_id}g{next(_shm_ring_ids)}f"
+        self.frame_ring = FrameRing(frame.shape, frame.dtype, shm_name=name)
+        if old is not None:
+            old.close()
+
+    def _capture_loop(self):
+        try:
+            while self.running:
+                start = time.perf_counter()
+                # Decodificar directamente en un slot libre del anillo
+                index, buffer = self._acquire_buffer()
+                success, frame = self.capture.read(buffer) if buffer is not None else self.capture.read()
+                if not success:
+                    if index is not None:
+                        self.frame_ring.release(index)
+                    # Fuentes con reconexión (CameraSource): reintentar mientras haya clientes
+                    reconnect = getattr(self.capture, 'reconnect', None)
+                    if reconnect is not None and reconnect(should_stop=lambda: not self.running or self._idle_expired()):
+                        continue
+                    logger.error("No se pudo leer frame de camera_id=%s", self.camera_id,
+                                 extra={'camera_id': self.camera_id, 'rate_key': self.camera_id})
+                    break
+                metrics.observe_stage("capture", self.camera_id, time.perf_counter() - start)
+                metrics.FRAMES_CAPTURED.inc(self.camera_id)
+
+                self._publish_frame(frame, index)
+
+                if self._idle_expired():
+                    logger.info("Sin clientes para camera_id=%s, liberando cámara", self.camera_id,
+                                extra={'camera_id': self.camera_id})
+                    break
+        finally:
+            self.stop()
+            self._on_stop(self)
+            if self.frame_ring is not None:
+                self.frame_ring.close()
+
+    def _detect_loop(self):
+        from backend.core.compliance_rules import rules_engine
+        from backend.core.inference_scheduler import inference_scheduler
+        last_seq = 0
+        throttled = False
+        pool = None
+
+        try:
+            while True:
+                with self._cond:
+                    if self.detect_subscribers == 0:
+                        # Sin clientes de detección: la cámara sale del reparto de inferencias
+                        inference_scheduler.release(self.camera_id)
+                    self._cond.wait_for(
+                        lambda: not self.running or (self.detect_subscribers > 0 and self.seq > last_seq))
+                    if not self.running:
+                        return
+
+                if pool is None:
+                    pool = _load_pool()
+                    if pool is None:
+                        # Sin modelo: el stream sigue sin detección
+                        return
+                    inference_scheduler.ensure_budget(pool)
+
+                # Reglas vigentes de la cámara (se recargan en segundo plano, sin reiniciar el stream)
+                rules = rules_engine.for_camera(self.camera_id)
+                delay = inference_scheduler.reserve(self.camera_id, rules)
+                if delay > 0:
+                    # Tasa asignada agotada: esperar el próximo token y analizar el frame más nuevo
+                    throttled = True
+                    with self._cond:
+                        self._cond.wait_for(lambda: not self.running, delay)
+                    continue
+
+                with self._cond:
+                    # El slot queda retenido mientras se detecta sobre él
+                    lease = self._lease_latest()
+                seq, frame = lease.seq, lease.frame
+                if last_seq and seq - last_seq > 1:
+                    # Frames que el detector no alcanzó a analizar o que el planificador saltó a propósito
+                    reason = "planificador" if throttled else "deteccion"
+                    metrics.FRAMES_DROPPED.inc(self.camera_id, reason, amount=seq - last_seq - 1)
+                last_seq = seq
+                throttled = False
+
+                with lease:
+                    try:
+                        with pool.acquire() as detector:
+                            detections = rules.filter_detections(detector.detect(frame))
+                            compliance = self._smooth_compliance(
+                                rules, detector.classify_compliance(detections, rules.required))
+                            metrics.observe_model_speed(self.camera_id, detector.last_speed)
+                    except Exception as e:
+                        get_logger("detector").error("Error en detección EPP (camera_id=%s): %s", self.camera_id, e,
+                                                     extra={'camera_id': self.camera_id, 'rate_key': self.camera_id})
+                        continue
+                    self.detected_seq = seq
+                    metrics.FRAMES_DETECTED.inc(self.camera_id)
+
+                    self._publish_result(seq, frame, detections, compliance)
+                    self._check_alert(pool, frame, detections, compliance, rules)
+        finally:
+            inference_scheduler.release(self.camera_id)
+
+    def _smooth_compliance(self, rules, compliance: Dict) -> Dict:
+        """Cumplimiento filtrado en el tiempo: un EPP que parpadea un frame no cambia el estado"""
+        if self._compliance_filter is None or self._compliance_filter.epp_types != list(rules.required):
+            # Primer frame o cambió el EPP obligatorio de la cámara
+            from backend.core.compliance_filter import ComplianceFilter
+            self._compliance_filter = ComplianceFilter(rules.required)
+        smoothed = self._compliance_filter.update(compliance)
+        if compliance['estado'] in ('I', 'N') and smoothed['estado'] not in ('I', 'N'):
+            metrics.COMPLIANCE_FLICKER.inc(self.camera_id)
+        return smoothed
+
+    def _publish_result(self, seq: int, frame, detections, compliance):
+        """Publica la detección y su versión compacta en JSON para los clientes"""
+        height, width = frame.shape[:2]
+        payload = {
+            'seq': seq,
+            'ts': int(time.time() * 1000),
+            'w': width,
+            'h': height,
+            # [x1, y1, x2, y2, confianza, tipo_epp, lleva_epp]
+            'det': [
+                [*det['bbox'], round(det['confidence'], 2), det['epp_type'], 1 if det['has_epp'] else 0]
+                for det in detections
+            ],
+            'estado': compliance['estado'],
+            'score': round(compliance['score']),
+            'mensaje': compliance['mensaje'],
+            'epp': {epp: 1 if present else 0 for epp, present in compliance['epp_status'].items()}
+        }
+        result_json = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+        with self._cond:
+            self.result = {'seq': seq, 'detections': detections, 'compliance': compliance}
+            self.result_json = result_json
+            self.result_version += 1
+            self._cond.notify_all()
+
+    def _check_alert(self, pool, frame, detections, compliance, rules):
+        """Guarda detección y genera alerta si hay incumplimiento (con límite de frecuencia)"""
+        current_time = time.time()
+        if current_time - self._last_alert_check < ALERT_CHECK_INTERVAL:
+            return
+        self._last_alert_check = current_time
+
+        # Una muestra por intervalo para los resúmenes de cumplimiento
+        from backend.core.compliance_rollup import compliance_rollup
+        compliance_rollup.record_sample(self.camera_id, compliance)
+
+        if compliance['estado'] not in ('I', 'N') or not rules.alerts_enabled:
+            return
+
+        # Una ocurrencia cada ALERT_MIN_INTERVAL como máximo; AlertManager las agrupa en incidentes
+        if current_time - self._last_alert_time <= ALERT_MIN_INTERVAL:
+            return
+        self._last_alert_time = current_time
+
+        def snapshot():
+            with metrics.stage_timer("draw", self.camera_id):
+                return pool.reference.draw_detections(frame, detections, compliance)
+
+        try:
+            from backend.core.alert_manager import alert_manager
+
+            # El snapshot anotado solo se dibuja si se abre un incidente nuevo
+            alert_manager.report_violation(self.camera_id, detections, compliance, snapshot=snapshot)
+        except Exception as e:
+            get_logger("alerts").error("Error guardando detección/alerta (camera_id=%s): %s", self.camera_id, e,
+                                       extra={'camera_id': self.camera_id, 'rate_key': self.camera_id})
+
+
+class _Opening:
+    """Apertura en curso de una cámara: los suscriptores concurrentes esperan done"""
+    __slots__ = ('done', 'stream')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.stream: Optional[CameraStream] = None
+
+
+class StreamHub:
+    # Clase de stream que crea subscribe() (el hub de workers usa streams remotos)
+    stream_class = CameraStream
+
+    def __init__(self, open_capture: Callable[[int], object], release_capture: Callable[[int], None],
+                 shared_frames: bool = False):
+        """
+        Registro de streams activos por cámara
+
+        Args:
+            open_capture: Abre la captura de una cámara configurada (None si falla)
+            release_capture: Libera la captura de una cámara
+            shared_frames: Anillos de frames en memoria compartida (procesos worker)
+        """
+        self.shared_frames = shared_frames
+        self._open_capture = open_capture
+        self._release_capture = release_capture
+        self._streams: Dict[int, CameraStream] = {}
+        # Cámaras que se están abriendo (fuera del lock)
+        self._opening: Dict[int, _Opening] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, camera_id: int, detect: bool = False) -> Optional[CameraStream]:
+        """Se suscribe al stream de una cámara, abriéndola si no está activa"""
+        while True:
+            opening = None
+            with self._lock:
+                stream = self._streams.get(camera_id)
+                if stream is None:
+                    opening = self._opening.get(camera_id)
+                    if opening is None:
+                        # Este hilo abre la cámara; los demás suscriptores esperan su resultado
+                        self._opening[camera_id] = _Opening()
+                        break
+                elif stream.running:
+                    stream.add_subscriber(detect)
+                    return stream
+
+            if opening is not None:
+                opening.done.wait()
+                if opening.stream is None:
+                    return None
+                continue
+
+            # El stream anterior se está cerrando: esperar a que libere la cámara
+            stream.join(timeout=2.0)
+            with self._lock:
+                if self._streams.get(camera_id) is stream:
+                    del self._streams[camera_id]
+
+        # Abrir fuera del lock: RTSP o un worker pueden tardar segundos y no deben
+        # bloquear a las demás cámaras ni a _on_stream_stop
+        stream = None
+        try:
+            capture = self._open_capture(camera_id)
+            if capture is not None:
+                stream = self.stream_class(camera_id, capture, on_stop=self._on_stream_stop,
+                                           shared_frames=self.shared_frames)
+        finally:
+            with self._lock:
+                opening = self._opening.pop(camera_id)
+                if stream is not None:
+                    self._streams[camera_id] = stream
+                    stream.start()
+                    if stream.running:
+                        stream.add_subscriber(detect)
+                    else:
+                        stream = None
+                opening.stream = stream
+            opening.done.set()
+        return stream
+
+    def unsubscribe(self, stream: CameraStream, detect: bool = False):
+        stream.remove_subscriber(detect)
+
+    def stop(self, camera_id: int, wait: float = 2.0):
+        """Detiene el stream de una cámara (y libera la captura)"""
+        with self._lock:
+            stream = self._streams.get(camera_id)
+        if stream is not None:
+            stream.stop(wait=wait)
+
+    def stop_all(self, wait: float = 2.0):
+        with self._lock:
+            streams = list(self._streams.values())
+        for stream in streams:
+            stream.stop(wait=wait)
+
+    def get_stream(self, camera_id: int) -> Optional[CameraStream]:
+        return self._streams.get(camera_id)
+
+    def collect_metrics(self):
+        """Gauges de streams activos, clientes y atraso de detección (colector de /metrics)"""
+        with self._lock:
+            streams = list(self._streams.values())
+        metrics.STREAM_SUBSCRIBERS.clear()
+        metrics.DETECTION_LAG.clear()
+        metrics.STREAMS_ACTIVE.set(len(streams))
+        for stream in streams:
+            metrics.STREAM_SUBSCRIBERS.set(stream.subscribers - stream.detect_subscribers, stream.camera_id, "video")
+            metrics.STREAM_SUBSCRIBERS.set(stream.detect_subscribers, stream.camera_id, "deteccion")
+            if stream.detect_subscribers:
+                metrics.DETECTION_LAG.set(max(0, stream.seq - stream.detected_seq), stream.camera_id)
+
+    def _on_stream_stop(self, stream: CameraStream):
+        with self._lock:
+            if self._streams.get(stream.camera_id) is stream:
+                del self._streams[stream.camera_id]
+        self._release_capture(stream.camera_id)
+
+
+def _load_pool():
+    """Carga el pool de detectores global (None si el modelo no está disponible)"""
+    try:
+        from backend.core.detector_pool import get_detector_pool
+        return get_detector_pool()
+    except Exception as e:
+        get_logger("detector").exception("No se pudo cargar modelo EPP: %s", e)
+        return None
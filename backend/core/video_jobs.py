@@ -0,0 +1,323 @@
+"""
+Registro persistente de videos subidos (trabajos de procesamiento)
+Reemplaza el diccionario en memoria: el estado y el progreso viven en la base de datos,
+así varios workers detrás de un balanceador ven los mismos videos, las estadísticas
+sobreviven a reinicios y los archivos temporales vencidos se borran solos
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from sqlalchemy import update, delete
+from sqlalchemy.orm import sessionmaker, Session
+from dotenv import load_dotenv
+from backend.core.database import SessionLocal, engine, create_db_engine, TrabajoVideo
+
+from backend.core.logging_config import get_logger
+load_dotenv()
+
+logger = get_logger("video")
+
+# Base de datos propia opcional (p.ej. sqlite:///backend/data/video_jobs.db en un solo nodo)
+VIDEO_JOBS_DATABASE_URL = os.getenv("VIDEO_JOBS_DATABASE_URL", "")
+VIDEO_JOB_TTL_HOURS = float(os.getenv("VIDEO_JOB_TTL_HOURS", "24"))
+VIDEO_JOB_GC_INTERVAL = float(os.getenv("VIDEO_JOB_GC_INTERVAL", "300"))
+
+# Frames entre escrituras de progreso a la base de datos
+PROGRESS_FLUSH_FRAMES = 30
+
+ESTADOS = ('en_cola', 'procesando', 'completado', 'fallido')
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class VideoJobRegistry:
+    def __init__(self, temp_dir: Path, database_url: str = VIDEO_JOBS_DATABASE_URL,
+                 ttl_hours: float = VIDEO_JOB_TTL_HOURS):
+        """
+        Registro de trabajos de video
+
+        Args:
+            temp_dir: Directorio de videos temporales (para borrar huérfanos)
+            database_url: URL de base de datos propia (vacío = la base de datos principal)
+            ttl_hours: Horas sin actividad antes de borrar un video y su registro
+        """
+        self.temp_dir = Path(temp_dir)
+        self.ttl = timedelta(hours=ttl_hours)
+
+        if database_url:
+            self.engine = create_db_engine(database_url)
+            self._session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        else:
+            self.engine = engine
+            self._session_factory = SessionLocal
+
+        self._table_ready = False
+        self._table_lock = threading.Lock()
+        self._gc_thread: Optional[threading.Thread] = None
+        self._gc_stop = threading.Event()
+
+    def _get_db(self) -> Session:
+        """Sesión de base de datos (crea la tabla la primera vez)"""
+        if not self._table_ready:
+            with self._table_lock:
+                if not self._table_ready:
+                    TrabajoVideo.__table__.create(bind=self.engine, checkfirst=True)
+                    self._table_ready = True
+        return self._session_factory()
+
+    def _expires_at(self) -> datetime:
+        return datetime.now() + self.ttl
+
+    @staticmethod
+    def _to_dict(job: TrabajoVideo) -> Dict:
+        return {
+            'video_id': job.id,
+            'filename': job.nombre_archivo,
+            'path': job.ruta,
+            'content_hash': job.content_hash,
+            'estado': job.estado,
+            'upload_complete': bool(job.subida_completa),
+            'error': job.error,
+            'worker': job.worker,
+            'total_frames': job.total_frames or 0,
+            'fps': job.fps or 0,
+            'duration': job.duracion or 0,
+            'width': job.ancho,
+            'height': job.alto,
+            'cache_hit': bool(job.cache_hit),
+            'stats': {
+                'frames_procesados': job.frames_procesados,
+                'detecciones_totales': job.detecciones_totales,
+                'personas_detectadas': job.personas_detectadas,
+                'epp_incorrecto': job.epp_incorrecto
+            },
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'expires_at': job.expires_at.isoformat() if job.expires_at else None
+        }
+
+    def register(self, video_id: str, path: str, filename: str, metadata: Dict,
+                 upload_complete: bool = True, content_hash: str = None) -> Dict:
+        """
+        Registra un video (o actualiza sus metadatos si ya existe, p.ej. al completar la subida)
+
+        Returns:
+            Información del trabajo
+        """
+        db = self._get_db()
+        try:
+            job = db.get(TrabajoVideo, video_id)
+            if job is None:
+                job = TrabajoVideo(id=video_id, ruta=path, nombre_archivo=filename, estado='en_cola')
+                db.add(job)
+            job.total_frames = metadata['total_frames']
+            job.fps = metadata['fps']
+            job.duracion = metadata['duration']
+            job.ancho = metadata['width']
+            job.alto = metadata['height']
+            job.subida_completa = 1 if upload_complete else 0
+            if content_hash:
+                job.content_hash = content_hash
+            job.expires_at = self._expires_at()
+            db.commit()
+            return self._to_dict(job)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def get(self, video_id: str) -> Optional[Dict]:
+        """Información del trabajo (None si no existe)"""
+        db = self._get_db()
+        try:
+            job = db.get(TrabajoVideo, video_id)
+            return self._to_dict(job) if job is not None else None
+        finally:
+            db.close()
+
+    def _update(self, video_id: str, **values) -> bool:
+        """UPDATE de una fila; True si existía"""
+        db = self._get_db()
+        try:
+            result = db.execute(update(TrabajoVideo).where(TrabajoVideo.id == video_id).values(**values))
+            db.commit()
+            return result.rowcount > 0
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def start_run(self, video_id: str, cache_hit: bool = False) -> bool:
+        """Marca el trabajo como en proceso y reinicia sus contadores"""
+        return self._update(
+            video_id, estado='procesando', worker=WORKER_ID, error=None, cache_hit=1 if cache_hit else 0,
+            frames_procesados=0, detecciones_totales=0, personas_detectadas=0, epp_incorrecto=0,
+            expires_at=self._expires_at()
+        )
+
+    def add_progress(self, video_id: str, frames: int, detecciones: int, epp_incorrecto: int,
+                     personas_detectadas: int):
+        """
+        Suma progreso de forma atómica (UPDATE col = col + n)
+
+        Args:
+            frames: Frames procesados desde la última escritura
+            detecciones: Detecciones desde la última escritura
+            epp_incorrecto: Frames con EPP incorrecto desde la última escritura
+            personas_detectadas: Personas en el último frame
+        """
+        self._update(
+            video_id,
+            frames_procesados=TrabajoVideo.frames_procesados + frames,
+            detecciones_totales=TrabajoVideo.detecciones_totales + detecciones,
+            epp_incorrecto=TrabajoVideo.epp_incorrecto + epp_incorrecto,
+            personas_detectadas=personas_detectadas,
+            expires_at=self._expires_at()
+        )
+
+    def finish_run(self, video_id: str, completed: bool, error: str = None):
+        """
+        Cierra la ejecución: completado, fallido (con error) o de vuelta en cola si se interrumpió
+        """
+        if error:
+            estado = 'fallido'
+        else:
+            estado = 'completado' if completed else 'en_cola'
+        self._update(video_id, estado=estado, error=error, worker=None, expires_at=self._expires_at())
+
+    def delete(self, video_id: str) -> Optional[Dict]:
+        """
+        Borra el registro y su archivo temporal
+
+        Returns:
+            Información del trabajo borrado (None si no existía o ya lo borró otro worker)
+        """
+        job = self.get(video_id)
+        if job is None:
+            return None
+        db = self._get_db()
+        try:
+            result = db.execute(delete(TrabajoVideo).where(TrabajoVideo.id == video_id))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        if result.rowcount == 0:
+            return None
+        self._remove_file(Path(job['path']))
+        return job
+
+    @staticmethod
+    def _remove_file(path: Path):
+        try:
+            if path.exists():
+                path.unlink()
+                logger.info("Archivo eliminado: %s", path)
+        except OSError as e:
+            logger.error("No se pudo borrar %s: %s", path, e)
+
+    def collect_expired(self, on_expire: Callable[[str], None] = None) -> int:
+        """
+        Borra trabajos vencidos y archivos temporales huérfanos
+
+        Args:
+            on_expire: Callback por cada video borrado (p.ej. cerrar sus sesiones HLS)
+
+        Returns:
+            Cantidad de videos borrados
+        """
+        now = datetime.now()
+        db = self._get_db()
+        try:
+            expired = [row.id for row in db.query(TrabajoVideo.id).filter(TrabajoVideo.expires_at < now)]
+            known = {row.ruta for row in db.query(TrabajoVideo.ruta)}
+        finally:
+            db.close()
+
+        removed = 0
+        for video_id in expired:
+            # Otro worker pudo borrarlo antes: delete() solo cuenta si esta fila se eliminó aquí
+            if self.delete(video_id) is not None:
+                removed += 1
+                if on_expire is not None:
+                    on_expire(video_id)
+
+        # Archivos sin registro (subidas abandonadas, registros perdidos) sin modificar en todo el TTL
+        cutoff = time.time() - self.ttl.total_seconds()
+        known_names = {Path(p).name for p in known}
+        for path in self.temp_dir.iterdir():
+            if path.is_file() and path.name not in known_names and path.stat().st_mtime < cutoff:
+                self._remove_file(path)
+                removed += 1
+
+        if removed:
+            logger.info("Limpieza: %s videos temporales vencidos eliminados", removed)
+        return removed
+
+    def start_gc(self, interval: float = VIDEO_JOB_GC_INTERVAL, on_expire: Callable[[str], None] = None):
+        """Inicia el hilo de limpieza periódica"""
+        if self._gc_thread is not None and self._gc_thread.is_alive():
+            return
+        self._gc_stop.clear()
+
+        def loop():
+            while not self._gc_stop.wait(interval):
+                try:
+                    self.collect_expired(on_expire)
+                except Exception as e:
+                    logger.error("Limpieza de videos temporales: %s", e)
+
+        self._gc_thread = threading.Thread(target=loop, name="limpieza-videos", daemon=True)
+        self._gc_thread.start()
+
+    def stop_gc(self):
+        self._gc_stop.set()
+
+
+class JobProgress:
+    def __init__(self, registry: VideoJobRegistry, video_id: str, flush_every: int = PROGRESS_FLUSH_FRAMES):
+        """
+        Acumula el progreso de una ejecución y lo escribe en lotes
+
+        Args:
+            registry: Registro de trabajos
+            video_id: Video en proceso
+            flush_every: Frames entre escrituras
+        """
+        self.registry = registry
+        self.video_id = video_id
+        self.flush_every = flush_every
+        self.frames = 0
+        self.detecciones = 0
+        self.epp_incorrecto = 0
+        self.personas_detectadas = 0
+
+    def add(self, detecciones: int, incorrecto: bool):
+        """Registra un frame procesado"""
+        self.frames += 1
+        self.detecciones += detecciones
+        self.personas_detectadas = detecciones
+        if incorrecto:
+            self.epp_incorrecto += 1
+        if self.frames >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.frames == 0:
+            return
+        try:
+            self.registry.add_progress(self.video_id, self.frames, self.detecciones,
+                                       self.epp_incorrecto, self.personas_detectadas)
+        except Exception as e:
+            logger.error("No se pudo guardar progreso de %s: %s", self.video_id, e)
+            return
+        self.frames = 0
+        self.detecciones = 0
+        self.epp_incorrecto = 0
@@ -0,0 +1,110 @@
+// Overlay de detecciones dibujado en el navegador (modo overlay=client)
+// El servidor envía el video sin anotar y las detecciones por SSE en /api/stream/{id}/detections
+
+const EPPOverlay = (() => {
+    const COLOR_CORRECTO = '#00FF00';
+    const COLOR_INCORRECTO = '#FF0000';
+    const COLOR_ADVERTENCIA = '#FFA500';
+    const COLOR_SIN_PERSONA = '#B4B4B4';
+
+    // cameraId -> { source: EventSource, canvases: Set<HTMLCanvasElement>, last: payload }
+    const canales = new Map();
+
+    function colorPanel(estado) {
+        if (estado === 'P') return COLOR_SIN_PERSONA;
+        if (estado === 'C') return COLOR_CORRECTO;
+        if (estado === 'I') return COLOR_ADVERTENCIA;
+        return COLOR_INCORRECTO;
+    }
+
+    function dibujar(canvas, data) {
+        if (canvas.width !== data.w || canvas.height !== data.h) {
+            canvas.width = data.w;
+            canvas.height = data.h;
+        }
+        const ctx = canvas.getContext('2d');
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.font = '14px sans-serif';
+        ctx.textBaseline = 'bottom';
+
+        // Bounding boxes: [x1, y1, x2, y2, confianza, tipo_epp, lleva_epp]
+        for (const [x1, y1, x2, y2, conf, tipo, lleva] of data.det) {
+            const color = lleva ? COLOR_CORRECTO : COLOR_INCORRECTO;
+            ctx.strokeStyle = color;
+            ctx.lineWidth = 2;
+            ctx.strokeRect(x1, y1, x2 - x1, y2 - y1);
+
+            const etiqueta = `${tipo} ${conf.toFixed(2)}`;
+            const ancho = ctx.measureText(etiqueta).width;
+            ctx.fillStyle = color;
+            ctx.fillRect(x1, y1 - 20, ancho + 4, 20);
+            ctx.fillStyle = '#FFFFFF';
+            ctx.fillText(etiqueta, x1 + 2, y1 - 4);
+        }
+
+        // Panel de estado
+        ctx.fillStyle = 'rgba(0, 0, 0, 0.7)';
+        ctx.fillRect(10, 10, 240, 110);
+        ctx.fillStyle = colorPanel(data.estado);
+        ctx.font = 'bold 18px sans-serif';
+        ctx.fillText(`Estado: ${data.estado}`, 20, 38);
+        ctx.fillStyle = '#FFFFFF';
+        ctx.font = '14px sans-serif';
+        ctx.fillText(`Score: ${data.score}%`, 20, 62);
+        ctx.font = '12px sans-serif';
+        ctx.fillText(data.mensaje, 20, 84);
+
+        let y = 104;
+        for (const [epp, presente] of Object.entries(data.epp)) {
+            if (y >= 120) break;
+            ctx.fillStyle = presente ? COLOR_CORRECTO : COLOR_INCORRECTO;
+            ctx.fillText(`${presente ? '[X]' : '[ ]'} ${epp.charAt(0).toUpperCase() + epp.slice(1)}`, 20, y);
+            y += 20;
+        }
+    }
+
+    function limpiarDesconectados(cameraId) {
+        const canal = canales.get(cameraId);
+        if (!canal) return;
+        for (const canvas of canal.canvases) {
+            if (!canvas.isConnected) canal.canvases.delete(canvas);
+        }
+        if (canal.canvases.size === 0) {
+            canal.source.close();
+            canales.delete(cameraId);
+        }
+    }
+
+    function conectar(cameraId) {
+        const source = new EventSource(`/api/stream/${cameraId}/detections`);
+        const canal = { source, canvases: new Set(), last: null };
+
+        source.onmessage = (event) => {
+            canal.last = JSON.parse(event.data);
+            limpiarDesconectados(cameraId);
+            for (const canvas of canal.canvases) dibujar(canvas, canal.last);
+        };
+        source.onerror = () => console.warn(`Overlay: reconectando detecciones de cámara ${cameraId}`);
+
+        canales.set(cameraId, canal);
+        return canal;
+    }
+
+    return {
+        // Asocia un canvas (superpuesto al <img> del stream) a las detecciones de una cámara
+        bind(canvas, cameraId) {
+            const canal = canales.get(cameraId) || conectar(cameraId);
+            canal.canvases.add(canvas);
+            if (canal.last) dibujar(canvas, canal.last);
+        },
+        // Desasocia un canvas y cierra el canal si ya no quedan canvases
+        unbind(canvas, cameraId) {
+            const canal = canales.get(cameraId);
+            if (!canal) return;
+            canal.canvases.delete(canvas);
+            const ctx = canvas.getContext('2d');
+            ctx.clearRect(0, 0, canvas.width, canvas.height);
+            limpiarDesconectados(cameraId);
+        }
+    };
+})();
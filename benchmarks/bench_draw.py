@@ -0,0 +1,111 @@
+"""
+Micro-benchmark de EPPDetector.draw_detections
+Compara el dibujado anterior (2 copias completas + addWeighted de todo el frame)
+con el camino rápido (blend solo del panel, tamaños de texto cacheados, in_place)
+
+Ejecutar: python -m benchmarks.bench_draw [--iterations 300]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.core.epp_detector import EPPDetector
+
+RESOLUTIONS = {
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+}
+
+
+def draw_detections_legacy(frame, detections, compliance):
+    """Implementación original (referencia para comparar)"""
+    frame_annotated = frame.copy()
+    for det in detections:
+        x1, y1, x2, y2 = det['bbox']
+        color = (0, 255, 0) if det['has_epp'] else (0, 0, 255)
+        cv2.rectangle(frame_annotated, (x1, y1), (x2, y2), color, 2)
+        label = f"{det['epp_type']} {det['confidence']:.2f}"
+        label_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        cv2.rectangle(frame_annotated, (x1, y1 - label_size[1] - 10), (x1 + label_size[0], y1), color, -1)
+        cv2.putText(frame_annotated, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+    overlay = frame_annotated.copy()
+    cv2.rectangle(overlay, (10, 10), (250, 120), (0, 0, 0), -1)
+    cv2.addWeighted(overlay, 0.7, frame_annotated, 0.3, 0, frame_annotated)
+    cv2.putText(frame_annotated, f"Estado: {compliance['estado']}", (20, 35), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 165, 255), 2)
+    cv2.putText(frame_annotated, f"Score: {compliance['score']:.0f}%", (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    cv2.putText(frame_annotated, compliance['mensaje'], (20, 85), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+    y_offset = 105
+    for epp, present in compliance['epp_status'].items():
+        if y_offset < 120:
+            cv2.putText(frame_annotated, f"{'[X]' if present else '[ ]'} {epp.capitalize()}",
+                        (20, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 255, 0), 1)
+            y_offset += 20
+    return frame_annotated
+
+
+def make_sample(height: int, width: int, n_detections: int = 8):
+    """Genera un frame sintético con detecciones fijas"""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    tipos = ['casco', 'chaleco', 'guantes', 'botas', 'gafas']
+    detections = []
+    for i in range(n_detections):
+        x1 = int(rng.integers(0, width - 200))
+        y1 = int(rng.integers(40, height - 200))
+        detections.append({
+            'bbox': [x1, y1, x1 + 150, y1 + 150],
+            'confidence': 0.5 + (i % 5) / 10,
+            'class': tipos[i % 5],
+            'has_epp': i % 2 == 0,
+            'epp_type': tipos[i % 5]
+        })
+    compliance = {
+        'estado': 'I',
+        'score': 60.0,
+        'epp_status': {'casco': True, 'chaleco': True, 'guantes': False, 'botas': True, 'gafas': False},
+        'mensaje': 'Falta: guantes, gafas',
+        'person_detected': True
+    }
+    return frame, detections, compliance
+
+
+def time_call(fn, iterations: int) -> float:
+    """Tiempo medio por llamada en milisegundos"""
+    fn()  # calentamiento (llena cachés)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def run(iterations: int = 300) -> dict:
+    """Ejecuta el benchmark para cada resolución y devuelve ms/frame por variante"""
+    # draw_detections no usa el modelo: no hace falta cargar YOLO
+    detector = EPPDetector.__new__(EPPDetector)
+    results = {}
+    for name, (height, width) in RESOLUTIONS.items():
+        frame, detections, compliance = make_sample(height, width)
+        work = frame.copy()
+        results[name] = {
+            'legacy_ms': time_call(lambda: draw_detections_legacy(frame, detections, compliance), iterations),
+            'copy_ms': time_call(lambda: detector.draw_detections(frame, detections, compliance), iterations),
+            'in_place_ms': time_call(lambda: detector.draw_detections(work, detections, compliance, in_place=True), iterations),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de draw_detections")
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'Resolución':<10} {'Original':>10} {'Rápido':>10} {'In-place':>10} {'Ahorro':>10}")
+    for name, r in run(args.iterations).items():
+        saving = r['legacy_ms'] - r['in_place_ms']
+        print(f"{name:<10} {r['legacy_ms']:>8.3f}ms {r['copy_ms']:>8.3f}ms {r['in_place_ms']:>8.3f}ms {saving:>8.3f}ms")
@@ -0,0 +1,370 @@
+"""
+Benchmark reproducible del pipeline de detección
+Mide por etapa (espera del pool, preprocess, inference, postprocess, clasificación,
+dibujado, JPEG y opcionalmente escritura en BD) con 1, 4 y 6 cámaras concurrentes
+compartiendo el pool de detectores, y reporta percentiles, FPS y picos de memoria en JSON
+
+Ejecutar:
+    python -m benchmarks.bench_pipeline                              # stub + frames sintéticos (CI)
+    python -m benchmarks.bench_pipeline --clip obra.mp4 --model models/best.pt
+    python -m benchmarks.bench_pipeline --output benchmarks/base.json
+    python -m benchmarks.bench_pipeline --compare benchmarks/base.json --tolerance 0.15
+    DATABASE_URL=sqlite:///backend/data/bench.db python -m benchmarks.bench_pipeline --db-camera-id 1   # BD sin servidor
+
+Con --compare el proceso termina con código 1 si hay regresiones respecto a la base
+(solo tiene sentido comparar corridas con el mismo modelo, fuente y máquina)
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.core.detector_pool import EPPDetectorPool
+from backend.core.jpeg_encoder import encode_jpeg
+from benchmarks.stub_model import StubYOLO
+
+RESOLUTIONS = {
+    '480p': (480, 854),
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+}
+
+STAGES = ['pool_wait', 'preprocess', 'inference', 'postprocess', 'classify', 'draw', 'encode', 'db_write', 'total']
+
+# Diferencia mínima (ms) para considerar regresión una etapa: evita ruido en etapas de microsegundos
+MIN_REGRESSION_MS = 0.2
+
+
+# ============= FRAMES DE ENTRADA =============
+
+def synthetic_frames(count: int, height: int, width: int, seed: int = 0) -> List[np.ndarray]:
+    """Frames sintéticos deterministas: fondo con ruido y 'trabajadores' que se desplazan"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(20, 90, size=(height, width, 3), dtype=np.uint8)
+    workers = [
+        (int(rng.integers(0, width - 160)), int(rng.integers(0, height - 320)), int(rng.integers(-6, 7)))
+        for _ in range(6)
+    ]
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        for n, (x, y, dx) in enumerate(workers):
+            x = (x + dx * i) % (width - 160)
+            cv2.rectangle(frame, (x, y), (x + 120, y + 300), (200, 200, 200), -1)
+            cv2.rectangle(frame, (x + 20, y), (x + 100, y + 50), (0, 220, 255) if n % 2 else (60, 60, 60), -1)
+            cv2.rectangle(frame, (x, y + 80), (x + 120, y + 180), (0, 140, 255) if n % 3 else (90, 90, 90), -1)
+        frames.append(frame)
+    return frames
+
+
+def clip_frames(path: str, count: int, height: int, width: int) -> List[np.ndarray]:
+    """Primeros frames de un video grabado (decodificados a memoria, redimensionados)"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"No se pudo abrir el video: {path}")
+    frames = []
+    try:
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame.shape[:2] != (height, width):
+                frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            frames.append(frame)
+    finally:
+        cap.release()
+    if not frames:
+        raise SystemExit(f"El video no tiene frames legibles: {path}")
+    return frames
+
+
+# ============= EJECUCIÓN =============
+
+def build_pool(model: str, pool_size: Optional[int], stub_passes: int) -> EPPDetectorPool:
+    """Pool real de detectores: con el stub (model='stub') o con un modelo YOLO"""
+    if model == 'stub':
+        return EPPDetectorPool(size=pool_size, model_factory=lambda: StubYOLO(passes=stub_passes))
+    return EPPDetectorPool(model_path=model, size=pool_size)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    data = np.asarray(values)
+    return {
+        'p50': round(float(np.percentile(data, 50)), 3),
+        'p95': round(float(np.percentile(data, 95)), 3),
+        'p99': round(float(np.percentile(data, 99)), 3),
+        'mean': round(float(data.mean()), 3),
+        'max': round(float(data.max()), 3),
+    }
+
+
+def run_level(pool: EPPDetectorPool, frames: List[np.ndarray], cameras: int, frames_per_camera: int,
+              warmup: int, width: int, quality: int, db_camera_id: Optional[int] = None) -> Dict:
+    """
+    Ejecuta el pipeline con N cámaras concurrentes (un hilo por cámara, lo más rápido posible)
+
+    Args:
+        pool: Pool de detectores compartido
+        frames: Frames de entrada (solo lectura, compartidos)
+        cameras: Número de cámaras concurrentes
+        frames_per_camera: Frames medidos por cámara
+        warmup: Frames iniciales por cámara que no se miden
+        width: Ancho del JPEG de salida
+        quality: Calidad JPEG
+        db_camera_id: Si se indica, guarda las detecciones con incumplimiento (AlertManager)
+
+    Returns:
+        Percentiles por etapa (ms), FPS y pico de memoria de Python
+    """
+    alert_manager = None
+    if db_camera_id is not None:
+        from backend.core.alert_manager import alert_manager
+
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    samples_lock = threading.Lock()
+    barrier = threading.Barrier(cameras)
+    measured_at = [0.0] * cameras
+    errors = []
+
+    def camera_loop(camera: int):
+        try:
+            measure_camera(camera)
+        except Exception as e:
+            errors.append(f"cámara {camera}: {e!r}")
+            barrier.abort()
+
+    def measure_camera(camera: int):
+        local = {stage: [] for stage in STAGES}
+        barrier.wait()
+        for i in range(warmup + frames_per_camera):
+            if i == warmup:
+                measured_at[camera] = time.perf_counter()
+            # Cada cámara recorre los frames desde un desfase distinto
+            frame = frames[(camera * 37 + i) % len(frames)]
+
+            t0 = time.perf_counter()
+            with pool.acquire() as detector:
+                t1 = time.perf_counter()
+                detections = detector.detect(frame)
+                speed = detector.last_speed
+                t2 = time.perf_counter()
+                compliance = detector.classify_compliance(detections)
+                t3 = time.perf_counter()
+            annotated = pool.reference.draw_detections(frame, detections, compliance)
+            t4 = time.perf_counter()
+            encode_jpeg(annotated, width, quality)
+            t5 = time.perf_counter()
+            db_ms = None
+            if alert_manager is not None and compliance['estado'] in ('I', 'N'):
+                alert_manager.save_detection(db_camera_id, detections, compliance)
+                db_ms = (time.perf_counter() - t5) * 1000
+            end = time.perf_counter()
+
+            if i < warmup:
+                continue
+            local['pool_wait'].append((t1 - t0) * 1000)
+            for stage in ('preprocess', 'inference', 'postprocess'):
+                if stage in speed:
+                    local[stage].append(speed[stage])
+            if not speed:
+                local['inference'].append((t2 - t1) * 1000)
+            local['classify'].append((t3 - t2) * 1000)
+            local['draw'].append((t4 - t3) * 1000)
+            local['encode'].append((t5 - t4) * 1000)
+            if db_ms is not None:
+                local['db_write'].append(db_ms)
+            local['total'].append((end - t0) * 1000)
+
+        with samples_lock:
+            for stage, values in local.items():
+                samples[stage].extend(values)
+
+    tracemalloc.reset_peak()
+    threads = [threading.Thread(target=camera_loop, args=(n,), name=f"bench-cam{n}") for n in range(cameras)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    finished = time.perf_counter()
+    if errors:
+        raise RuntimeError(f"Falló el pipeline: {errors[0]}")
+    _, traced_peak = tracemalloc.get_traced_memory()
+
+    # Tiempo medido: desde que la última cámara terminó el calentamiento
+    elapsed = finished - max(measured_at) if frames_per_camera else 0.0
+    total_frames = cameras * frames_per_camera
+    fps_total = total_frames / elapsed if elapsed > 0 else 0.0
+    return {
+        'cameras': cameras,
+        'frames': total_frames,
+        'elapsed_s': round(elapsed, 3),
+        'fps_total': round(fps_total, 2),
+        'fps_per_camera': round(fps_total / cameras, 2),
+        'stages_ms': {stage: percentiles(values) for stage, values in samples.items() if values},
+        'traced_peak_mb': round(traced_peak / 1024 / 1024, 2),
+    }
+
+
+def rss_peak_mb() -> Optional[float]:
+    """Pico de memoria residente del proceso (no disponible en Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB, macOS bytes
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def run(model: str = 'stub', clip: Optional[str] = None, cameras: List[int] = (1, 4, 6),
+        frames_per_camera: int = 120, warmup: int = 10, resolution: str = '720p', pool_size: Optional[int] = None,
+        width: int = 640, quality: int = 80, stub_passes: int = 2, seed: int = 0,
+        db_camera_id: Optional[int] = None) -> Dict:
+    """Ejecuta el benchmark completo y devuelve el reporte (serializable a JSON)"""
+    height, frame_width = RESOLUTIONS[resolution]
+    source_count = max(60, warmup + frames_per_camera)
+    if clip:
+        frames = clip_frames(clip, source_count, height, frame_width)
+    else:
+        frames = synthetic_frames(source_count, height, frame_width, seed=seed)
+
+    pool = build_pool(model, pool_size, stub_passes)
+    tracemalloc.start()
+    levels = {}
+    try:
+        for n in cameras:
+            print(f"[BENCH] {n} cámara(s) x {frames_per_camera} frames...")
+            levels[str(n)] = run_level(pool, frames, n, frames_per_camera, warmup, width, quality, db_camera_id)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'meta': {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'model': model,
+            'source': clip or f'synthetic(seed={seed})',
+            'resolution': resolution,
+            'pool_size': pool.size,
+            'threads_per_instance': pool.threads_per_instance,
+            'frames_per_camera': frames_per_camera,
+            'warmup': warmup,
+            'jpeg': {'width': width, 'quality': quality},
+            'stub_passes': stub_passes if model == 'stub' else None,
+            'db_write': db_camera_id is not None,
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'levels': levels,
+        'rss_peak_mb': rss_peak_mb(),
+    }
+
+
+# ============= COMPARACIÓN CON LA BASE =============
+
+def compare(report: Dict, baseline: Dict, tolerance: float = 0.10) -> List[str]:
+    """
+    Compara un reporte con una base guardada
+
+    Args:
+        report: Reporte actual (run())
+        baseline: Reporte guardado con --output
+        tolerance: Fracción de empeoramiento tolerada (0.10 = 10%)
+
+    Returns:
+        Lista de regresiones encontradas (vacía si no hay)
+    """
+    regressions = []
+    for key in ('model', 'source', 'resolution', 'pool_size', 'jpeg', 'stub_passes'):
+        if report['meta'].get(key) != baseline['meta'].get(key):
+            print(f"[BENCH WARNING] '{key}' distinto de la base: "
+                  f"{baseline['meta'].get(key)} -> {report['meta'].get(key)}")
+
+    for level, current in report['levels'].items():
+        base = baseline['levels'].get(level)
+        if base is None:
+            continue
+        if current['fps_total'] < base['fps_total'] * (1 - tolerance):
+            regressions.append(f"{level} cám.: fps {base['fps_total']} -> {current['fps_total']}")
+        for stage, stats in current['stages_ms'].items():
+            base_stats = base['stages_ms'].get(stage)
+            if not base_stats:
+                continue
+            for pct in ('p50', 'p95'):
+                before, after = base_stats[pct], stats[pct]
+                if after > before * (1 + tolerance) and after - before > MIN_REGRESSION_MS:
+                    regressions.append(f"{level} cám.: {stage} {pct} {before:.3f}ms -> {after:.3f}ms")
+        if current['traced_peak_mb'] > base['traced_peak_mb'] * (1 + tolerance) + 1:
+            regressions.append(f"{level} cám.: memoria {base['traced_peak_mb']}MB -> {current['traced_peak_mb']}MB")
+    return regressions
+
+
+def print_report(report: Dict):
+    meta = report['meta']
+    print(f"\nModelo: {meta['model']} | Fuente: {meta['source']} | {meta['resolution']} | "
+          f"Pool: {meta['pool_size']} x {meta['threads_per_instance']} hilo(s)")
+    for level, result in report['levels'].items():
+        print(f"\n{level} cámara(s): {result['fps_total']:.1f} fps totales, "
+              f"{result['fps_per_camera']:.1f} fps/cámara, pico Python {result['traced_peak_mb']} MB")
+        print(f"  {'Etapa':<12} {'p50':>9} {'p95':>9} {'p99':>9} {'máx':>9}")
+        for stage, stats in result['stages_ms'].items():
+            print(f"  {stage:<12} {stats['p50']:>7.2f}ms {stats['p95']:>7.2f}ms "
+                  f"{stats['p99']:>7.2f}ms {stats['max']:>7.2f}ms")
+    if report['rss_peak_mb'] is not None:
+        print(f"\nPico de memoria residente: {report['rss_peak_mb']} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de detección EPP")
+    parser.add_argument("--model", default="stub", help="'stub' (sin torch) o ruta a un modelo YOLO (models/best.pt)")
+    parser.add_argument("--clip", help="Video grabado como fuente (por defecto, frames sintéticos)")
+    parser.add_argument("--cameras", default="1,4,6", help="Niveles de cámaras concurrentes")
+    parser.add_argument("--frames", type=int, default=120, help="Frames medidos por cámara")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--resolution", choices=RESOLUTIONS, default="720p")
+    parser.add_argument("--pool-size", type=int, help="Instancias del pool (por defecto EPP_POOL_SIZE)")
+    parser.add_argument("--width", type=int, default=640, help="Ancho del JPEG de salida")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--stub-passes", type=int, default=2, help="Costo del stub por frame")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db-camera-id", type=int,
+                        help="Incluye AlertManager.save_detection contra la BD configurada (cámara existente)")
+    parser.add_argument("--output", help="Guarda el reporte JSON (sirve como base para --compare)")
+    parser.add_argument("--compare", help="Reporte JSON base contra el que buscar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    report = run(model=args.model, clip=args.clip, cameras=[int(n) for n in args.cameras.split(",")],
+                 frames_per_camera=args.frames, warmup=args.warmup, resolution=args.resolution,
+                 pool_size=args.pool_size, width=args.width, quality=args.quality,
+                 stub_passes=args.stub_passes, seed=args.seed, db_camera_id=args.db_camera_id)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nReporte guardado en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESIONES (tolerancia {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\nSin regresiones respecto a {args.compare} (tolerancia {args.tolerance:.0%})")
@@ -0,0 +1,106 @@
+"""
+Modelo stub con la interfaz de ultralytics (model(frame) -> results con boxes y speed)
+Hace trabajo real de CPU (letterbox a 640, filtros y componentes conexas) y devuelve
+detecciones deterministas según el contenido del frame: sirve para medir el resto del
+pipeline en CI sin torch ni best.pt
+"""
+import time
+
+import cv2
+import numpy as np
+
+# Clases con los mismos nombres que el modelo entrenado
+STUB_NAMES = {
+    0: 'Hardhat', 1: 'NO-Hardhat',
+    2: 'Safety Vest', 3: 'NO-Safety Vest',
+    4: 'Gloves', 5: 'NO-Gloves',
+    6: 'Goggles', 7: 'NO-Goggles',
+    8: 'shoes', 9: 'no_shoes',
+    10: 'Person',
+}
+
+INPUT_SIZE = 640
+MAX_DETECTIONS = 20
+
+
+class _Tensor:
+    """Arreglo con .cpu()/.numpy() e indexado como los tensores de torch"""
+
+    def __init__(self, data):
+        self._data = np.asarray(data)
+
+    def __getitem__(self, index):
+        return _Tensor(self._data[index])
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._data
+
+
+class _Box:
+    def __init__(self, xyxy, conf: float, cls: int):
+        self.xyxy = _Tensor([xyxy])
+        self.conf = _Tensor([conf])
+        self.cls = _Tensor([cls])
+
+
+class _Result:
+    def __init__(self, boxes, speed):
+        self.boxes = boxes
+        self.speed = speed
+
+
+class StubYOLO:
+    def __init__(self, passes: int = 2):
+        """
+        Modelo stub determinista
+
+        Args:
+            passes: Repeticiones del filtro de "inferencia" (ajusta el costo por frame)
+        """
+        self.names = dict(STUB_NAMES)
+        self.passes = max(1, passes)
+
+    def __call__(self, frame, conf: float = 0.25, iou: float = 0.45, verbose: bool = False):
+        t0 = time.perf_counter()
+
+        # Preprocess: letterbox a 640x640 y normalización como YOLO
+        height, width = frame.shape[:2]
+        scale = INPUT_SIZE / max(height, width)
+        resized = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+        canvas = np.full((INPUT_SIZE, INPUT_SIZE, 3), 114, dtype=np.uint8)
+        canvas[:resized.shape[0], :resized.shape[1]] = resized
+        tensor = canvas.astype(np.float32) / 255.0
+        t1 = time.perf_counter()
+
+        # "Inferencia": filtros sobre la imagen completa y umbral de regiones claras
+        gray = cv2.cvtColor(tensor, cv2.COLOR_BGR2GRAY)
+        for _ in range(self.passes):
+            gray = cv2.GaussianBlur(gray, (9, 9), 0)
+            edges = cv2.Sobel(gray, cv2.CV_32F, 1, 1, ksize=3)
+        mask = ((gray > 0.6) | (np.abs(edges) > 0.5)).astype(np.uint8)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        t2 = time.perf_counter()
+
+        # Postprocess: regiones a cajas en coordenadas del frame original
+        boxes = []
+        order = np.argsort(-stats[1:, cv2.CC_STAT_AREA])[:MAX_DETECTIONS] + 1 if count > 1 else []
+        for label in order:
+            x, y, w, h, area = stats[label]
+            if area < 64:
+                continue
+            score = min(0.99, 0.3 + area / (w * h) * 0.6)
+            if score < conf:
+                continue
+            cls = int(x * 7 + y * 13 + area) % len(self.names)
+            boxes.append(_Box([x / scale, y / scale, (x + w) / scale, (y + h) / scale], score, cls))
+        t3 = time.perf_counter()
+
+        speed = {
+            'preprocess': (t1 - t0) * 1000,
+            'inference': (t2 - t1) * 1000,
+            'postprocess': (t3 - t2) * 1000,
+        }
+        return [_Result(boxes, speed)]
@@ -1,9 +1,7 @@
 """
-Script para inicializar la base de datos MySQL
+Script para inicializar la base de datos (MySQL, o SQLite con DATABASE_URL=sqlite:///...)
 Ejecutar: python init_db.py
 """
-import mysql.connector
-from mysql.connector import Error
 import os
 from dotenv import load_dotenv
 
@@ -14,9 +12,16 @@ DB_PORT = int(os.getenv("DB_PORT", "3306"))
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 DB_NAME = os.getenv("DB_NAME", "vision_epp")
+DATABASE_URL = os.getenv("DATABASE_URL", "")
 
 def create_database():
     """Crea la base de datos si no existe"""
+    if DATABASE_URL:
+        # SQLite crea el archivo al conectar; otra URL apunta a una base ya creada
+        return True
+    
+    import mysql.connector
+    from mysql.connector import Error
     try:
         # Conectar sin especificar base de datos
         connection = mysql.connector.connect(
@@ -69,9 +74,13 @@ if __name__ == "__main__":
     print("🗄️  INICIALIZACIÓN DE BASE DE DATOS - EPPVISION")
     print("=" * 60)
     print(f"\n📍 Configuración:")
-    print(f"   Host: {DB_HOST}:{DB_PORT}")
-    print(f"   Usuario: {DB_USER}")
-    print(f"   Base de datos: {DB_NAME}\n")
+    if DATABASE_URL:
+        from sqlalchemy.engine import make_url
+        print(f"   URL: {make_url(DATABASE_URL).render_as_string(hide_password=True)}\n")
+    else:
+        print(f"   Host: {DB_HOST}:{DB_PORT}")
+        print(f"   Usuario: {DB_USER}")
+        print(f"   Base de datos: {DB_NAME}\n")
     
     # Paso 1: Crear base de datos
     if create_database():